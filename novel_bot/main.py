@@ -10,12 +10,18 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from src.plugins.ai_chat_system.services.initialization import initialize_system
 from src.plugins.ai_chat_system.scheduler import scheduler
+from src.plugins.ai_chat_system.database.session import shutdown_database
+from src.plugins.ai_chat_system.services.token_usage import token_usage_recorder
+from src.plugins.ai_chat_system.services.task_manager import task_registry
+from src.plugins.ai_chat_system.services.job_executor import job_executor
+from src.plugins.ai_chat_system.services.connection_manager import manager as connection_manager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Application is starting up...")
     try:
         await initialize_system()
+        await job_executor.start()
         scheduler.start()
         print("Scheduler started.")
     except Exception as e:
@@ -28,6 +34,11 @@ async def lifespan(app: FastAPI):
     if scheduler.running:
         scheduler.shutdown()
         print("Scheduler shut down.")
+    await job_executor.shutdown()
+    await token_usage_recorder.flush()
+    await task_registry.flush()
+    await connection_manager.close_backplane()
+    await shutdown_database()
 
 app = FastAPI(title="MyNovelBot API", lifespan=lifespan)
 
@@ -1,12 +1,9 @@
 # novel_bot/src/plugins/ai_chat_system/api_manager.py
 
-import google.generativeai as genai
-from typing import List, Dict, Any
-import asyncio
-import time
+from typing import List, Dict, Any, Iterable, Optional
 from nonebot import logger
 
-from .constants import API_KEY_COOLDOWN_DURATION
+from .key_scheduler import KeyScheduler
 
 class ApiManager:
     def __init__(self, api_keys: List[Dict[str, Any]] | List[str]):
@@ -24,14 +21,11 @@ class ApiManager:
             logger.trace("ApiManager: Instantiated with an empty list of API keys.")
             
         self.current_key_index = 0
-        self.key_priority_order = list(range(len(self.keys)))
         self.last_successful_key_index = 0
-        self.key_cooldowns: dict[int, float] = {}
+        # [核心重构] 用感知速率限制的调度器取代列表重排 + 固定冷却时间
+        self.scheduler = KeyScheduler(len(self.keys))
         
         self.verified_models: list[Dict[str, Any]] = [] # [核心修改] 现在存储模型详情字典
-        
-        if self.keys:
-            self.configure_key(self.current_key_index)
 
     def get_current_key(self) -> str:
         if not self.keys or not (0 <= self.current_key_index < len(self.keys)):
@@ -39,71 +33,57 @@ class ApiManager:
         return self.keys[self.current_key_index]
 
     def configure_key(self, key_index: int):
+        # [优化] 不再调用全局的 genai.configure，实际请求通过 llm_client_pool 中按 Key 隔离的客户端发出
         if not self.keys or not (0 <= key_index < len(self.keys)):
             return
         self.current_key_index = key_index
-        current_key = self.keys[self.current_key_index]
-        genai.configure(api_key=current_key)
+
+    def set_rate_limits(self, rate_limits: Optional[Dict[str, Dict[str, float]]]):
+        """按模型名前缀设置每个 Key 的 RPM/TPM 上限，例如 {"gemini-2.5-pro": {"rpm": 5, "tpm": 250000}}。"""
+        if rate_limits is not None and rate_limits != self.scheduler.rate_limits:
+            self.scheduler.rate_limits = rate_limits
+            for state in self.scheduler.states:
+                state.buckets.clear()
+
+    def acquire_key(self, model_name: str, estimated_tokens: int = 0, exclude: Iterable[int] = ()) -> Optional[int]:
+        """选出当前负载最低的可用 Key；调用结束后必须调用 release_key。"""
+        if not self.keys: return None
+        return self.scheduler.acquire(model_name, estimated_tokens, exclude)
+
+    def release_key(self, key_index: int, error: Optional[BaseException] = None, cancelled: bool = False):
+        """error 为 None 表示成功；cancelled 表示请求被主动取消（如对冲落败），不计入成败。"""
+        if not self.keys: return
+        self.scheduler.release(key_index, error, cancelled)
+        if error is None and not cancelled:
+            self.last_successful_key_index = key_index
+            self.current_key_index = key_index
     
     def report_key_success(self, key_index: int):
         if not self.keys: return
         self.last_successful_key_index = key_index
         self.current_key_index = key_index
-        if key_index in self.key_priority_order:
-            self.key_priority_order.remove(key_index)
-        self.key_priority_order.insert(0, key_index)
-        if key_index in self.key_cooldowns:
-            del self.key_cooldowns[key_index]
+        self.scheduler.report_success(key_index)
 
-    def report_key_failure(self, key_index: int):
+    def report_key_failure(self, key_index: int, error: Optional[BaseException] = None):
         if not self.keys: return
-        if key_index in self.key_priority_order:
-            self.key_priority_order.remove(key_index)
-            self.key_priority_order.append(key_index)
-        self.key_cooldowns[key_index] = time.time()
+        self.scheduler.report_failure(key_index, error)
 
     def get_prioritized_and_available_indices(self) -> List[int]:
         if not self.keys: return []
-        now = time.time()
-        return [
-            index for index in self.key_priority_order 
-            if self.key_cooldowns.get(index) is None or (now - self.key_cooldowns.get(index, 0)) > API_KEY_COOLDOWN_DURATION
-        ]
+        return self.scheduler.available_indices()
+
+    def get_key_stats(self) -> List[Dict[str, Any]]:
+        return self.scheduler.get_stats(self.keys)
 
-    async def initialize_available_models(self) -> List[Dict[str, Any]]:
+    async def initialize_available_models(self, force_refresh: bool = False) -> List[Dict[str, Any]]:
         if not self.keys:
             logger.warning("ApiManager: Cannot initialize models without any API keys.")
             return []
 
-        for i in range(len(self.keys)):
-            key_idx_to_try = (self.current_key_index + i) % len(self.keys)
-            self.configure_key(key_idx_to_try)
-            try:
-                models_iterator = await asyncio.wait_for(
-                    asyncio.to_thread(genai.list_models), timeout=20.0
-                )
-                
-                # [核心修改] 提取并格式化模型详细信息
-                all_models_from_api = sorted([
-                    {
-                        "name": m.name,
-                        "display_name": m.display_name,
-                        "description": m.description,
-                        "input_token_limit": m.input_token_limit,
-                        "output_token_limit": m.output_token_limit,
-                        "supported_generation_methods": m.supported_generation_methods,
-                    }
-                    for m in models_iterator if "generateContent" in m.supported_generation_methods
-                ], key=lambda x: x['display_name'])
-                
-                if all_models_from_api:
-                    self.verified_models = all_models_from_api
-                    self.current_key_index = key_idx_to_try
-                    logger.info(f"ApiManager: Successfully verified {len(self.verified_models)} models using Key index {key_idx_to_try}.")
-                    return self.verified_models
-            except Exception as e:
-                logger.error(f"ApiManager: Exception querying models with Key index {key_idx_to_try}: {e}")
-        
-        logger.error("ApiManager: All provided API Keys failed to find any models.")
-        self.verified_models = []
-        return []
\ No newline at end of file
+        # [优化] 相同 Key 集合的并发查询合并为一次，结果带 TTL 持久化
+        from .services.model_discovery import model_discovery
+
+        self.verified_models = await model_discovery.discover(self.keys, force_refresh=force_refresh)
+        if not self.verified_models:
+            logger.error("ApiManager: All provided API Keys failed to find any models.")
+        return self.verified_models
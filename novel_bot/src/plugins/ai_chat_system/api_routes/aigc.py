@@ -1,13 +1,13 @@
 # novel_bot/src/plugins/ai_chat_system/api_routes/aigc.py
 
-from fastapi import APIRouter, Body, HTTPException, BackgroundTasks, Depends
+from fastapi import APIRouter, Body, HTTPException
 from pydantic import BaseModel, Field
 from typing import Optional, List
 
 from ..services.drawing.image_analyzer import get_prompt_from_image
 from ..services.drawing.main_service import generate_image
 from ..services.drawing.config import AI_DRAWING_CONFIG
-from ..services.task_manager import TaskManager, get_task_manager
+from ..services.job_executor import job_executor, JobContext
 
 router = APIRouter(prefix="/aigc", tags=["AI Drawing (AIGC)"])
 
@@ -29,38 +29,36 @@ class ImageToPromptRequest(BaseModel):
     image_base64: str
     strategy: str = "gemini"
 
-async def run_generate_image_task(task_id: str, user_id: str, payload: dict, mode: str, task_manager_instance: TaskManager):
-    try:
-        await task_manager_instance.update_task_progress(task_id, 25, "上传并处理中")
-        image_url = await generate_image(payload, mode)
-        await task_manager_instance.update_task_progress(task_id, 100, "成功")
-        await task_manager_instance.update_task(task_id, "success", {"image_url": image_url})
-    except Exception as e:
-        error_detail = str(e.detail) if isinstance(e, HTTPException) else str(e)
-        await task_manager_instance.update_task(task_id, "failed", {"error": error_detail})
+async def run_generate_image_task(job: JobContext, mode: str) -> dict:
+    await job.progress(25, "上传并处理中")
+    image_url = await generate_image(job.payload["params"], mode)
+    await job.progress(100, "成功")
+    return {"image_url": image_url}
+
+@job_executor.handler("txt2img", queue="media", priority=5, max_attempts=2)
+async def run_txt2img_job(job: JobContext) -> dict:
+    return await run_generate_image_task(job, "txt2img")
+
+@job_executor.handler("img2img", queue="media", priority=5, max_attempts=2)
+async def run_img2img_job(job: JobContext) -> dict:
+    return await run_generate_image_task(job, "img2img")
 
 @router.post("/txt2img")
 async def handle_txt2img(
     payload: Txt2ImgRequest, 
-    user_id: str = Body(...), 
-    background_tasks: BackgroundTasks = BackgroundTasks(),
-    task_manager: TaskManager = Depends(get_task_manager)
+    user_id: str = Body(...)
 ):
-    """接收文生图参数，提交到后台任务队列，并立即返回任务ID。"""
-    task_id = await task_manager.create_task("txt2img", user_id)
-    background_tasks.add_task(run_generate_image_task, task_id, user_id, payload.model_dump(), "txt2img", task_manager)
+    """接收文生图参数，提交到后台作业队列，并立即返回任务ID。"""
+    task_id = await job_executor.submit("txt2img", user_id, {"params": payload.model_dump()})
     return {"status": "processing", "task_id": task_id}
 
 @router.post("/img2img")
 async def handle_img2img(
     payload: Img2ImgRequest, 
-    user_id: str = Body(...), 
-    background_tasks: BackgroundTasks = BackgroundTasks(),
-    task_manager: TaskManager = Depends(get_task_manager)
+    user_id: str = Body(...)
 ):
-    """接收图生图参数，提交到后台任务队列，并立即返回任务ID。"""
-    task_id = await task_manager.create_task("img2img", user_id)
-    background_tasks.add_task(run_generate_image_task, task_id, user_id, payload.model_dump(), "img2img", task_manager)
+    """接收图生图参数，提交到后台作业队列，并立即返回任务ID。"""
+    task_id = await job_executor.submit("img2img", user_id, {"params": payload.model_dump()})
     return {"status": "processing", "task_id": task_id}
 
 @router.post("/image-to-prompt")
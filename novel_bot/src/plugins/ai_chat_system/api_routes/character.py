@@ -7,7 +7,7 @@ import time
 from pathlib import Path
 import tempfile
 
-from fastapi import APIRouter, File, HTTPException, UploadFile, Depends, BackgroundTasks
+from fastapi import APIRouter, File, HTTPException, UploadFile, Depends
 from nonebot import logger
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -16,14 +16,19 @@ from sqlalchemy.orm.attributes import flag_modified
 from .. import global_state
 from ..database.session import get_db_session, DBSession
 from ..database.models import ContentItem
-from ..services.task_manager import TaskManager, get_task_manager
+from ..services.job_executor import job_executor, JobContext, JobError
 from ..services.connection_manager import broadcast_status_update
 from ..services.data_persistence import _USER_DATA_PATH
+from ..services.content_versions import bump_item_version
 
 router = APIRouter(prefix="/character", tags=["Character Management"])
 
-async def _run_upload_task(task_id: str, user_id: str, filename: str, temp_file_path: str, original_filename: str, task_manager_instance: TaskManager):
-    temp_path = Path(temp_file_path)
+@job_executor.handler("upload_character_image", queue="interactive", priority=0, max_attempts=1)
+async def _run_upload_task(job: JobContext) -> dict:
+    task_id, user_id = job.task_id, job.user_id
+    filename = job.payload["filename"]
+    original_filename = job.payload["original_filename"]
+    temp_path = Path(job.payload["temp_file_path"])
     
     user_specific_dir = _USER_DATA_PATH / user_id
     image_dir = user_specific_dir / "character_images"
@@ -32,7 +37,7 @@ async def _run_upload_task(task_id: str, user_id: str, filename: str, temp_file_
     
     async for db in get_db_session():
         try:
-            await task_manager_instance.update_task_progress(task_id, 25, "上传文件中")
+            await job.progress(25, "上传文件中")
             
             image_dir.mkdir(parents=True, exist_ok=True)
             
@@ -42,7 +47,7 @@ async def _run_upload_task(task_id: str, user_id: str, filename: str, temp_file_
             
             shutil.move(temp_path, image_path)
             
-            await task_manager_instance.update_task_progress(task_id, 75, "更新数据库")
+            await job.progress(75, "更新数据库")
             
             image_url = f"/api/{user_id}/character_images/{image_filename}"
             logger.info(f"[DIAG][Task:{task_id}] Generated image URL: {image_url}")
@@ -80,37 +85,35 @@ async def _run_upload_task(task_id: str, user_id: str, filename: str, temp_file_
             
             logger.info(f"[DIAG][Task:{task_id}] Staged change for DB commit. New image URL: {item.data['image']}")
             await db.commit()
+            bump_item_version(user_id, 'character', filename)
             logger.info(f"[DIAG][Task:{task_id}] DB commit successful.")
             
             await broadcast_status_update({
                 "event": "update", "dataType": "character", "filename": filename
-            }, "data_update")
+            }, "data_update", user_id=user_id)
             
             logger.info(f"成功更新角色 '{filename}' 的图片URL到数据库: {image_url}")
 
-            await task_manager_instance.update_task_progress(task_id, 100, "成功")
+            await job.progress(100, "成功")
             
             success_payload = {"image_url": image_url, "filename": filename}
             logger.info(f"[DIAG][Task:{task_id}] Updating task to 'success' with payload: {success_payload}")
-            await task_manager_instance.update_task(task_id, "success", success_payload)
 
         except Exception as e:
             await db.rollback()
             logger.error(f"[DIAG][Task:{task_id}] An error occurred, rolling back DB transaction.")
             logger.error(f"为角色 '{filename}' 上传图片失败: {e}", exc_info=True)
-            error_detail = str(e)
-            await task_manager_instance.update_task(task_id, "failed", {"error": error_detail})
+            raise JobError(str(e)) from e
         finally:
             if temp_path.exists():
                 temp_path.unlink()
+    return success_payload
 
 @router.post("/{user_id}/{filename}/image")
 async def upload_character_image(
     user_id: str,
     filename: str,
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    task_manager: TaskManager = Depends(get_task_manager)
+    file: UploadFile = File(...)
 ):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="请上传图片文件。")
@@ -122,8 +125,8 @@ async def upload_character_image(
     finally:
         await file.close()
 
-    task_id = await task_manager.create_task("upload_character_image", user_id)
-    
-    background_tasks.add_task(_run_upload_task, task_id, user_id, filename, temp_file_path, file.filename, task_manager)
+    task_id = await job_executor.submit("upload_character_image", user_id, {
+        "filename": filename, "temp_file_path": temp_file_path, "original_filename": file.filename,
+    })
 
     return {"status": "processing", "task_id": task_id}
\ No newline at end of file
@@ -3,8 +3,11 @@
 from fastapi import APIRouter, Body, HTTPException, Depends
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Literal
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..database.session import DBSession
 from ..services.community_service import CommunityService, get_community_service
+from ..services.data_persistence import bulk_upsert_content_items
 from .. import global_state
 
 router = APIRouter(prefix="/community", tags=["Community Hub"])
@@ -69,7 +72,8 @@ async def browse_content(
 async def import_content(
     item_id: int,
     payload: Dict[str, str] = Body(...),
-    service: CommunityService = Depends(get_community_service)
+    service: CommunityService = Depends(get_community_service),
+    db: AsyncSession = DBSession
 ):
     """
     用户从社区导入内容到自己的私有数据中。
@@ -86,20 +90,19 @@ async def import_content(
         if not item:
             raise HTTPException(status_code=404, detail="Content not found.")
         
-        # 调用 DataManager 保存数据
-        save_result = global_state.data_manager.save_user_data(
-            user_id=user_id,
-            data_type=item['data_type'],
-            name=item['name'],
-            data=item['data']
+        # 与批量导入共用同一条 upsert 写入路径
+        [save_result] = await bulk_upsert_content_items(
+            db, user_id, [{"data_type": item['data_type'], "filename": item['name'], "data": item['data']}]
         )
 
-        if save_result["success"]:
+        if save_result["status"] in ("inserted", "updated"):
             # 导入成功后，增加下载计数
             await service.increment_download_count(item_id)
             return {"status": "success", "message": f"'{item['name']}' 已成功导入！", "filename": save_result["filename"]}
         else:
             raise HTTPException(status_code=500, detail=save_result.get("error", "保存导入数据时失败。"))
-            
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"导入失败: {e}")
\ No newline at end of file
@@ -2,21 +2,32 @@
 
 from fastapi import APIRouter, Body, HTTPException, Query, Request, Response
 from typing import Dict, List, Optional
-import hashlib
-import json
-import time
-from sqlalchemy import select, func, or_
+from sqlalchemy import select, func, or_, and_
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import global_state
 from ..services.connection_manager import broadcast_status_update
 from ..database.session import DBSession
-from ..database.models import User, ContentItem
-from ..services.data_persistence import save_content_item_to_db, delete_content_item_from_db, rename_content_item_in_db
+from ..database.models import ContentItem, ContentDisplayRank
+from ..services.content_versions import get_collection_version, make_etag, not_modified_response
+from ..services.search_index import build_search_subquery
+from ..services.data_persistence import (
+    save_content_item_to_db, delete_content_item_from_db, rename_content_item_in_db, bulk_upsert_content_items
+)
 
 router = APIRouter(tags=["Data CRUD"])
 
+# 单次批量写入的条目数上限
+MAX_BATCH_ITEMS = 1000
+
+# sort_by 取值到冗余列的映射；其它取值回退为按 data 中的同名字段排序
+_SORT_COLUMNS = {
+    "name": func.coalesce(ContentItem.name, ContentItem.filename),
+    "displayName": func.coalesce(ContentItem.display_name, ContentItem.filename),
+    "filename": ContentItem.filename,
+}
+
 @router.get("/data/{user_id}/{data_type}")
 async def get_paginated_data(
     request: Request,
@@ -38,66 +49,80 @@ async def get_paginated_data(
     is_persona_request = data_type == "persona"
     actual_data_type = "character" if is_persona_request else data_type
 
-    query = select(ContentItem).where(
-        ContentItem.data_type == actual_data_type,
-        or_(ContentItem.owner_id == user_id, ContentItem.owner_id.is_(None))
+    # [优化] ETag 只由版本号与查询参数决定，命中时在查询数据库之前直接返回 304
+    current_etag = make_etag(
+        "data", user_id, data_type,
+        get_collection_version(user_id, actual_data_type), get_collection_version(None, actual_data_type),
+        get_collection_version(user_id, "config"), page, limit, sort_by, search
     )
-    
-    if is_persona_request:
-        query = query.where(ContentItem.data['is_user_persona'].as_boolean() == True)
-    else:
-        query = query.where(ContentItem.data['is_user_persona'].as_boolean().isnot(True))
+    not_modified = not_modified_response(request, response, current_etag)
+    if not_modified is not None:
+        return not_modified
 
-    if search:
+    filters = [
+        ContentItem.data_type == actual_data_type,
+        or_(ContentItem.owner_id == user_id, ContentItem.owner_id.is_(None)),
+        ContentItem.is_user_persona.is_(True) if is_persona_request else ContentItem.is_user_persona.isnot(True),
+    ]
+
+    # [优化] 优先使用全文索引（按相关度排序）；索引不可用或查询中没有可检索的词时退回 LIKE
+    search_subquery = build_search_subquery(db.get_bind().dialect.name, search) if search else None
+    if search and search_subquery is None:
         search_lower = f"%{search.lower()}%"
-        query = query.where(
+        filters.append(
             or_(
-                ContentItem.data['displayName'].as_string().ilike(search_lower),
-                ContentItem.data['name'].as_string().ilike(search_lower),
+                ContentItem.display_name.ilike(search_lower),
+                ContentItem.name.ilike(search_lower),
                 ContentItem.data['description'].as_string().ilike(search_lower)
             )
         )
-        
-    count_query = select(func.count()).select_from(query.alias())
-    total_items_result = await db.execute(count_query)
-    total_items = total_items_result.scalar_one()
-    
-    full_result = await db.execute(query)
-    all_items = full_result.scalars().all()
-
-    items = []
-    for item in all_items:
-        item_data = item.data
-        item_data['filename'] = item.filename
-        item_data['is_private'] = item.owner_id == user_id
-        item_data['owner_id'] = item.owner_id
-        items.append(item_data)
-        
-    user_config_result = await db.execute(select(User.display_order).where(User.user_id == user_id))
-    display_order_dict = user_config_result.scalar_one_or_none() or {}
-    
+
+    count_query = select(func.count(ContentItem.id)).where(*filters)
+    if search_subquery is not None:
+        count_query = count_query.join(search_subquery, search_subquery.c.item_id == ContentItem.id)
+    total_items = (await db.execute(count_query)).scalar_one()
+
+    # [优化] 排序与分页在数据库中完成：用户自定义顺序（content_display_ranks）优先，
+    # 其余条目私有在前，再按 sort_by 排序；只取当前页的行。
     display_order_key = "personas" if is_persona_request else f"{actual_data_type}s"
-    order = display_order_dict.get(display_order_key, [])
-    
-    if order:
-        order_map = {filename: i for i, filename in enumerate(order)}
-        items.sort(key=lambda x: order_map.get(x['filename'], float('inf')))
-    else:
-        items.sort(key=lambda x: (not x['is_private'], x.get(sort_by, x['filename'])))
+    rank_join = and_(
+        ContentDisplayRank.owner_id == user_id,
+        ContentDisplayRank.list_key == display_order_key,
+        ContentDisplayRank.filename == ContentItem.filename,
+    )
+    sort_column = _SORT_COLUMNS.get(sort_by)
+    if sort_column is None:
+        sort_column = func.coalesce(ContentItem.data[sort_by].as_string(), ContentItem.filename)
+
+    order_by = [
+        ContentDisplayRank.rank.is_(None),
+        ContentDisplayRank.rank,
+        ContentItem.owner_id.is_(None),
+        sort_column,
+        ContentItem.filename,
+        ContentItem.id,
+    ]
+    query = select(ContentItem)
+    if search_subquery is not None:
+        # 搜索时相关度优先于用户自定义顺序
+        query = query.join(search_subquery, search_subquery.c.item_id == ContentItem.id)
+        order_by.insert(0, search_subquery.c.score)
+    query = (
+        query
+        .outerjoin(ContentDisplayRank, rank_join)
+        .where(*filters)
+        .order_by(*order_by)
+        .offset((page - 1) * limit)
+        .limit(limit)
+    )
+    page_items = (await db.execute(query)).scalars().all()
 
+    paginated_items = [
+        {**item.data, "filename": item.filename, "is_private": item.owner_id == user_id, "owner_id": item.owner_id}
+        for item in page_items
+    ]
     total_pages = (total_items + limit - 1) // limit if limit > 0 else 1
-    start = (page - 1) * limit
-    end = start + limit
-    paginated_items = items[start:end]
-    
-    content_json = json.dumps(paginated_items, sort_keys=True).encode('utf-8')
-    unique_content = content_json + str(time.time()).encode('utf-8')
-    current_etag = f'"{hashlib.md5(unique_content).hexdigest()}"'
     
-    if request.headers.get('if-none-match') == current_etag:
-        return Response(status_code=304)
-        
-    response.headers["ETag"] = current_etag
 
     return {
         "items": paginated_items,
@@ -107,6 +132,36 @@ async def get_paginated_data(
     }
 
 
+@router.post("/data/{user_id}/batch")
+async def batch_upsert_data(user_id: str, payload: Dict = Body(...), db: AsyncSession = DBSession):
+    """
+    批量创建或覆盖私有条目。payload: {"items": [{"data_type", "filename", "data"}], "overwrite": true}
+    所有条目在一个事务中写入，结果按 items 的顺序逐项返回。
+    """
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="'items' must be a non-empty list.")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} items per batch.")
+    if not all(isinstance(item, dict) for item in items):
+        raise HTTPException(status_code=400, detail="Every item must be an object.")
+
+    results = await bulk_upsert_content_items(db, user_id, items, overwrite=bool(payload.get("overwrite", True)))
+
+    changed = [result for result in results if result["status"] in ("inserted", "updated")]
+    for data_type in sorted({result["data_type"] for result in changed}):
+        await broadcast_status_update({
+            "event": "batch_update",
+            "dataType": data_type,
+            "filenames": [result["filename"] for result in changed if result["data_type"] == data_type],
+        }, "data_update", user_id=user_id)
+
+    counts = {status: 0 for status in ("inserted", "updated", "skipped", "failed")}
+    for result in results:
+        counts[result["status"]] += 1
+    return {"status": "success" if not counts["failed"] else "partial", **counts, "results": results}
+
+
 @router.post("/data/{user_id}/{data_type}/{name}")
 async def create_or_update_data(
     user_id: str, data_type: str, name: str, data: Dict = Body(...), db: AsyncSession = DBSession
@@ -126,7 +181,7 @@ async def create_or_update_data(
             "event": "update",
             "dataType": data_type,
             "filename": save_result.get("filename")
-        }, "data_update")
+        }, "data_update", user_id=user_id)
         return {
             "status": "success",
             "message": f"{data_type.capitalize()} '{name}' saved.",
@@ -149,7 +204,7 @@ async def delete_data(user_id: str, data_type: str, name: str, db: AsyncSession
             "event": "delete",
             "dataType": data_type,
             "filename": name
-        }, "data_update")
+        }, "data_update", user_id=user_id)
         return {"status": "success", "message": result_message}
     else:
         raise HTTPException(status_code=404, detail=result_message)
@@ -172,7 +227,7 @@ async def rename_data(user_id: str, data_type: str, old_name: str, payload: Dict
             "dataType": data_type,
             "oldFilename": old_name,
             "newFilename": new_name
-        }, "data_update")
+        }, "data_update", user_id=user_id)
         return {"status": "success", "message": result}
     else:
         if "已被占用" in result:
@@ -1,28 +1,40 @@
 import json
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import zipfile
 from io import BytesIO
 from pathlib import Path
 import tempfile
 import os
+import uuid
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
 from fastapi.responses import FileResponse
 from nonebot import logger
 
 from .. import global_state
+from ..database import session as db_session
+from ..services.data_persistence import bulk_upsert_content_items
 from ..services.task_manager import TaskManager, get_task_manager
+from ..services.job_executor import job_executor, JobContext, JobError
 
 router = APIRouter(prefix="/data", tags=["Data Import/Export"])
 
-async def run_export_task(task_id: str, user_id: str, task_manager_instance: TaskManager):
+def _write_export_zip(zip_path: str, files: List[Tuple[str, str]]):
+    """在进程池中执行：把 (源文件, 压缩包内路径) 列表打包为 zip。"""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for source, arcname in files:
+            zf.write(source, arcname=arcname)
+
+
+@job_executor.handler("export_data", queue="bulk", priority=20, max_attempts=2)
+async def run_export_task(job: JobContext) -> dict:
+    task_id, user_id = job.task_id, job.user_id
     dm = global_state.data_manager
     if not dm:
-        await task_manager_instance.update_task(task_id, "failed", {"error": "DataManager not initialized."})
-        return
+        raise JobError("DataManager not initialized.")
 
     try:
-        await task_manager_instance.update_task_progress(task_id, 10, "初始化导出...")
+        await job.progress(10, "初始化导出...")
 
         temp_dir = Path(tempfile.gettempdir()) / "mynovelbot_exports"
         temp_dir.mkdir(exist_ok=True)
@@ -30,46 +42,34 @@ async def run_export_task(task_id: str, user_id: str, task_manager_instance: Tas
 
         data_types_to_export = ["character", "preset", "world_info", "group"]
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            processed_count = 0
-            total_count = len(data_types_to_export)
-
-            for data_type in data_types_to_export:
-                await task_manager_instance.update_task_progress(
-                    task_id, 
-                    10 + int((processed_count / total_count) * 80), 
-                    f"正在打包 {data_type}..."
-                )
-                
-                user_data_path = dm._get_user_data_path(user_id, data_type)
-                if user_data_path.exists():
-                    for json_file in user_data_path.glob("*.json"):
-                        zf.write(json_file, arcname=f"{data_type}s/{json_file.name}")
-                
-                processed_count += 1
+        files = []
+        for processed_count, data_type in enumerate(data_types_to_export):
+            await job.progress(
+                10 + int((processed_count / len(data_types_to_export)) * 30),
+                f"正在收集 {data_type}..."
+            )
+            
+            user_data_path = dm._get_user_data_path(user_id, data_type)
+            if user_data_path.exists():
+                files.extend((str(json_file), f"{data_type}s/{json_file.name}") for json_file in user_data_path.glob("*.json"))
+
+        # [优化] 压缩在进程池中完成，不占用事件循环
+        await job.progress(40, f"正在打包 {len(files)} 个文件...")
+        await job.run_cpu(_write_export_zip, str(zip_path), files)
         
         download_url = f"/api/data/download/{task_id}"
-        await task_manager_instance.update_task_progress(task_id, 100, "打包完成")
-        await task_manager_instance.update_task(
-            task_id, 
-            "success", 
-            {"message": "数据打包完成，可以下载。", "download_url": download_url}
-        )
+        await job.progress(100, "打包完成")
         logger.info(f"Data export task {task_id} for user {user_id} completed successfully.")
+        return {"message": "数据打包完成，可以下载。", "download_url": download_url}
 
     except Exception as e:
         logger.error(f"Failed to export data for user {user_id}: {e}", exc_info=True)
-        await task_manager_instance.update_task(task_id, "failed", {"error": f"导出处理失败: {str(e)}"})
+        raise RuntimeError(f"导出处理失败: {str(e)}") from e
 
 
 @router.post("/export/{user_id}")
-async def export_all_user_data(
-    user_id: str, 
-    background_tasks: BackgroundTasks,
-    task_manager: TaskManager = Depends(get_task_manager)
-):
-    task_id = await task_manager.create_task("export_data", user_id)
-    background_tasks.add_task(run_export_task, task_id, user_id, task_manager)
+async def export_all_user_data(user_id: str):
+    task_id = await job_executor.submit("export_data", user_id)
     return {"status": "processing", "task_id": task_id}
 
 
@@ -98,18 +98,21 @@ async def download_exported_data(
     )
 
 
-async def run_import_task(task_id: str, user_id: str, file_content: bytes, task_manager_instance: TaskManager):
+@job_executor.handler("import_data", queue="bulk", priority=20, max_attempts=1)
+async def run_import_task(job: JobContext) -> dict:
+    user_id = job.user_id
+    upload_path = Path(job.payload["upload_path"])
     dm = global_state.data_manager
     if not dm:
-        await task_manager_instance.update_task(task_id, "failed", {"error": "DataManager not initialized."})
-        return
+        raise JobError("DataManager not initialized.")
 
     try:
-        await task_manager_instance.update_task_progress(task_id, 20, "解析文件中")
-        import_data = json.loads(file_content)
+        await job.progress(20, "解析文件中")
+        import_data = json.loads(upload_path.read_bytes())
     except json.JSONDecodeError:
-        await task_manager_instance.update_task(task_id, "failed", {"error": "解析JSON失败，文件可能已损坏。"})
-        return
+        raise JobError("解析JSON失败，文件可能已损坏。")
+    finally:
+        upload_path.unlink(missing_ok=True)
     
     report = {
         "characters": {"imported": 0, "skipped": 0},
@@ -122,46 +125,53 @@ async def run_import_task(task_id: str, user_id: str, file_content: bytes, task_
         "world_info": "world_info", "groups": "group",
     }
     
-    total_items = sum(len(import_data.get(key, [])) for key in data_map.keys())
-    processed_items = 0
-
     try:
+        items = []
         for data_key, data_type in data_map.items():
-            if data_key in import_data:
-                current_data = dm.get_available_data(user_id, data_type)
-                for name, data in import_data[data_key].items():
-                    if name not in current_data:
-                        data['is_private'] = True
-                        dm.save_user_data(user_id, data_type, name, data, is_editing=False)
-                        report[data_key]["imported"] += 1
-                    else:
-                        report[data_key]["skipped"] += 1
-                    
-                    processed_items += 1
-                    progress = 20 + int((processed_items / total_items) * 75) if total_items > 0 else 95
-                    await task_manager_instance.update_task_progress(task_id, progress, f"正在处理 {data_type}...")
-
-        await task_manager_instance.update_task_progress(task_id, 100, "完成")
-        await task_manager_instance.update_task(task_id, "success", {"report": report})
+            for name, data in (import_data.get(data_key) or {}).items():
+                if isinstance(data, dict):
+                    data['is_private'] = True
+                items.append({"data_type": data_type, "filename": name, "data": data})
+
+        # [优化] 所有条目通过一次批量 upsert 写入（已存在的同名条目跳过），整个导入只提交一次
+        await job.progress(40, f"正在写入 {len(items)} 个条目...")
+        async with db_session.AsyncSessionLocal() as db:
+            results = await bulk_upsert_content_items(db, user_id, items, overwrite=False)
+
+        data_key_of = {data_type: data_key for data_key, data_type in data_map.items()}
+        for result in results:
+            bucket = report[data_key_of[result["data_type"]]]
+            if result["status"] == "inserted":
+                bucket["imported"] += 1
+            else:
+                bucket["skipped"] += 1
+        failures = [result for result in results if result["status"] == "failed"]
+        if failures:
+            logger.warning(f"Import for user {user_id}: {len(failures)} items failed, first error: {failures[0].get('error')}")
+
+        await job.progress(100, "完成")
+        return {"report": report, "items": results}
 
     except Exception as e:
         logger.error(f"Failed to import data for user {user_id}: {e}", exc_info=True)
-        await task_manager_instance.update_task(task_id, "failed", {"error": f"导入处理失败: {str(e)}"})
+        raise JobError(f"导入处理失败: {str(e)}") from e
 
 
 @router.post("/import/{user_id}")
 async def import_all_user_data(
     user_id: str, 
-    background_tasks: BackgroundTasks, 
-    file: UploadFile = File(...),
-    task_manager: TaskManager = Depends(get_task_manager)
+    file: UploadFile = File(...)
 ):
     if not file.filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .json file.")
 
     content = await file.read()
+    # 作业入参需要可持久化（重启后恢复），上传内容先写入临时文件
+    upload_dir = Path(tempfile.gettempdir()) / "mynovelbot_imports"
+    upload_dir.mkdir(exist_ok=True)
+    upload_path = upload_dir / f"{uuid.uuid4().hex}.json"
+    upload_path.write_bytes(content)
     
-    task_id = await task_manager.create_task("import_data", user_id)
-    background_tasks.add_task(run_import_task, task_id, user_id, content, task_manager)
+    task_id = await job_executor.submit("import_data", user_id, {"upload_path": str(upload_path)})
 
     return {"status": "processing", "task_id": task_id}
\ No newline at end of file
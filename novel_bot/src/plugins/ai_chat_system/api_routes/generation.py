@@ -1,6 +1,5 @@
 # novel_bot/src/plugins/ai_chat_system/api_routes/generation.py
 
-import json
 import logging
 from typing import Any, Dict
 
@@ -13,6 +12,7 @@ from nonebot.adapters.onebot.v11.event import Sender
 from .. import generators, global_state
 from ..generation_pipeline import perform_message_action_generation
 from ..prompt_builder import build_system_prompt
+from ..utils.stream_coalescer import coalesce_chunks, sse_frame
 
 logger = logging.getLogger("nonebot")
 
@@ -32,7 +32,8 @@ async def handle_generate_character(payload: Dict[str, Any] = Body(...)):
             prompt=prompt, 
             user_id=user_id, 
             selected_presets=selected_presets,
-            selected_worlds=selected_worlds
+            selected_worlds=selected_worlds,
+            use_cache=payload.get("use_cache", True)
         )
         return {"status": "success", "data": generated_data}
     except Exception as e:
@@ -53,7 +54,8 @@ async def handle_generate_world_info(payload: Dict[str, Any] = Body(...)):
             prompt=prompt, 
             user_id=user_id,
             selected_presets=selected_presets,
-            selected_worlds=selected_worlds
+            selected_worlds=selected_worlds,
+            use_cache=payload.get("use_cache", True)
         )
         return {"status": "success", "data": generated_data}
     except Exception as e:
@@ -70,7 +72,7 @@ async def handle_extract_memory(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(status_code=400, detail="user_id and history are required.")
 
     try:
-        extracted_memories = await generators.generate_memory_from_history(user_id, history)
+        extracted_memories = await generators.generate_memory_from_history(user_id, history, use_cache=payload.get("use_cache", True))
         return {"status": "success", "data": extracted_memories}
     except Exception as e:
         logger.error(f"Failed to extract memory: {e}", exc_info=True)
@@ -85,7 +87,7 @@ async def handle_weave_story(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(status_code=400, detail="Prompt and user_id are required.")
     
     try:
-        story_package = await generators.generate_story_package_from_prompt(prompt, user_id)
+        story_package = await generators.generate_story_package_from_prompt(prompt, user_id, use_cache=payload.get("use_cache", True))
         return {"status": "success", "data": story_package}
     except Exception as e:
         logger.error(f"Failed to weave story package: {e}", exc_info=True)
@@ -103,12 +105,13 @@ async def handle_message_action(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(status_code=400, detail="Missing required fields for message action.")
 
     async def stream_generator():
+        # [优化] 合并细碎的文本块后再下发，显著减少 SSE 帧数和序列化次数
         try:
-            async for chunk in perform_message_action_generation(user_id, action, history, target_message):
-                yield f"data: {json.dumps(chunk)}\n\n"
+            async for chunk in coalesce_chunks(perform_message_action_generation(user_id, action, history, target_message)):
+                yield sse_frame(chunk)
         except Exception as e:
             error_payload = {"type": "error", "payload": {"code": "PIPELINE_ERROR", "message": f"处理消息操作时发生错误: {e}"}}
-            yield f"data: {json.dumps(error_payload)}\n\n"
+            yield sse_frame(error_payload)
 
     return StreamingResponse(stream_generator(), media_type="text/event-stream")
 
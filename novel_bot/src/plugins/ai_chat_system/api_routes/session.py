@@ -1,16 +1,25 @@
-from fastapi import APIRouter, HTTPException, Body, Depends
-from typing import List, Dict, Any
+from fastapi import APIRouter, HTTPException, Body, Depends, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Optional
+from pydantic import BaseModel
 
 from .. import global_state
 from .. import generators
 from ..database.session import DBSession
+from ..services.content_versions import get_collection_version, make_etag, not_modified_response
+from ..session_manager import SessionVersionConflict
+from ..utils.stream_coalescer import dumps_bytes
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(tags=["Session Management"])
 
 @router.get("/sessions/{user_id}/{char_filename}")
-async def get_sessions_for_character(user_id: str, char_filename: str, db: AsyncSession = DBSession):
+async def get_sessions_for_character(user_id: str, char_filename: str, request: Request, response: Response, db: AsyncSession = DBSession):
     if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    etag = make_etag("sessions", user_id, char_filename, get_collection_version(user_id, "sessions"))
+    not_modified = not_modified_response(request, response, etag)
+    if not_modified is not None:
+        return not_modified
     sessions = await global_state.session_manager.get_sessions_for_character(user_id, char_filename, db)
     return sessions
 
@@ -21,19 +30,108 @@ async def create_new_session_for_character(user_id: str, char_filename: str, db:
     if new_session: return new_session
     raise HTTPException(status_code=500, detail="Failed to create new session.")
 
+class AppendMessagesRequest(BaseModel):
+    messages: List[Dict[str, Any]]
+    expected_version: Optional[int] = None
+
+class PatchMessagesRequest(BaseModel):
+    # 键为消息的 seq，值为要修改的字段（role / content / tokenUsage）
+    patches: Dict[int, Dict[str, Any]] = {}
+    truncate_after: Optional[int] = None
+    expected_version: Optional[int] = None
+
+def _version_response(version: Optional[int], message: str) -> Dict[str, Any]:
+    if version is None:
+        raise HTTPException(status_code=404, detail="Session not found or failed to update history.")
+    return {"status": "success", "message": message, "version": version}
+
 @router.get("/history/{user_id}/{session_id}")
-async def get_session_history_by_id(user_id: str, session_id: str, db: AsyncSession = DBSession):
+async def get_session_history_by_id(user_id: str, session_id: str, request: Request, response: Response, db: AsyncSession = DBSession):
     if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    # 会话版本号在每次写入历史时递增，先用它判断缓存是否有效，命中时不读取任何消息
+    version = await global_state.session_manager.get_session_version(user_id, session_id, db)
+    if version is not None:
+        response.headers["X-Session-Version"] = str(version)
+        not_modified = not_modified_response(request, response, make_etag("history", session_id, version))
+        if not_modified is not None:
+            return not_modified
     history = await global_state.session_manager.get_session_history(user_id, session_id, db)
-    if history is not None: return history
+    if history is not None:
+        return history
     raise HTTPException(status_code=404, detail="Session history not found.")
 
+@router.get("/history/{user_id}/{session_id}/page")
+async def get_session_history_page(
+    user_id: str, session_id: str, request: Request, response: Response,
+    before: Optional[int] = None, limit: int = Query(50, ge=1, le=200), db: AsyncSession = DBSession
+):
+    """最新的消息在最后一页；滚动加载更早的消息时把 next_cursor 作为 before 传回。"""
+    if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    version = await global_state.session_manager.get_session_version(user_id, session_id, db)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    response.headers["X-Session-Version"] = str(version)
+    etag = make_etag("history_page", session_id, version, before, limit)
+    not_modified = not_modified_response(request, response, etag)
+    if not_modified is not None:
+        return not_modified
+    return await global_state.session_manager.get_session_history_page(user_id, session_id, db, before, limit)
+
+@router.get("/history/{user_id}/{session_id}/export")
+async def export_session_history(user_id: str, session_id: str, db: AsyncSession = DBSession):
+    """以 NDJSON（每行一条消息）流式导出整个会话。"""
+    if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    if await global_state.session_manager.get_session_version(user_id, session_id, db) is None:
+        raise HTTPException(status_code=404, detail="Session not found.")
+
+    async def ndjson_lines():
+        async for message in global_state.session_manager.iter_session_history(user_id, session_id):
+            yield dumps_bytes(message) + b"\n"
+
+    return StreamingResponse(
+        ndjson_lines(), media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{session_id}.ndjson"'}
+    )
+
 @router.put("/history/{user_id}/{session_id}")
-async def update_session_history_by_id(user_id: str, session_id: str, history: List[Dict[str, Any]] = Body(...), db: AsyncSession = DBSession):
+async def update_session_history_by_id(
+    user_id: str, session_id: str, history: List[Dict[str, Any]] = Body(...),
+    expected_version: Optional[int] = None, db: AsyncSession = DBSession
+):
+    if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    try:
+        version = await global_state.session_manager.update_session_history(user_id, session_id, history, db, expected_version)
+    except SessionVersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _version_response(version, "History updated.")
+
+@router.post("/history/{user_id}/{session_id}/append")
+async def append_session_messages(user_id: str, session_id: str, payload: AppendMessagesRequest, db: AsyncSession = DBSession):
+    if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    try:
+        version = await global_state.session_manager.append_messages(
+            user_id, session_id, payload.messages, db, payload.expected_version
+        )
+    except SessionVersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _version_response(version, "Messages appended.")
+
+@router.patch("/history/{user_id}/{session_id}/messages")
+async def patch_session_messages(user_id: str, session_id: str, payload: PatchMessagesRequest, db: AsyncSession = DBSession):
+    if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
+    try:
+        version = await global_state.session_manager.patch_messages(
+            user_id, session_id, payload.patches, db, payload.expected_version, payload.truncate_after
+        )
+    except SessionVersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _version_response(version, "Messages updated.")
+
+@router.post("/history/{user_id}/{session_id}/repair")
+async def repair_session_history_by_id(user_id: str, session_id: str, history: List[Dict[str, Any]] = Body(...), db: AsyncSession = DBSession):
     if not global_state.session_manager: raise HTTPException(status_code=503, detail="SessionManager not initialized.")
-    if await global_state.session_manager.update_session_history(user_id, session_id, history, db):
-        return {"status": "success", "message": "History updated."}
-    raise HTTPException(status_code=500, detail="Failed to update session history.")
+    version = await global_state.session_manager.repair_session_history(user_id, session_id, history, db)
+    return _version_response(version, "History rewritten.")
 
 @router.delete("/session/{user_id}/{session_id}")
 async def delete_session_by_id(user_id: str, session_id: str, db: AsyncSession = DBSession):
@@ -53,7 +151,7 @@ async def rename_session_by_id(user_id: str, session_id: str, payload: Dict[str,
     raise HTTPException(status_code=404, detail="Session not found or failed to rename.")
 
 @router.post("/session/{user_id}/{session_id}/generate_title")
-async def generate_session_title(user_id: str, session_id: str, db: AsyncSession = DBSession):
+async def generate_session_title(user_id: str, session_id: str, use_cache: bool = True, db: AsyncSession = DBSession):
     if not global_state.session_manager:
         raise HTTPException(status_code=503, detail="SessionManager not initialized.")
     
@@ -62,7 +160,7 @@ async def generate_session_title(user_id: str, session_id: str, db: AsyncSession
         raise HTTPException(status_code=400, detail="Not enough history to generate a title.")
         
     try:
-        title = await generators.generate_title_from_history(user_id, history)
+        title = await generators.generate_title_from_history(user_id, history, use_cache=use_cache)
         if await global_state.session_manager.rename_session(user_id, session_id, title, db):
             return {"status": "success", "title": title}
         else:
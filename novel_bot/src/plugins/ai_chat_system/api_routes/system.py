@@ -11,8 +11,13 @@ from typing import List, Optional, Dict, Any
 from ..services import system_utils
 from .. import global_state
 from ..api_manager import ApiManager
+from ..llm_services.client_pool import llm_client_pool
+from ..llm_services.latency_tracker import latency_tracker
+from ..utils.stream_coalescer import stream_metrics
 from ..session_manager import SessionManager
 from ..database.session import get_db_session
+from ..database.write_queue import write_queue
+from ..services.token_usage import get_usage_stats, key_fingerprint, token_usage_recorder
 from ..database.models import Session, ChatMessage, User
 
 router = APIRouter(prefix="/system", tags=["System Utilities"])
@@ -31,6 +36,7 @@ class ApiKey(BaseModel):
 class CheckModelsRequest(BaseModel):
     user_id: str
     api_keys: Optional[List[ApiKey]] = None
+    force_refresh: bool = False
 
 @test_router.post("/system/check_models")
 async def check_user_models(payload: CheckModelsRequest, db: AsyncSession = Depends(get_db_session)):
@@ -62,7 +68,7 @@ async def check_user_models(payload: CheckModelsRequest, db: AsyncSession = Depe
             os.environ['HTTP_PROXY'] = proxy_url
 
         temp_api_manager = ApiManager(api_keys_to_check)
-        await temp_api_manager.initialize_available_models()
+        await temp_api_manager.initialize_available_models(force_refresh=payload.force_refresh)
         
         global_state.api_key_model_cache[payload.user_id] = temp_api_manager.verified_models
         
@@ -87,35 +93,20 @@ async def check_user_models(payload: CheckModelsRequest, db: AsyncSession = Depe
 
 @test_router.get("/system/token_usage_stats/{user_id}")
 async def get_token_usage_stats(user_id: str, db: AsyncSession = Depends(get_db_session)):
-    latest_session_stmt = select(Session).where(Session.owner_id == user_id).order_by(Session.last_updated_at.desc()).limit(1)
-    result = await db.execute(latest_session_stmt)
-    latest_session = result.scalar_one_or_none()
-
-    if not latest_session:
-        return {"hourly": 0, "daily": 0, "monthly": 0}
-
-    messages_stmt = select(ChatMessage).where(ChatMessage.session_id == latest_session.id)
-    result = await db.execute(messages_stmt)
-    history = result.scalars().all()
-
-    if not history:
-        return {"hourly": 0, "daily": 0, "monthly": 0}
-
-    total_tokens = 0
-    message_count = 0
-    for message in history:
-        usage = message.token_usage
-        if usage and isinstance(usage, dict) and "total_token_count" in usage:
-            total_tokens += usage["total_token_count"]
-            message_count += 1
-    
-    avg_tokens_per_message = total_tokens / message_count if message_count > 0 else 750
+    # [优化] 直接读取按小时预聚合的用量桶；先把内存中尚未写入的增量落库，保证统计包含最近的请求
+    await token_usage_recorder.flush()
 
-    hourly = avg_tokens_per_message * 20
-    daily = hourly * 24
-    monthly = daily * 30
+    key_names = {}
+    dm = global_state.data_manager
+    if dm:
+        user_config = await dm.get_user_config(user_id, db)
+        for index, item in enumerate(user_config.get("api_keys") or []):
+            key = item.get("key") if isinstance(item, dict) else item
+            if key:
+                name = item.get("name") if isinstance(item, dict) else None
+                key_names[key_fingerprint(key)] = name or f"Key {index + 1}"
 
-    return {"hourly": int(hourly), "daily": int(daily), "monthly": int(monthly)}
+    return await get_usage_stats(db, user_id, key_names)
 
 @test_router.post("/system/test-api-key")
 async def test_google_api_key(payload: ApiKeyTestRequest):
@@ -126,9 +117,9 @@ async def test_google_api_key(payload: ApiKeyTestRequest):
         if payload.proxy_url:
             os.environ['HTTPS_PROXY'] = payload.proxy_url
             os.environ['HTTP_PROXY'] = payload.proxy_url
-        genai.configure(api_key=payload.api_key)
+        model_client = llm_client_pool.get_gemini_client(payload.api_key).model_client
         await asyncio.wait_for(
-            asyncio.to_thread(lambda: list(genai.list_models())),
+            asyncio.to_thread(lambda: list(genai.list_models(client=model_client))),
             timeout=20.0
         )
         return {"status": "success", "message": "API Key is valid and working."}
@@ -170,4 +161,27 @@ async def perform_network_check(proxy_url: str | None = None):
         else:
             raise HTTPException(status_code=503, detail=result["message"])
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@router.get("/stream_metrics")
+async def get_stream_metrics():
+    """返回流式输出的合并统计（上游块数、下发帧数、帧率）。"""
+    return stream_metrics.snapshot()
+
+@router.get("/db_metrics")
+async def get_db_metrics():
+    """返回数据库写入队列的统计：队列深度、批大小、提交耗时与排队耗时分位数。"""
+    return write_queue.get_metrics()
+
+@router.get("/latency_stats")
+async def get_latency_stats():
+    """返回各模型首字延迟（TTFT）的分位数统计，对冲模式据此确定触发时限。"""
+    return latency_tracker.snapshot()
+
+@router.get("/key_stats/{user_id}")
+async def get_key_stats(user_id: str):
+    """返回用户（或系统默认）API Key 的调度统计：进行中请求数、退避剩余时间、RPM/TPM 利用率等。"""
+    api_manager = global_state.user_api_managers.get(user_id) or global_state.api_manager
+    if not api_manager or not api_manager.keys:
+        raise HTTPException(status_code=404, detail="No API keys are configured for this user.")
+    return {"keys": api_manager.get_key_stats()}
@@ -1,19 +1,55 @@
 import traceback
-from fastapi import APIRouter, Body, HTTPException, Depends
-from typing import Dict, List
+from fastapi import APIRouter, Body, HTTPException, Depends, Query, Request, Response
+from typing import Dict, List, Optional
 from nonebot import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from .. import global_state
 from ..services.connection_manager import broadcast_status_update
+from ..services.content_versions import etag_matches, get_collection_version, make_etag, not_modified_response
+from ..services.public_catalog import PUBLIC_CATALOG_FIELDS, public_catalog
+from ..services.model_discovery import extract_key_strings, model_discovery
 from ..database.session import DBSession
 from ..database.models import User
 
 router = APIRouter(tags=["System & Config"])
 
+async def _public_catalog_fields(mode: str) -> Dict:
+    """公共目录来自预构建的快照，不再每次查询数据库。"""
+    snapshot = await public_catalog.get_snapshot()
+    if mode == "reference":
+        return {"public_catalog": {"version": snapshot.version, "url": f"/public_catalog?v={snapshot.version}"}}
+    return dict(snapshot.payload)
+
+@router.get("/public_catalog")
+async def get_public_catalog(request: Request, v: Optional[str] = None):
+    """
+    返回预压缩的公共目录。带有与当前版本一致的 v 参数时可被客户端永久缓存；
+    否则通过 ETag 做条件请求。
+    """
+    snapshot = await public_catalog.get_snapshot()
+    etag = f'"{snapshot.version}"'
+    cache_control = "public, max-age=31536000, immutable" if v == snapshot.version else "no-cache"
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body, encoding = snapshot.encoded(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @router.get("/bootstrap/{user_id}")
-async def bootstrap_user_data(user_id: str, db: AsyncSession = DBSession):
+async def bootstrap_user_data(
+    user_id: str, request: Request, response: Response,
+    public_catalog_mode: str = Query("embed", alias="public_catalog", pattern="^(embed|reference)$"),
+    db: AsyncSession = DBSession
+):
+    """
+    public_catalog=embed（默认）时内嵌完整的公共目录；reference 时只返回目录的版本与地址，
+    客户端再单独请求可被浏览器缓存的 /public_catalog。
+    """
     logger.info(f"[DIAG] /bootstrap endpoint hit for user_id: {user_id}")
     try:
         if not global_state.data_manager or not global_state.session_manager:
@@ -21,12 +57,23 @@ async def bootstrap_user_data(user_id: str, db: AsyncSession = DBSession):
             raise HTTPException(status_code=503, detail="System services not fully initialized.")
         
         logger.debug("[DIAG] System services seem to be initialized.")
+
+        # [优化] 条件 GET：配置、会话列表、公共数据与模型连接状态都未变化时直接返回 304
+        verified_models = global_state.api_key_model_cache.get(user_id)
+        etag = make_etag(
+            "bootstrap", user_id, public_catalog_mode,
+            get_collection_version(user_id, "config"), get_collection_version(user_id, "sessions"),
+            *(get_collection_version(None, data_type) for data_type in PUBLIC_CATALOG_FIELDS),
+            None if verified_models is None else [m.get("name") for m in verified_models],
+        )
+        not_modified = not_modified_response(request, response, etag)
+        if not_modified is not None:
+            return not_modified
         
         dm = global_state.data_manager
         
         if user_id == 'anonymous-user':
             logger.info(f"[DIAG] Handling anonymous user. Preparing default bootstrap data.")
-            public_data = await dm.get_all_public_data(db)
             anonymous_config = dm._get_default_anonymous_config()
 
             response_payload = {
@@ -34,10 +81,7 @@ async def bootstrap_user_data(user_id: str, db: AsyncSession = DBSession):
                 "user_info": None,
                 "system_status": { "model_is_ready": False, "api_key_count": 0, "verified_models": [] },
                 "initial_sessions": [],
-                "public_characters": public_data.get('character', {}),
-                "public_presets": public_data.get('preset', {}),
-                "public_world_info": public_data.get('world_info', {}),
-                "public_groups": public_data.get('group', {}),
+                **(await _public_catalog_fields(public_catalog_mode)),
             }
             logger.info(f"[DIAG] Successfully prepared response for anonymous user.")
             return response_payload
@@ -61,6 +105,9 @@ async def bootstrap_user_data(user_id: str, db: AsyncSession = DBSession):
             "account_number": user_db_obj.account_number, "avatar": user_db_obj.avatar
         }
 
+        # [优化] 重启后用持久化的模型发现结果恢复连接状态，无需用户重新点击"连接"
+        await model_discovery.restore_user_models(user_id, extract_key_strings(user_config.get("api_keys", [])))
+
         active_char_filename = user_config.get("active_character")
         sessions = []
         if active_char_filename:
@@ -68,9 +115,6 @@ async def bootstrap_user_data(user_id: str, db: AsyncSession = DBSession):
             sessions = await global_state.session_manager.get_sessions_for_character(user_id, active_char_filename, db)
             logger.debug(f"[DIAG] Found {len(sessions)} initial sessions.")
         
-        logger.debug(f"[DIAG] Fetching all public data...")
-        public_data = await dm.get_all_public_data(db)
-        logger.debug(f"[DIAG] Public data fetched.")
 
         response_payload = {
             "user_config": user_config,
@@ -81,10 +125,7 @@ async def bootstrap_user_data(user_id: str, db: AsyncSession = DBSession):
                 "verified_models": global_state.api_key_model_cache.get(user_id, []),
             },
             "initial_sessions": sessions,
-            "public_characters": public_data.get('character', {}),
-            "public_presets": public_data.get('preset', {}),
-            "public_world_info": public_data.get('world_info', {}),
-            "public_groups": public_data.get('group', {}),
+            **(await _public_catalog_fields(public_catalog_mode)),
         }
         logger.info(f"[DIAG] Successfully prepared response for user '{user_db_obj.username}'. Bootstrap complete.")
         return response_payload
@@ -109,7 +150,8 @@ async def update_user_config(user_id: str, config_data: Dict = Body(...), db: As
         logger.info(f"[CONFIG] User '{user_id}' config updated successfully. Changed keys: {list(config_data.keys())}")
         await broadcast_status_update(
             {"user_id": user_id, "new_config": config_data},
-            "user_config_updated"
+            "user_config_updated",
+            user_id=user_id
         )
         return {"status": "success", "message": "User config updated successfully."}
     except Exception as e:
@@ -129,8 +171,8 @@ async def update_display_order(user_id: str, payload: Dict = Body(...), db: Asyn
     
     try:
         user_config = await global_state.data_manager.get_user_config(user_id, db)
-        user_config.setdefault("display_order", {})[data_type] = order
-        await global_state.data_manager.save_user_config(user_id, user_config, db)
+        display_order = {**user_config.get("display_order", {}), data_type: order}
+        await global_state.data_manager.update_user_config_fields(user_id, {"display_order": display_order}, db)
         return {"status": "success", "message": f"{data_type} display order updated."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update display order: {e}")
@@ -143,12 +185,13 @@ async def update_generation_profiles(user_id: str, profiles: Dict = Body(...), d
     
     try:
         user_config = await global_state.data_manager.get_user_config(user_id, db)
-        user_config.setdefault("generation_profiles", {}).update(profiles)
-        await global_state.data_manager.save_user_config(user_id, user_config, db)
+        generation_profiles = {**user_config.get("generation_profiles", {}), **profiles}
+        await global_state.data_manager.update_user_config_fields(user_id, {"generation_profiles": generation_profiles}, db)
         
         await broadcast_status_update(
-            {"user_id": user_id, "generation_profiles": user_config["generation_profiles"]},
-            "user_config_updated"
+            {"user_id": user_id, "generation_profiles": generation_profiles},
+            "user_config_updated",
+            user_id=user_id
         )
         return {"status": "success", "message": "Generation profiles updated successfully."}
     except Exception as e:
@@ -166,6 +209,7 @@ async def set_temporary_model(user_id: str, payload: Dict = Body(...)):
     
     await broadcast_status_update(
         {"user_id": user_id, "temp_model": model},
-        "session_model_updated"
+        "session_model_updated",
+        user_id=user_id
     )
     return {"status": "success", "message": "Session model updated."}
\ No newline at end of file
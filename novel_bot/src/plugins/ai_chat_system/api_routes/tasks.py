@@ -4,6 +4,7 @@ from fastapi import APIRouter, HTTPException, Query, Depends
 from typing import List
 
 from ..services.task_manager import TaskManager, get_task_manager
+from ..services.job_executor import job_executor
 
 router = APIRouter(prefix="/tasks", tags=["Background Tasks"])
 
@@ -18,6 +19,11 @@ async def get_tasks_for_user(
     tasks = await task_manager.get_tasks_by_user(user_id, limit, offset)
     return tasks
 
+@router.get("/queues")
+async def get_job_queue_stats() -> dict:
+    """各作业队列的排队数、执行数与并发上限。"""
+    return job_executor.stats()
+
 @router.get("/{task_id}")
 async def get_task_status(
     task_id: str,
@@ -29,4 +35,22 @@ async def get_task_status(
     task = await task_manager.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
\ No newline at end of file
+    return task
+
+@router.post("/user/{user_id}/{task_id}/cancel")
+async def cancel_task(
+    user_id: str,
+    task_id: str,
+    task_manager: TaskManager = Depends(get_task_manager)
+):
+    """取消该用户排队中或正在执行的作业。"""
+    task = await task_manager.get_task(task_id)
+    if not task or task["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if await job_executor.cancel(task_id):
+        return {"status": "cancelled", "task_id": task_id}
+    # 不在本 worker 上：若仍未结束，请求持有它的 worker 取消，结果经 task_update 推送
+    if task["status"] in ("pending", "processing"):
+        job_executor.request_remote_cancel(task_id)
+        return {"status": "cancelling", "task_id": task_id}
+    raise HTTPException(status_code=404, detail="Task not found or already finished")
@@ -1,6 +1,6 @@
 # novel_bot/src/plugins/ai_chat_system/api_routes/tts.py
 
-from fastapi import APIRouter, Body, HTTPException, BackgroundTasks, Depends
+from fastapi import APIRouter, Body, HTTPException
 from pydantic import BaseModel, Field
 import base64
 import logging
@@ -8,7 +8,7 @@ from typing import Dict, List, Tuple, Optional
 
 from ..services.tts_service import tts_client
 from ..services.tts_merger import synthesize_and_merge_audio
-from ..services.task_manager import TaskManager, get_task_manager
+from ..services.job_executor import job_executor, JobContext
 
 router = APIRouter(prefix="/tts", tags=["TTS"])
 logger = logging.getLogger("nonebot")
@@ -58,38 +58,30 @@ async def synthesize_speech(payload: Dict = Body(...)):
             status_code=500, detail=f"Failed to synthesize audio: {str(e)}"
         )
 
-async def run_synthesize_batch_task(task_id: str, payload: SynthesizeBatchRequest, task_manager_instance: TaskManager):
-    try:
-        await task_manager_instance.update_task_progress(task_id, 20, "初始化合成")
-        
-        merged_audio_bytes = await synthesize_and_merge_audio(
-            user_id=payload.user_id,
-            segments=payload.segments,
-            rate=payload.params.rate,
-            volume=payload.params.volume,
-            pitch=payload.params.pitch,
-            task_id=task_id,
-            task_manager_instance=task_manager_instance
-        )
-        audio_base64 = base64.b64encode(merged_audio_bytes).decode("utf-8")
-        result = {"audio_data": f"data:audio/mp3;base64,{audio_base64}"}
-        
-        await task_manager_instance.update_task_progress(task_id, 100, "成功")
-        await task_manager_instance.update_task(task_id, "success", result)
-    except Exception as e:
-        logger.error(f"TTS API: Failed to batch synthesize audio in background: {e}", exc_info=True)
-        await task_manager_instance.update_task(task_id, "failed", {"error": str(e)})
+@job_executor.handler("tts_batch", queue="media", priority=5, max_attempts=2)
+async def run_synthesize_batch_task(job: JobContext) -> dict:
+    payload = SynthesizeBatchRequest(**job.payload)
+    await job.progress(20, "初始化合成")
+    
+    merged_audio_bytes = await synthesize_and_merge_audio(
+        user_id=payload.user_id,
+        segments=payload.segments,
+        rate=payload.params.rate,
+        volume=payload.params.volume,
+        pitch=payload.params.pitch,
+        job=job
+    )
+    audio_base64 = base64.b64encode(merged_audio_bytes).decode("utf-8")
+    result = {"audio_data": f"data:audio/mp3;base64,{audio_base64}"}
+    
+    await job.progress(100, "成功")
+    return result
 
 
 @router.post("/synthesize-batch")
-async def synthesize_batch_speech(
-    payload: SynthesizeBatchRequest, 
-    background_tasks: BackgroundTasks,
-    task_manager: TaskManager = Depends(get_task_manager)
-):
+async def synthesize_batch_speech(payload: SynthesizeBatchRequest):
     if not payload.segments:
         raise HTTPException(status_code=400, detail="Segments list cannot be empty.")
     
-    task_id = await task_manager.create_task("tts_batch", payload.user_id)
-    background_tasks.add_task(run_synthesize_batch_task, task_id, payload, task_manager)
-    return {"status": "processing", "task_id": task_id}
\ No newline at end of file
+    task_id = await job_executor.submit("tts_batch", payload.user_id, payload.model_dump())
+    return {"status": "processing", "task_id": task_id}
@@ -1,6 +1,6 @@
 # novel_bot/src/plugins/ai_chat_system/api_routes/user_profile.py
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Body, BackgroundTasks
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Body
 from pydantic import BaseModel
 import tempfile
 import shutil
@@ -8,7 +8,7 @@ from pathlib import Path
 
 from ..database.session import get_db_session
 from ..services.user_service import UserService, get_user_service
-from ..services.task_manager import TaskManager, get_task_manager
+from ..services.job_executor import job_executor, JobContext, JobError
 from nonebot import logger
 
 router = APIRouter(prefix="/user", tags=["User Profile"])
@@ -17,45 +17,45 @@ class UsernameUpdatePayload(BaseModel):
     new_username: str
     password: str
 
-async def _run_avatar_upload_task(task_id: str, user_id: str, temp_file_path: str, original_filename: str, task_manager_instance: TaskManager):
+@job_executor.handler("upload_avatar", queue="interactive", priority=0, max_attempts=1)
+async def _run_avatar_upload_task(job: JobContext) -> dict:
     """后台执行头像上传和处理的任务，确保数据持久化。"""
-    temp_path = Path(temp_file_path)
+    task_id, user_id = job.task_id, job.user_id
+    temp_path = Path(job.payload["temp_file_path"])
+    original_filename = job.payload["original_filename"]
     # [诊断日志] 记录后台任务开始
     logger.info(f"[DIAG][Task:{task_id}] Avatar upload task started for user '{user_id}'.")
     
     async for db in get_db_session():
         try:
-            await task_manager_instance.update_task_progress(task_id, 25, "上传文件中")
+            await job.progress(25, "上传文件中")
             
             service = UserService(db)
             avatar_url = await service.update_user_avatar(user_id, temp_path, original_filename)
             # [诊断日志] 记录从UserService返回的URL
             logger.info(f"[DIAG][Task:{task_id}] UserService returned new avatar URL: {avatar_url}")
             
-            await task_manager_instance.update_task_progress(task_id, 100, "成功")
+            await job.progress(100, "成功")
             
             success_payload = {"image_url": avatar_url}
             # [诊断日志] 记录最终发送给任务管理器的成功载荷
             logger.info(f"[DIAG][Task:{task_id}] Updating task to 'success' with payload: {success_payload}")
-            await task_manager_instance.update_task(task_id, "success", success_payload)
             logger.info(f"头像上传任务 {task_id} 成功，返回URL: {avatar_url}")
         except Exception as e:
             # [诊断日志] 记录数据库回滚
             logger.error(f"[DIAG][Task:{task_id}] An error occurred in avatar upload task.")
             logger.error(f"头像上传失败 for user {user_id}: {e}", exc_info=True)
-            error_detail = str(e)
-            await task_manager_instance.update_task(task_id, "failed", {"error": f"头像上传失败: {error_detail}"})
+            raise JobError(f"头像上传失败: {e}") from e
         finally:
             if temp_path.exists():
                 temp_path.unlink()
+    return success_payload
 
 @router.post("/{user_id}/avatar")
 async def upload_avatar(
     user_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    service: UserService = Depends(get_user_service),
-    task_manager: TaskManager = Depends(get_task_manager)
+    service: UserService = Depends(get_user_service)
 ):
     """为指定用户上传或更新头像"""
     if not file.content_type.startswith("image/"):
@@ -68,8 +68,9 @@ async def upload_avatar(
     finally:
         await file.close()
 
-    task_id = await task_manager.create_task("upload_avatar", user_id)
-    background_tasks.add_task(_run_avatar_upload_task, task_id, user_id, temp_file_path, file.filename, task_manager)
+    task_id = await job_executor.submit("upload_avatar", user_id, {
+        "temp_file_path": temp_file_path, "original_filename": file.filename,
+    })
     return {"status": "processing", "task_id": task_id}
 
 @router.put("/{user_id}/username")
@@ -6,35 +6,17 @@ import logging
 from websockets.exceptions import ConnectionClosed
 
 from .. import global_state
+from ..services.connection_manager import manager
 
 router = APIRouter()
 logger = logging.getLogger("websocket")
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].close(code=1001)
-                logger.info(f"Closed existing connection for user {user_id}.")
-            except (RuntimeError, ConnectionClosed):
-                pass
-        self.active_connections[user_id] = websocket
-        logger.info(f"User {user_id} connected.")
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            logger.info(f"User {user_id} disconnected.")
-
-manager = ConnectionManager()
 
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+    # [优化] 使用共享的 ConnectionManager，广播与任务进度推送才能找到这个连接
+    if not await manager.connect(websocket, user_id):
+        return
     
     ping_task_instance = None
     try:
@@ -42,7 +24,9 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             while True:
                 try:
                     await asyncio.sleep(20)
-                    await websocket.send_json({"type": "ping"})
+                    # 与其他通知共用该连接的发送队列
+                    if not await manager.send_to_user(user_id, {"type": "ping"}, websocket):
+                        break
                 except (WebSocketDisconnect, ConnectionClosed):
                     break
 
@@ -54,6 +38,14 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 if data.get("type") == "pong":
                     logger.debug(f"Received pong from user {user_id}")
                     continue
+                # [核心新增] 客户端按主题订阅/退订公共事件，私有事件始终只发给所属用户
+                if data.get("type") in ("subscribe", "unsubscribe"):
+                    topics = data.get("topics") or []
+                    if data["type"] == "subscribe":
+                        manager.subscribe(websocket, user_id, topics)
+                    else:
+                        manager.unsubscribe(websocket, user_id, topics)
+                    continue
             except WebSocketDisconnect:
                 logger.info(f"Client {user_id} disconnected gracefully.")
                 break
@@ -66,4 +58,4 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     finally:
         if ping_task_instance:
             ping_task_instance.cancel()
-        manager.disconnect(user_id)
\ No newline at end of file
+        manager.disconnect(websocket, user_id)
\ No newline at end of file
@@ -6,4 +6,15 @@ DEFAULT_USER_PERSONA_NAME = "User"
 DEFAULT_PRESET_NAME = "百变助手"
 
 # Cooldown duration for failed API keys in seconds
-API_KEY_COOLDOWN_DURATION = 300 # 5 minutes
\ No newline at end of file
+API_KEY_COOLDOWN_DURATION = 300 # 5 minutes
+
+# Key scheduler: default per-key, per-model limits (override via
+# `rate_limits` in the LLM service config) and the first backoff step.
+DEFAULT_KEY_RPM = 60
+DEFAULT_KEY_TPM = 1_000_000
+KEY_BACKOFF_BASE_SECONDS = 2
+
+# Streaming: consecutive text chunks are merged into one frame and flushed
+# when either the time window or the size window is reached.
+STREAM_FLUSH_INTERVAL_MS = 30
+STREAM_FLUSH_CHARS = 256
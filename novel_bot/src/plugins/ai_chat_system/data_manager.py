@@ -1,10 +1,13 @@
 # novel_bot/src/plugins/ai_chat_system/data_manager.py
 
+import copy
 import json
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import logging
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .database.models import User, ContentItem 
@@ -12,50 +15,119 @@ from .database.models import User, ContentItem
 from .services.data_persistence import (
     save_content_item_to_db, 
     delete_content_item_from_db, 
-    rename_content_item_in_db
+    rename_content_item_in_db,
+    sync_display_ranks
 )
+from .services.content_versions import bump_collection_version
+from .services.connection_manager import manager as connection_manager
+from . import global_state
 from .constants import DEFAULT_CHARACTER_NAME, DEFAULT_PRESET_NAME, DEFAULT_USER_PERSONA_NAME
 
 logger = logging.getLogger("nonebot")
 
+USER_CONFIG_CACHE_SIZE = 1024
+USER_CONFIG_CACHE_TTL_SECONDS = 300
+
+# 配置键 -> (User 列名, 保存完整配置时缺省该键所写入的值)
+_USER_CONFIG_FIELDS: Dict[str, Tuple[str, Any]] = {
+    "active_character": ("active_character_filename", None),
+    "active_session_id": ("active_session_id", None),
+    "user_persona": ("user_persona_filename", None),
+    "preset": ("preset_filename", None),
+    "active_modules": ("active_modules", {}),
+    "max_tokens": ("max_tokens", 4096),
+    "world_info": ("session_world_info", []),
+    "display_order": ("display_order", {}),
+    "regex_rules": ("regex_rules", []),
+    "generation_profiles": ("generation_profiles", {}),
+    "deleted_public_items": ("deleted_public_items", []),
+    "tts_voice_assignments": ("tts_voice_assignments", {}),
+    "tts_service_config": ("tts_service_config", {}),
+    "api_keys": ("api_keys", []),
+    "llm_service_config": ("llm_service_config", {}),
+    "has_completed_onboarding": ("has_completed_onboarding", False),
+}
+_USER_CONFIG_COLUMNS = [getattr(User, column) for column, _ in _USER_CONFIG_FIELDS.values()]
+
 class DataManager:
     def __init__(self):
         # DataManager 现在是纯粹的服务协调者
-        pass
+        # [优化] 用户配置的原始列值缓存（LRU + TTL），保存时写穿
+        self._config_cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+    def _cache_columns(self, user_id: str, columns: Dict[str, Any]):
+        self._config_cache[user_id] = (columns, time.monotonic() + USER_CONFIG_CACHE_TTL_SECONDS)
+        self._config_cache.move_to_end(user_id)
+        while len(self._config_cache) > USER_CONFIG_CACHE_SIZE:
+            self._config_cache.popitem(last=False)
+
+    def invalidate_user_config(self, user_id: Optional[str] = None, propagate: bool = True):
+        """
+        丢弃某个用户（或全部用户）的缓存配置，用于绕过 DataManager 修改了 users 表的场景。
+        propagate 为 True 时同时通知其他 worker 丢弃各自的缓存。
+        """
+        if user_id is None:
+            self._config_cache.clear()
+        else:
+            self._config_cache.pop(user_id, None)
+        if propagate:
+            connection_manager.publish_control("user_config", {"user_id": user_id})
+
+    async def _get_config_columns(self, user_id: str, db: AsyncSession) -> Optional[Dict[str, Any]]:
+        entry = self._config_cache.get(user_id)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._config_cache.move_to_end(user_id)
+                return entry[0]
+            del self._config_cache[user_id]
+
+        row = (await db.execute(select(*_USER_CONFIG_COLUMNS).where(User.user_id == user_id))).mappings().first()
+        if row is None:
+            return None
+        columns = dict(row)
+        self._cache_columns(user_id, columns)
+        return columns
+
+    @staticmethod
+    def _config_from_columns(columns: Dict[str, Any]) -> Dict[str, Any]:
+        # 返回深拷贝：调用方会原地修改返回的配置，不能影响缓存
+        columns = copy.deepcopy(columns)
+        return {
+            "active_character": columns["active_character_filename"] or DEFAULT_CHARACTER_NAME,
+            "active_session_id": columns["active_session_id"],
+            "user_persona": columns["user_persona_filename"] or DEFAULT_USER_PERSONA_NAME,
+            "preset": columns["preset_filename"] or DEFAULT_PRESET_NAME,
+            "active_modules": columns["active_modules"] or {},
+            "max_tokens": columns["max_tokens"] or 4096,
+            "world_info": columns["session_world_info"] or [],
+            "display_order": columns["display_order"] or {},
+            "regex_rules": columns["regex_rules"] or [],
+            "generation_profiles": columns["generation_profiles"] or {},
+            "deleted_public_items": columns["deleted_public_items"] or [],
+            "tts_voice_assignments": columns["tts_voice_assignments"] or {},
+            "tts_service_config": columns["tts_service_config"] or {},
+            "api_keys": columns["api_keys"] or [],
+            "llm_service_config": columns["llm_service_config"] or {},
+            "has_completed_onboarding": columns["has_completed_onboarding"] or False,
+        }
 
     async def get_user_config(self, user_id: str, db: AsyncSession, db_user: Optional[User] = None) -> Dict[str, Any]:
         """
-        从数据库获取用户配置。
+        获取用户配置（优先读缓存）。返回的字典可以自由修改。
         """
         if user_id == 'anonymous-user':
             return self._get_default_anonymous_config()
 
-        user = db_user
-        if not user:
-            result = await db.execute(select(User).where(User.user_id == user_id))
-            user = result.scalar_one_or_none()
+        if db_user is not None:
+            columns = {column: getattr(db_user, column) for column, _ in _USER_CONFIG_FIELDS.values()}
+            self._cache_columns(user_id, columns)
+        else:
+            columns = await self._get_config_columns(user_id, db)
 
-        if not user:
+        if columns is None:
             raise ValueError(f"User with ID {user_id} not found.")
 
-        return {
-            "active_character": user.active_character_filename or DEFAULT_CHARACTER_NAME,
-            "active_session_id": user.active_session_id,
-            "user_persona": user.user_persona_filename or DEFAULT_USER_PERSONA_NAME,
-            "preset": user.preset_filename or DEFAULT_PRESET_NAME,
-            "active_modules": user.active_modules or {},
-            "max_tokens": user.max_tokens or 4096,
-            "world_info": user.session_world_info or [],
-            "display_order": user.display_order or {},
-            "regex_rules": user.regex_rules or [],
-            "generation_profiles": user.generation_profiles or {},
-            "deleted_public_items": user.deleted_public_items or [],
-            "tts_voice_assignments": user.tts_voice_assignments or {},
-            "tts_service_config": user.tts_service_config or {},
-            "api_keys": user.api_keys or [],
-            "llm_service_config": user.llm_service_config or {},
-            "has_completed_onboarding": user.has_completed_onboarding or False,
-        }
+        return self._config_from_columns(columns)
 
     def _get_default_anonymous_config(self) -> Dict[str, Any]:
         """为匿名用户提供一个默认的、只读的配置。"""
@@ -72,34 +144,55 @@ class DataManager:
         }
 
     async def save_user_config(self, user_id: str, config_data: Dict, db: AsyncSession):
-        """将配置数据保存回数据库中的 User 对象。"""
+        """
+        保存完整的用户配置（缺省的键写入默认值，与以往语义一致），
+        但只有与当前值不同的列才会被写入数据库。
+        """
         if user_id == 'anonymous-user':
             logger.warning("Attempted to save config for anonymous user. Operation skipped.")
             return
 
-        result = await db.execute(select(User).where(User.user_id == user_id))
-        user = result.scalar_one_or_none()
-        if not user:
+        current = await self._get_config_columns(user_id, db)
+        if current is None:
             raise ValueError(f"Cannot save config for non-existent user {user_id}")
 
-        user.active_character_filename = config_data.get("active_character")
-        user.active_session_id = config_data.get("active_session_id")
-        user.user_persona_filename = config_data.get("user_persona")
-        user.preset_filename = config_data.get("preset")
-        user.active_modules = config_data.get("active_modules", {})
-        user.max_tokens = config_data.get("max_tokens", 4096)
-        user.session_world_info = config_data.get("world_info", [])
-        user.display_order = config_data.get("display_order", {})
-        user.regex_rules = config_data.get("regex_rules", [])
-        user.generation_profiles = config_data.get("generation_profiles", {})
-        user.deleted_public_items = config_data.get("deleted_public_items", [])
-        user.tts_voice_assignments = config_data.get("tts_voice_assignments", {})
-        user.tts_service_config = config_data.get("tts_service_config", {})
-        user.api_keys = config_data.get("api_keys", [])
-        user.llm_service_config = config_data.get("llm_service_config", {})
-        user.has_completed_onboarding = config_data.get("has_completed_onboarding", False)
-        
-        await db.commit()
+        changed = {}
+        for key, (column, default) in _USER_CONFIG_FIELDS.items():
+            value = config_data.get(key, default)
+            if current.get(column) != value:
+                changed[key] = value
+        if changed:
+            await self.update_user_config_fields(user_id, changed, db)
+
+    async def update_user_config_fields(self, user_id: str, fields: Dict[str, Any], db: AsyncSession):
+        """部分更新：只写入给定的配置键对应的列，并写穿缓存。"""
+        if user_id == 'anonymous-user':
+            logger.warning("Attempted to save config for anonymous user. Operation skipped.")
+            return
+
+        unknown = set(fields) - set(_USER_CONFIG_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown user config keys: {sorted(unknown)}")
+        values = {_USER_CONFIG_FIELDS[key][0]: value for key, value in fields.items()}
+
+        try:
+            result = await db.execute(update(User).where(User.user_id == user_id).values(**values))
+            if result.rowcount == 0:
+                raise ValueError(f"Cannot save config for non-existent user {user_id}")
+            if "display_order" in fields:
+                await sync_display_ranks(db, user_id, fields["display_order"])
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            self.invalidate_user_config(user_id)
+            raise
+
+        entry = self._config_cache.get(user_id)
+        if entry is not None:
+            entry[0].update(copy.deepcopy(values))
+        # 本进程写穿缓存，其他 worker 的缓存则直接丢弃
+        connection_manager.publish_control("user_config", {"user_id": user_id})
+        bump_collection_version(user_id, "config")
 
     async def get_all_public_data(self, db: AsyncSession) -> Dict[str, Dict]:
         """获取所有公共数据项。"""
@@ -127,4 +220,13 @@ class DataManager:
         
     async def rename_user_data(self, db: AsyncSession, user_id: str, data_type: str, old_name: str, new_name: str) -> str:
         logger.info(f"DataManager: Renaming '{old_name}' to '{new_name}' ({data_type}) for user '{user_id}' in DB.")
-        return await rename_content_item_in_db(db, user_id, data_type, old_name, new_name)
\ No newline at end of file
+        return await rename_content_item_in_db(db, user_id, data_type, old_name, new_name)
+
+
+def _on_remote_config_change(data: Dict[str, Any]):
+    # 其他 worker 修改了用户配置：丢弃本进程的缓存，下次读取时从数据库加载
+    if global_state.data_manager:
+        global_state.data_manager.invalidate_user_config(data.get("user_id"), propagate=False)
+
+
+connection_manager.on_control("user_config", _on_remote_config_change)
@@ -3,7 +3,7 @@
 import datetime
 from sqlalchemy import (
     create_engine, Column, Integer, String, Text, Boolean, Float, DateTime,
-    ForeignKey, UniqueConstraint
+    ForeignKey, UniqueConstraint, Index, LargeBinary
 )
 # [核心修复] 从 dialects.postgresql 导入 JSONB 的语句被移除
 # [核心修复] 导入通用的、跨数据库的 JSON 类型
@@ -53,10 +53,45 @@ class ContentItem(Base):
     data_type = Column(String, nullable=False, index=True) # 'character', 'preset', 'world_info', etc.
     filename = Column(String, nullable=False, index=True)
     data = Column(JSON, nullable=False) # [核心修复] JSONB -> JSON
+    # [优化] 从 data 中冗余出来的列，用于在 SQL 中完成列表的过滤、搜索与排序（写入时由 index_columns 同步）
+    name = Column(String, nullable=True)
+    display_name = Column(String, nullable=True)
+    is_user_persona = Column(Boolean, nullable=True)
     
     owner = relationship("User", back_populates="content_items")
     
-    __table_args__ = (UniqueConstraint('owner_id', 'data_type', 'filename', name='_owner_type_filename_uc'),)
+    __table_args__ = (
+        UniqueConstraint('owner_id', 'data_type', 'filename', name='_owner_type_filename_uc'),
+        Index('ix_content_items_type_persona_name', 'data_type', 'is_user_persona', 'name'),
+    )
+
+    @staticmethod
+    def index_columns(data: dict) -> dict:
+        """由 data 计算冗余列的值，所有写入 data 的地方都应一并写入这些列。"""
+        data = data if isinstance(data, dict) else {}
+        return {
+            "name": data.get("name"),
+            "display_name": data.get("displayName"),
+            "is_user_persona": bool(data.get("is_user_persona")),
+        }
+
+# 用户自定义的列表顺序（User.display_order）的展开形式，便于列表查询直接按 rank 排序。
+# list_key 与 display_order 的键一致，如 'characters'、'personas'、'presets'。
+class ContentDisplayRank(Base):
+    __tablename__ = 'content_display_ranks'
+    owner_id = Column(String, ForeignKey('users.user_id'), primary_key=True)
+    list_key = Column(String, primary_key=True)
+    filename = Column(String, primary_key=True)
+    rank = Column(Integer, nullable=False)
+
+    @staticmethod
+    def rows_for(owner_id: str, list_key: str, order: list) -> list:
+        """把一个文件名列表展开为 rank 行（去重，保留首次出现的位置）。"""
+        filenames = dict.fromkeys(f for f in order if isinstance(f, str))
+        return [
+            {"owner_id": owner_id, "list_key": list_key, "filename": filename, "rank": rank}
+            for rank, filename in enumerate(filenames)
+        ]
     
 class Session(Base):
     __tablename__ = 'sessions'
@@ -66,21 +101,33 @@ class Session(Base):
     title = Column(String, nullable=False, default="新对话")
     created_at = Column(Float, nullable=False)
     last_updated_at = Column(Float, nullable=False)
+    # [优化] 乐观并发控制：每次写入历史记录都会递增
+    version = Column(Integer, nullable=True, default=0)
 
     owner = relationship("User", back_populates="sessions")
-    messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan", order_by="ChatMessage.timestamp")
+    messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan", order_by="ChatMessage.seq")
 
 class ChatMessage(Base):
     __tablename__ = 'chat_messages'
     id = Column(Integer, primary_key=True)
     session_id = Column(String, ForeignKey('sessions.id'), nullable=False, index=True)
+    # [优化] 会话内单调递增的序号，消息顺序以它为准（旧数据在启动时按 timestamp 回填）
+    seq = Column(Integer, nullable=True)
     timestamp = Column(Float, nullable=False, index=True)
     role = Column(String, nullable=False) # 'user' or 'model'
     content = Column(Text, nullable=False)
+    # [优化] 长正文可压缩存储：content_codec 为 NULL 时正文在 content 中，否则在 content_blob 中（content 为空串）
+    content_codec = Column(String(32), nullable=True)
+    content_blob = Column(LargeBinary, nullable=True)
     token_usage = Column(JSON, nullable=True) # [核心修复] JSONB -> JSON
+    # [优化] 写入时计算一次的本地 Token 数，以及计数所用的后端名称
+    token_count = Column(Integer, nullable=True)
+    tokenizer = Column(String, nullable=True)
     
     session = relationship("Session", back_populates="messages")
 
+    __table_args__ = (Index('ix_chat_messages_session_seq', 'session_id', 'seq'),)
+
 class SharedContent(Base):
     __tablename__ = 'shared_content'
     id = Column(Integer, primary_key=True)
@@ -110,4 +157,62 @@ class Task(Base):
     start_time = Column(Float, nullable=True)
     end_time = Column(Float, nullable=True)
     result = Column(JSON, nullable=True) # [核心修复] JSONB -> JSON
-    error = Column(JSON, nullable=True) # [核心修复] JSONB -> JSON
\ No newline at end of file
+    error = Column(JSON, nullable=True) # [核心修复] JSONB -> JSON
+    # [核心新增] 由 job_executor 调度的作业：所属队列、优先级（越小越先执行）、入参、已尝试次数与下次重试时间。
+    # queue 为 NULL 的是不经过执行器的旧式任务。
+    queue = Column(String(32), nullable=True, index=True)
+    priority = Column(Integer, nullable=True)
+    payload = Column(JSON, nullable=True)
+    attempts = Column(Integer, nullable=True)
+    run_after = Column(Float, nullable=True)
+    # 持有该作业（排队或执行中）的 worker 及其最近一次续约时间；续约超时的作业才会被其他 worker 接管
+    worker_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(Float, nullable=True)
+
+# 按内容寻址的生成结果缓存，键为 (任务, 模型池, 规范化内容, 生成参数) 的哈希
+class LLMResponseCache(Base):
+    __tablename__ = 'llm_response_cache'
+    cache_key = Column(String(64), primary_key=True)
+    task = Column(String, nullable=False, index=True)
+    model_name = Column(String, nullable=True)
+    response_text = Column(Text, nullable=False)
+    created_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+
+# 模型发现结果，按 API Key 集合的指纹持久化，重启后无需重新查询
+class ModelDiscoveryCache(Base):
+    __tablename__ = 'model_discovery_cache'
+    key_fingerprint = Column(String(64), primary_key=True)
+    models = Column(JSON, nullable=False)
+    discovered_at = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False)
+
+# Token 用量按 (用户, 模型, Key 指纹, 小时) 预聚合，统计接口只需扫描少量桶
+class TokenUsageRollup(Base):
+    __tablename__ = 'token_usage_rollups'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    key_id = Column(String(16), nullable=False)
+    bucket_start = Column(Integer, nullable=False)  # 整点的 Unix 时间戳
+    requests = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    candidates_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'bucket_start', 'model', 'key_id', name='_token_usage_bucket_uc'),
+    )
+
+# 消息正文压缩所用的 zstd 字典，由本库的消息样本训练；chat_messages.content_codec 中引用其 id
+# data 为空的行是某个 worker 正在训练时占用的名额，generation 的唯一索引保证同一代字典只有一个 worker 训练
+class CompressionDictionary(Base):
+    __tablename__ = 'compression_dictionaries'
+    id = Column(Integer, primary_key=True)
+    codec = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    created_at = Column(Float, nullable=False)
+    generation = Column(Integer, nullable=True)
+
+    __table_args__ = (Index('ix_compression_dictionaries_generation', 'generation', unique=True),)
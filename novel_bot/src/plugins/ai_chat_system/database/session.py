@@ -1,27 +1,64 @@
 # novel_bot/src/plugins/ai_chat_system/database/session.py
 
+import json
 from typing import AsyncGenerator
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from fastapi import Depends
 from nonebot import logger
 
-from .models import Base
+from .models import Base, ContentItem, ContentDisplayRank
 
 engine = None
 AsyncSessionLocal = None
 
+# [优化] SQLite 生产配置：WAL 允许读写并发，synchronous=NORMAL 在 WAL 下仍可保证一致性，
+# busy_timeout 让短暂的锁竞争等待而不是立即报 "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 10000,       # 毫秒
+    "cache_size": -64000,        # 负数表示 KiB，即约 64 MB
+    "mmap_size": 268435456,      # 256 MB
+    "temp_store": "MEMORY",
+}
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    # [核心修复] 关闭 sqlite3 驱动自带的隐式事务管理（它不会在 SAVEPOINT 前发出 BEGIN，
+    # 导致 RELEASE SAVEPOINT 直接提交），事务改由 _begin_sqlite_transaction 显式开始
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def _begin_sqlite_transaction(conn):
+    conn.exec_driver_sql("BEGIN")
+
 def initialize_database(db_url: str):
     global engine, AsyncSessionLocal
     try:
-        # [核心修复] 添加连接池参数以提高健壮性
-        engine = create_async_engine(
-            db_url, 
-            echo=False,
-            pool_size=10,  # 增加连接池大小
-            max_overflow=20, # 允许额外的临时连接
-            pool_recycle=3600, # 每小时回收一次连接，防止连接因空闲而失效
-            pool_pre_ping=True # 在每次从池中获取连接时，先执行一个简单的 "ping" 查询来检查其有效性
-        )
+        if make_url(db_url).get_backend_name() == "sqlite":
+            # 连接池参数对 SQLite 没有意义（写入由文件锁串行化），只设置 pragma
+            engine = create_async_engine(db_url, echo=False, connect_args={"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000})
+            event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+            event.listen(engine.sync_engine, "begin", _begin_sqlite_transaction)
+            logger.info("Database engine initialized with SQLite profile (WAL, synchronous=NORMAL).")
+        else:
+            # [核心修复] 添加连接池参数以提高健壮性
+            engine = create_async_engine(
+                db_url, 
+                echo=False,
+                pool_size=10,  # 增加连接池大小
+                max_overflow=20, # 允许额外的临时连接
+                pool_recycle=3600, # 每小时回收一次连接，防止连接因空闲而失效
+                pool_pre_ping=True # 在每次从池中获取连接时，先执行一个简单的 "ping" 查询来检查其有效性
+            )
+            logger.info("Database engine initialized successfully with robust pool settings.")
         AsyncSessionLocal = async_sessionmaker(
             autocommit=False, 
             autoflush=False, 
@@ -29,16 +66,112 @@ def initialize_database(db_url: str):
             class_=AsyncSession,
             expire_on_commit=False
         )
-        logger.info("Database engine and session maker initialized successfully with robust pool settings.")
     except Exception as e:
         logger.critical(f"Failed to initialize database connection: {e}", exc_info=True)
         raise
 
+def dialect_insert(dialect: str):
+    """返回支持 ON CONFLICT 的方言 insert()（PostgreSQL 或 SQLite），用于 upsert。"""
+    return postgresql.insert if dialect == "postgresql" else sqlite.insert
+
+async def shutdown_database():
+    """应用关闭时调用：先写完写入队列中剩余的数据，再释放连接。"""
+    from .write_queue import write_queue
+    await write_queue.stop()
+    if engine is not None:
+        await engine.dispose()
+        logger.info("Database engine disposed.")
+
+def _add_missing_columns(sync_conn):
+    """
+    create_all 只会创建缺失的表，不会为已存在的表补充新增的列。
+    这里为旧数据库补上模型中新增的可空列，以及缺失的索引。
+    """
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable:
+                logger.warning(f"Database: Cannot auto-add non-nullable column '{table.name}.{column.name}'. Please migrate manually.")
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"Database: Added missing column '{table.name}.{column.name}' ({column_type}).")
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+def _backfill_message_sequences(sync_conn):
+    """为旧数据中没有 seq 的消息按 (timestamp, id) 顺序补上会话内序号。"""
+    rows = sync_conn.execute(text(
+        "SELECT id, session_id FROM chat_messages WHERE seq IS NULL ORDER BY session_id, timestamp, id"
+    )).all()
+    if not rows:
+        return
+    next_seq = {
+        session_id: (max_seq or 0) + 1
+        for session_id, max_seq in sync_conn.execute(text(
+            "SELECT session_id, MAX(seq) FROM chat_messages GROUP BY session_id"
+        ))
+    }
+    updates = []
+    for message_id, session_id in rows:
+        updates.append({"id": message_id, "seq": next_seq[session_id]})
+        next_seq[session_id] += 1
+    sync_conn.execute(text("UPDATE chat_messages SET seq = :seq WHERE id = :id"), updates)
+    logger.info(f"Database: Backfilled sequence numbers for {len(updates)} chat messages.")
+
+def _backfill_content_index_columns(sync_conn):
+    """为旧的 content_items 行补上由 data 冗余出来的 name / display_name / is_user_persona 列。"""
+    rows = sync_conn.execute(text("SELECT id, data FROM content_items WHERE is_user_persona IS NULL")).all()
+    if not rows:
+        return
+    updates = []
+    for item_id, data in rows:
+        if isinstance(data, str):
+            data = json.loads(data)
+        updates.append({"id": item_id, **ContentItem.index_columns(data)})
+    sync_conn.execute(text(
+        "UPDATE content_items SET name = :name, display_name = :display_name, is_user_persona = :is_user_persona WHERE id = :id"
+    ), updates)
+    logger.info(f"Database: Backfilled index columns for {len(updates)} content items.")
+
+def _backfill_display_ranks(sync_conn):
+    """把尚未展开的 users.display_order 写入 content_display_ranks。"""
+    rows = sync_conn.execute(text(
+        "SELECT user_id, display_order FROM users "
+        "WHERE display_order IS NOT NULL AND user_id NOT IN (SELECT DISTINCT owner_id FROM content_display_ranks)"
+    )).all()
+    ranks = []
+    for user_id, display_order in rows:
+        if isinstance(display_order, str):
+            display_order = json.loads(display_order)
+        for list_key, order in (display_order or {}).items():
+            if isinstance(order, list):
+                ranks.extend(ContentDisplayRank.rows_for(user_id, list_key, order))
+    if ranks:
+        sync_conn.execute(text(
+            "INSERT INTO content_display_ranks (owner_id, list_key, filename, rank) VALUES (:owner_id, :list_key, :filename, :rank)"
+        ), ranks)
+        logger.info(f"Database: Backfilled {len(ranks)} display ranks.")
+
 async def create_db_and_tables():
+    from ..services.search_index import ensure_search_index
+    from ..services.message_compression import load_compression_dictionaries
     if not engine:
         raise RuntimeError("Database engine not initialized.")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_backfill_message_sequences)
+        await conn.run_sync(_backfill_content_index_columns)
+        await conn.run_sync(_backfill_display_ranks)
+        await conn.run_sync(ensure_search_index)
+        await conn.run_sync(load_compression_dictionaries)
     logger.info("Database tables created/verified.")
 
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
@@ -0,0 +1,167 @@
+# novel_bot/src/plugins/ai_chat_system/database/write_queue.py
+# 职责: SQLite 的单写者队列。后台写入被串行化并按批提交（每个写入在各自的 SAVEPOINT 中执行，
+#       一批只 COMMIT 一次），避免并发提交互相争抢写锁导致 "database is locked"；读取不经过队列。
+#       非 SQLite 数据库直接在独立会话中执行并提交。
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from nonebot import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import session as db_session
+
+T = TypeVar("T")
+WriteJob = Callable[[AsyncSession], Awaitable[T]]
+
+MAX_BATCH_SIZE = 64
+_LATENCY_WINDOW = 256
+
+
+class WriteQueueMetrics:
+    def __init__(self):
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.batches = 0
+        self.failed_commits = 0
+        self.max_batch_size = 0
+        self._commit_ms: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._wait_ms: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def record_batch(self, size: int, commit_ms: float, wait_ms: List[float]):
+        self.batches += 1
+        self.max_batch_size = max(self.max_batch_size, size)
+        self._commit_ms.append(commit_ms)
+        self._wait_ms.extend(wait_ms)
+
+    @staticmethod
+    def _percentile(values: Deque[float], quantile: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(int(len(ordered) * quantile), len(ordered) - 1)], 2)
+
+    def snapshot(self, queue_depth: int) -> Dict[str, Any]:
+        return {
+            "queue_depth": queue_depth,
+            "jobs": self.jobs,
+            "failed_jobs": self.failed_jobs,
+            "batches": self.batches,
+            "failed_commits": self.failed_commits,
+            "avg_batch_size": round(self.jobs / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "commit_ms_p50": self._percentile(self._commit_ms, 0.5),
+            "commit_ms_p95": self._percentile(self._commit_ms, 0.95),
+            "queue_wait_ms_p95": self._percentile(self._wait_ms, 0.95),
+        }
+
+
+class DatabaseWriteQueue:
+    """
+    submit(job) 中的 job 接收一个 AsyncSession，只负责执行写操作，不要自行 commit。
+    工作协程在首次提交时按需启动，stop() 会先处理完队列中剩余的写入。
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self.metrics = WriteQueueMetrics()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _serialized() -> bool:
+        return db_session.engine is not None and db_session.engine.dialect.name == "sqlite"
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, job: WriteJob) -> T:
+        if not db_session.AsyncSessionLocal:
+            raise RuntimeError("Database session maker not initialized.")
+        if not self._serialized():
+            async with db_session.AsyncSessionLocal() as db:
+                result = await job(db)
+                await db.commit()
+                return result
+
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((job, future, time.monotonic()))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                next_item = self._queue.get_nowait()
+                if next_item is None:
+                    stopping = True
+                    break
+                batch.append(next_item)
+            try:
+                await self._commit_batch(batch)
+            except Exception as e:
+                logger.error(f"DB_WRITE_QUEUE: Unexpected error while committing a batch: {e}", exc_info=True)
+            if stopping:
+                return
+
+    async def _commit_batch(self, batch: List[Tuple[WriteJob, asyncio.Future, float]]):
+        started_at = time.monotonic()
+        wait_ms = [(started_at - enqueued_at) * 1000 for _, _, enqueued_at in batch]
+        succeeded: List[Tuple[asyncio.Future, Any]] = []
+
+        async with db_session.AsyncSessionLocal() as db:
+            for job, future, _ in batch:
+                if future.done():  # 调用方已取消
+                    continue
+                self.metrics.jobs += 1
+                try:
+                    async with db.begin_nested():
+                        result = await job(db)
+                    succeeded.append((future, result))
+                except Exception as e:
+                    self.metrics.failed_jobs += 1
+                    if not future.done():
+                        future.set_exception(e)
+
+            commit_started_at = time.monotonic()
+            try:
+                await db.commit()
+            except Exception as e:
+                self.metrics.failed_commits += 1
+                logger.error(f"DB_WRITE_QUEUE: Commit of {len(succeeded)} writes failed: {e}")
+                await db.rollback()
+                for future, _ in succeeded:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        self.metrics.record_batch(len(batch), (time.monotonic() - commit_started_at) * 1000, wait_ms)
+        for future, result in succeeded:
+            if not future.done():
+                future.set_result(result)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {"serialized": self._serialized(), **self.metrics.snapshot(self.queue_depth())}
+
+    async def stop(self):
+        """处理完已入队的写入后停止工作协程（应用关闭时调用）。"""
+        if self._worker is None or self._worker.done():
+            return
+        self._queue.put_nowait(None)
+        await self._worker
+        self._worker = None
+
+
+write_queue = DatabaseWriteQueue()
@@ -4,8 +4,8 @@ import asyncio
 import logging
 import traceback
 import re
+import bisect
 from typing import Any, AsyncGenerator, Dict, List, Optional
-import math
 
 import google.generativeai as genai
 from google.generativeai import retriever
@@ -13,9 +13,12 @@ from google.generativeai.types import AsyncGenerateContentResponse, generation_t
 from nonebot.adapters.onebot.v11 import MessageEvent
 
 from . import global_state
-from .prompt_builder import build_system_prompt
+from .prompt_builder import build_system_prompt_sections
 from .tools.web_search import execute_web_search, web_search_tool
 from .utils.api_utils import call_llm_service
+from .utils.tokenizer import (
+    TokenizerBackend, DEFAULT_TOKENIZER, count_tokens, get_tokenizer, get_tokenizer_for_model
+)
 
 logger = logging.getLogger("nonebot")
 
@@ -47,39 +50,51 @@ def _safe_get_response_text(response: Any) -> Optional[str]:
         logger.warning(f"Error accessing response text: {e}")
         return None
 
+def _model_name_of(model_entry: Any) -> Optional[str]:
+    """模型池中的条目可能是模型名，也可能是 ApiManager 返回的模型详情字典。"""
+    if isinstance(model_entry, dict):
+        return model_entry.get("name")
+    return model_entry if isinstance(model_entry, str) else None
+
+def _get_message_token_count(message: Dict, tokenizer: TokenizerBackend) -> int:
+    """优先使用写入时缓存的 Token 数，只有缓存缺失或计数后端不一致时才重新计算。"""
+    cached_count = message.get("tokenCount")
+    if isinstance(cached_count, int) and message.get("tokenizer") == tokenizer.name:
+        return cached_count
+
+    content = message.get("content", "") or "".join(p.get("text", "") for p in message.get("parts", []) if isinstance(p, dict))
+    try:
+        token_count = tokenizer.count(content)
+    except Exception as e:
+        logger.warning(f"AI_CHAT: Tokenizer '{tokenizer.name}' failed on a history message: {e}. Using heuristic.")
+        tokenizer = get_tokenizer(DEFAULT_TOKENIZER)
+        token_count = tokenizer.count(content)
+
+    message["tokenCount"] = token_count
+    message["tokenizer"] = tokenizer.name
+    return token_count
+
 async def _truncate_history_by_tokens(
     system_prompt: str,
-    history: List[Dict]
+    history: List[Dict],
+    model_name: Optional[str] = None
 ) -> List[Dict]:
-    """根据Token限制智能截断历史记录 (本地估算)。"""
-    def estimate_tokens(text: str) -> int:
-        # 一个非常粗略的估算：平均每个中文字符约占1.5个token
-        # 英文则大约是 字符数/4
-        # 这里用一个更简单的混合估算：字符数 / 2
-        return math.ceil(len(text) / 2)
+    """根据Token限制截断历史记录：对缓存的逐条 Token 数做后缀和，再二分查找可保留的条数。"""
+    tokenizer = get_tokenizer_for_model(model_name)
+    budget = MAX_CONTEXT_TOKENS - count_tokens(system_prompt, model_name)
+    if budget <= 0:
+        logger.warning(f"AI_CHAT: System prompt alone exceeds the context budget ({MAX_CONTEXT_TOKENS} tokens). Sending no history.")
+        return []
 
-    try:
-        system_prompt_tokens = estimate_tokens(system_prompt)
-        current_tokens = system_prompt_tokens
-        
-        truncated_history = []
-        
-        for message in reversed(history):
-            content = message.get("content", "") or "".join(p.get("text", "") for p in message.get("parts", []))
-            message_tokens = estimate_tokens(content)
-            
-            if current_tokens + message_tokens > MAX_CONTEXT_TOKENS:
-                logger.info(f"AI_CHAT: Token limit reached (estimated). Truncating history. Total tokens: {current_tokens}")
-                break
-            
-            current_tokens += message_tokens
-            truncated_history.append(message)
-            
-        return list(reversed(truncated_history))
-        
-    except Exception as e:
-        logger.error(f"AI_CHAT: Failed to truncate history by tokens (local estimation): {e}. Falling back to simple truncation.", exc_info=True)
-        return history[-50:]
+    # suffix_sums[k] 为最后 k 条消息的 Token 总数，单调不减
+    suffix_sums = [0]
+    for message in reversed(history):
+        suffix_sums.append(suffix_sums[-1] + _get_message_token_count(message, tokenizer))
+
+    keep_count = bisect.bisect_right(suffix_sums, budget) - 1
+    if keep_count < len(history):
+        logger.info(f"AI_CHAT: Token limit reached. Keeping last {keep_count}/{len(history)} messages ({suffix_sums[keep_count]} tokens).")
+    return history[len(history) - keep_count:]
 
 async def _handle_generation_stream(
     response_generator: AsyncGenerator[Dict[str, Any], None],
@@ -88,7 +103,8 @@ async def _handle_generation_stream(
     is_gemini_provider: bool
 ) -> AsyncGenerator[Dict[str, Any], None]:
     """内部函数，用于处理来自 call_llm_service 的流式响应。"""
-    full_response_text = ""
+    # [优化] 用列表收集文本块，最后一次性拼接，避免长回复时反复拼接字符串
+    response_parts: List[str] = []
     usage_metadata = None
     
     async for response_part in response_generator:
@@ -107,12 +123,13 @@ async def _handle_generation_stream(
 
         chunk_text = _safe_get_response_text(response_part)
         if chunk_text:
-            full_response_text += chunk_text
+            response_parts.append(chunk_text)
             yield {"type": "chunk", "content": chunk_text}
         else:
             logger.debug(f"AI_CHAT: Skipping an empty or status-only chunk.")
             
     if not stop_event.is_set():
+        full_response_text = "".join(response_parts)
         if not full_response_text.strip():
             logger.warning(f"AI_CHAT: Generation for user {user_id_str} resulted in an empty response.")
             yield {"type": "error", "payload": {"code": "EMPTY_RESPONSE", "message": "(AI模型本次未生成任何有效内容)"}}
@@ -137,7 +154,8 @@ async def generate_ai_reply(
     stop_event: asyncio.Event,
     temp_model_override: Optional[str] = None,
     request_story_options: bool = False,
-    system_prompt_override: Optional[str] = None
+    system_prompt_override: Optional[str] = None,
+    cacheable_prefix: Optional[str] = None
 ) -> AsyncGenerator[Dict[str, Any], None]:
     logger.info(f"AI_CHAT: Starting unified generation pipeline for user {user_id_str}, action: {action}")
     
@@ -180,7 +198,11 @@ async def generate_ai_reply(
     active_preset_name = user_config.get("preset")
     active_preset = available_presets.get(active_preset_name, {})
     
-    system_prompt = system_prompt_override or build_system_prompt(user_config, user_text, event, request_story_options)
+    if system_prompt_override:
+        system_prompt = system_prompt_override
+    else:
+        cacheable_prefix, dynamic_tail = build_system_prompt_sections(user_config, user_text, event, request_story_options, history=api_history)
+        system_prompt = cacheable_prefix + dynamic_tail
     
     if not system_prompt.strip():
         logger.error(f"AI_CHAT: Aborting generation for user {user_id_str} because system prompt is empty.")
@@ -190,17 +212,17 @@ async def generate_ai_reply(
     model_pool = []
     if llm_service_config.get("provider") == "koboldai_horde":
         model_pool = llm_service_config.get("horde_models", ["Chronos-Hermes-13b"])
-        final_history = await _truncate_history_by_tokens(system_prompt, api_history) if api_history else api_history
+        final_history = await _truncate_history_by_tokens(system_prompt, api_history, _model_name_of(model_pool[0]) if model_pool else None) if api_history else api_history
     else:
         verified_user_models = global_state.api_key_model_cache.get(user_id_str, [])
         model_pool = [temp_model_override] if temp_model_override else verified_user_models
         if not model_pool: model_pool = ["models/gemini-1.5-pro-latest"] # Fallback
-        final_history = await _truncate_history_by_tokens(system_prompt, api_history) if api_history else api_history
+        final_history = await _truncate_history_by_tokens(system_prompt, api_history, _model_name_of(model_pool[0])) if api_history else api_history
 
     kwargs_for_service = {}
-    if is_gemini_provider:
-        # ... (此处逻辑保持不变)
-        pass
+    if is_gemini_provider and cacheable_prefix and system_prompt.startswith(cacheable_prefix):
+        # [优化] 稳定前缀可以交给服务端上下文缓存，只有动态尾部需要每轮发送
+        kwargs_for_service["cacheable_prefix"] = cacheable_prefix
 
     generation_config = genai.types.GenerationConfig(
         temperature=float(active_preset.get("temperature", 0.8)),
@@ -210,6 +232,7 @@ async def generate_ai_reply(
     
     service_config_to_pass = {**llm_service_config, "api_keys": user_config.get('api_keys', [])}
     
+    response_generator = None
     try:
         response_generator, model_name_used = await call_llm_service(
             user_id=user_id_str, service_config=service_config_to_pass, model_pool=model_pool,
@@ -232,6 +255,11 @@ async def generate_ai_reply(
     except Exception as e:
         logger.critical(f"AI_CHAT: Unexpected critical error in generation pipeline for user {user_id_str}':\n{traceback.format_exc()}")
         yield {"type": "error", "payload": {"code": "PIPELINE_CRITICAL", "message": f"处理您的请求时发生意外错误: {type(e).__name__}"}}
+    finally:
+        # [优化] 无论流是否被完整消费（用户中止、客户端断开、尚未开始迭代就被取消），都及时关闭它以归还 API Key
+        close_stream = getattr(response_generator, "aclose", None)
+        if close_stream is not None:
+            await close_stream()
 
 async def perform_message_action_generation(
     user_id_str: str,
@@ -248,7 +276,8 @@ async def perform_message_action_generation(
     
     mock_event = MessageEvent.parse_obj({"message": "", "user_id": int(user_id_str) if user_id_str.isdigit() else 10000, "message_type": "private"})
 
-    system_prompt = build_system_prompt(user_config, "", mock_event, False)
+    stable_prefix, dynamic_tail = build_system_prompt_sections(user_config, "", mock_event, False, history=history_for_action)
+    system_prompt = stable_prefix + dynamic_tail
     
     action_instruction = ""
     if action in ['rewrite', 'regenerate']:
@@ -273,6 +302,7 @@ async def perform_message_action_generation(
         "action", 
         asyncio.Event(),
         request_story_options=(action == 'regenerate_options'),
-        system_prompt_override=final_system_prompt
+        system_prompt_override=final_system_prompt,
+        cacheable_prefix=stable_prefix
     ):
         yield chunk
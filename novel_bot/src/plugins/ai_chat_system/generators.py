@@ -2,7 +2,7 @@
 
 import json
 import logging
-from typing import Any, AsyncGenerator, Dict, List, Optional
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
 import uuid
 
 import google.generativeai as genai
@@ -10,6 +10,7 @@ from google.generativeai.types import generation_types
 
 from . import global_state
 from .utils.api_utils import call_llm_service
+from .services.response_cache import make_cache_key, response_cache
 
 logger = logging.getLogger("nonebot")
 
@@ -41,6 +42,49 @@ def _convert_history_to_api_format(history: List[Dict]) -> List[Dict]:
             })
     return api_history
 
+async def _call_with_response_cache(
+    task: str,
+    user_id: str,
+    service_config: Dict,
+    model_pool: List[str],
+    contents: List[Any],
+    system_instruction: Optional[str] = None,
+    generation_config: Optional[Any] = None,
+    use_cache: bool = True,
+    validate: Optional[Callable[[str], Any]] = None
+) -> str:
+    """
+    非流式调用并返回文本。相同的 (任务, 模型池, 内容, 生成参数) 直接返回缓存结果；
+    validate 用于在写入缓存前校验输出，校验失败的结果不会被缓存。
+    """
+    cache_key = make_cache_key(task, model_pool, contents, system_instruction, generation_config) if use_cache else None
+    if cache_key:
+        cached_text = await response_cache.get(cache_key)
+        if cached_text is not None:
+            logger.debug(f"AI_GENERATOR: Response cache hit for task '{task}'.")
+            return cached_text
+
+    response, model_name = await call_llm_service(
+        user_id=user_id,
+        service_config=service_config,
+        model_pool=model_pool,
+        contents=contents,
+        system_instruction=system_instruction,
+        generation_config=generation_config,
+        stream=False
+    )
+    if not response.candidates: raise ValueError("AI响应中不包含任何候选内容。")
+
+    response_text = response.text
+    if validate:
+        validate(response_text)
+    if cache_key:
+        await response_cache.set(cache_key, task, model_name, response_text)
+    return response_text
+
+def _clean_json_text(text: str) -> str:
+    return text.strip().removeprefix("```json").removesuffix("```").strip()
+
 DEFAULT_SYSTEM_PROMPT_TEMPLATES = {
     "character_card": """
 # 任务: 创作角色卡
@@ -146,7 +190,8 @@ async def _generate_structured_json(
     prompt: str, 
     user_id: str,
     selected_presets: Optional[List[str]] = None,
-    selected_worlds: Optional[List[str]] = None
+    selected_worlds: Optional[List[str]] = None,
+    use_cache: bool = True
 ) -> str:
     dm = global_state.data_manager
     if not dm: raise RuntimeError("DataManager not initialized.")
@@ -165,20 +210,18 @@ async def _generate_structured_json(
             response_mime_type="application/json", temperature=0.75
         )
         
-        response, _ = await call_llm_service(
+        response_text = await _call_with_response_cache(
+            task=f"structured:{task_name}",
             user_id=user_id,
             service_config={**llm_config, "api_keys": user_config.get('api_keys', [])},
             model_pool=model_pool,
             contents=[{'role': 'user', 'parts': [system_instruction]}],
             generation_config=generation_config,
-            stream=False
+            use_cache=use_cache,
+            validate=lambda text: json.loads(_clean_json_text(text))
         )
         
-        if not response.candidates: raise ValueError("AI响应中不包含任何候选内容。")
-
-        cleaned_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
-        
-        parsed_json = json.loads(cleaned_text)
+        parsed_json = json.loads(_clean_json_text(response_text))
         if task_name == 'world_info' and 'entries' in parsed_json:
             for entry in parsed_json['entries']:
                 if 'uid' not in entry: entry['uid'] = str(uuid.uuid4())
@@ -192,20 +235,20 @@ async def _generate_structured_json(
         logger.error(f"AI_GENERATOR ({task_name.capitalize()}): Generation failed for user '{user_id}': {e}", exc_info=True)
         raise RuntimeError(f"AI生成时发生内部错误: {e}") from e
 
-async def generate_character_from_prompt(prompt: str, user_id: str, selected_presets: Optional[List[str]] = None, selected_worlds: Optional[List[str]] = None) -> str:
-    return await _generate_structured_json("character_card", prompt, user_id, selected_presets, selected_worlds)
+async def generate_character_from_prompt(prompt: str, user_id: str, selected_presets: Optional[List[str]] = None, selected_worlds: Optional[List[str]] = None, use_cache: bool = True) -> str:
+    return await _generate_structured_json("character_card", prompt, user_id, selected_presets, selected_worlds, use_cache)
 
-async def generate_user_persona_from_prompt(prompt: str, user_id: str, selected_presets: Optional[List[str]] = None, selected_worlds: Optional[List[str]] = None) -> str:
-    return await _generate_structured_json("user_persona", prompt, user_id, selected_presets, selected_worlds)
+async def generate_user_persona_from_prompt(prompt: str, user_id: str, selected_presets: Optional[List[str]] = None, selected_worlds: Optional[List[str]] = None, use_cache: bool = True) -> str:
+    return await _generate_structured_json("user_persona", prompt, user_id, selected_presets, selected_worlds, use_cache)
 
-async def generate_world_info_from_prompt(prompt: str, user_id: str, selected_presets: Optional[List[str]] = None, selected_worlds: Optional[List[str]] = None) -> str:
-    return await _generate_structured_json("world_info", prompt, user_id, selected_presets, selected_worlds)
+async def generate_world_info_from_prompt(prompt: str, user_id: str, selected_presets: Optional[List[str]] = None, selected_worlds: Optional[List[str]] = None, use_cache: bool = True) -> str:
+    return await _generate_structured_json("world_info", prompt, user_id, selected_presets, selected_worlds, use_cache)
 
-async def generate_story_package_from_prompt(prompt: str, user_id: str) -> Dict[str, Any]:
-    json_string = await _generate_structured_json("story_package", prompt, user_id)
+async def generate_story_package_from_prompt(prompt: str, user_id: str, use_cache: bool = True) -> Dict[str, Any]:
+    json_string = await _generate_structured_json("story_package", prompt, user_id, use_cache=use_cache)
     return json.loads(json_string)
 
-async def generate_title_from_history(user_id: str, history: List[Dict]) -> str:
+async def generate_title_from_history(user_id: str, history: List[Dict], use_cache: bool = True) -> str:
     system_prompt = "你是一个对话总结专家。请仔细阅读以下对话历史，为其生成一个不超过10个字的、简洁且能概括核心内容的标题。只返回标题文本，不要包含任何其他说明或引号。"
     api_history = _convert_history_to_api_format(history)
     
@@ -215,18 +258,19 @@ async def generate_title_from_history(user_id: str, history: List[Dict]) -> str:
     llm_config = user_config.get("llm_service_config", {})
 
     model_pool = get_best_generation_model_pool()
-    response, _ = await call_llm_service(
+    response_text = await _call_with_response_cache(
+        task="title",
         user_id=user_id,
         service_config={**llm_config, "api_keys": user_config.get('api_keys', [])},
         model_pool=model_pool,
         contents=api_history,
         system_instruction=system_prompt,
         generation_config=genai.types.GenerationConfig(temperature=0.3, max_output_tokens=50),
-        stream=False
+        use_cache=use_cache
     )
-    return response.text.strip().replace("\"", "").replace("”", "").replace("“", "")
+    return response_text.strip().replace("\"", "").replace("”", "").replace("“", "")
 
-async def generate_memory_from_history(user_id: str, history: List[Dict]) -> List[str]:
+async def generate_memory_from_history(user_id: str, history: List[Dict], use_cache: bool = True) -> List[str]:
     system_prompt = """你是一个信息提取和总结的AI助手。你的任务是分析下面的对话历史，并提取出关于角色、关系、关键事件、重要设定或用户偏好等长期性的、值得记住的核心信息。
 
 # 规则
@@ -244,7 +288,8 @@ async def generate_memory_from_history(user_id: str, history: List[Dict]) -> Lis
     llm_config = user_config.get("llm_service_config", {})
 
     model_pool = get_best_generation_model_pool()
-    response, _ = await call_llm_service(
+    response_text = await _call_with_response_cache(
+        task="memory",
         user_id=user_id,
         service_config={**llm_config, "api_keys": user_config.get('api_keys', [])},
         model_pool=model_pool,
@@ -254,14 +299,18 @@ async def generate_memory_from_history(user_id: str, history: List[Dict]) -> Lis
             response_mime_type="application/json",
             temperature=0.5
         ),
-        stream=False
+        use_cache=use_cache,
+        validate=_parse_memory_entries
     )
+    return _parse_memory_entries(response_text)
+
+def _parse_memory_entries(response_text: str) -> List[str]:
     try:
-        data = json.loads(response.text)
+        data = json.loads(response_text)
         if isinstance(data, dict) and "entries" in data and isinstance(data["entries"], list):
             return data["entries"]
         else:
             raise ValueError("AI返回的JSON格式不正确，缺少'entries'数组。")
     except (json.JSONDecodeError, ValueError) as e:
-        logger.error(f"解析记忆提取结果失败: {e}\n原始回复: {response.text}")
+        logger.error(f"解析记忆提取结果失败: {e}\n原始回复: {response_text}")
         raise
\ No newline at end of file
@@ -0,0 +1,244 @@
+# novel_bot/src/plugins/ai_chat_system/key_scheduler.py
+# 职责: 感知速率限制的 API Key 调度器。为每个 Key 维护按模型划分的 RPM/TPM 令牌桶、
+#       进行中的请求数和退避状态，并通过惰性更新的最小堆以 O(log n) 选出负载最低的 Key。
+
+import heapq
+import random
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .constants import (
+    API_KEY_COOLDOWN_DURATION,
+    DEFAULT_KEY_RPM,
+    DEFAULT_KEY_TPM,
+    KEY_BACKOFF_BASE_SECONDS,
+)
+
+_RETRY_IN_PATTERN = re.compile(r"retry (?:in|after) (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+class TokenBucket:
+    """按分钟补充的令牌桶。"""
+
+    __slots__ = ("capacity", "tokens", "refill_per_second", "updated_at")
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.refill_per_second = per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+            self.updated_at = now
+
+    def available(self, amount: float, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= min(amount, self.capacity)
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+    def utilisation(self, now: float) -> float:
+        self._refill(now)
+        return round(1 - max(self.tokens, 0.0) / self.capacity, 3) if self.capacity else 0.0
+
+
+class KeyState:
+    """单个 Key 的调度状态。"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.in_flight = 0
+        self.backoff_until = 0.0
+        self.consecutive_failures = 0
+        self.version = 0
+        self.buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self.stats = {"requests": 0, "successes": 0, "failures": 0, "rate_limited": 0}
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """判断异常是否为 429 / RESOURCE_EXHAUSTED 类的限流错误。"""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "quota" in message.lower()
+
+
+def _is_invalid_key_error(error: BaseException) -> bool:
+    message = str(error)
+    return "API_KEY_INVALID" in message or "PERMISSION_DENIED" in message
+
+
+def parse_retry_after(error: BaseException) -> Optional[float]:
+    """从异常中提取服务商建议的重试等待秒数（Retry-After 头、RetryInfo 或错误文本）。"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("Retry-After") or headers.get("retry-after")
+        if value:
+            try:
+                return max(float(value), 0.0)
+            except ValueError:
+                pass
+
+    for detail in getattr(error, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            seconds = getattr(retry_delay, "seconds", 0) + getattr(retry_delay, "nanos", 0) / 1e9
+            if seconds > 0:
+                return seconds
+
+    match = _RETRY_IN_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class KeyScheduler:
+    """
+    选择 Key 时依次比较：进行中的请求数、近期连续失败次数、入堆顺序。
+    状态变化时推入新的堆条目并提升版本号，旧条目在弹出时按版本号丢弃（惰性删除）。
+    """
+
+    def __init__(self, key_count: int, rate_limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.states: List[KeyState] = [KeyState(i) for i in range(key_count)]
+        self.rate_limits = rate_limits or {}
+        self._heap: List[Tuple[int, int, int, int, int]] = []
+        self._sequence = 0
+        for state in self.states:
+            self._push(state)
+
+    def _push(self, state: KeyState):
+        state.version += 1
+        self._sequence += 1
+        heapq.heappush(self._heap, (state.in_flight, state.consecutive_failures, self._sequence, state.index, state.version))
+        # 过期条目过多时重建堆，避免其无限增长
+        if len(self._heap) > 4 * len(self.states) + 16:
+            self._heap = [entry for entry in self._heap if entry[4] == self.states[entry[3]].version]
+            heapq.heapify(self._heap)
+
+    def _limits_for(self, model_name: str) -> Tuple[float, float]:
+        for prefix, limits in self.rate_limits.items():
+            if model_name.startswith(prefix) or model_name.startswith(f"models/{prefix}"):
+                return limits.get("rpm", DEFAULT_KEY_RPM), limits.get("tpm", DEFAULT_KEY_TPM)
+        return DEFAULT_KEY_RPM, DEFAULT_KEY_TPM
+
+    def _buckets(self, state: KeyState, model_name: str) -> Tuple[TokenBucket, TokenBucket]:
+        buckets = state.buckets.get(model_name)
+        if buckets is None:
+            rpm, tpm = self._limits_for(model_name)
+            buckets = state.buckets[model_name] = (TokenBucket(rpm), TokenBucket(tpm))
+        return buckets
+
+    def acquire(self, model_name: str, estimated_tokens: int = 0, exclude: Iterable[int] = ()) -> Optional[int]:
+        """
+        选出负载最低、未处于退避期且令牌桶有余量的 Key，并将其进行中请求数加一。
+        所有可用 Key 的令牌桶都已耗尽时退而选择负载最低者（令牌桶只是软限制）；
+        全部 Key 都在退避或被排除时返回 None。
+        """
+        now = time.monotonic()
+        excluded = set(exclude)
+        popped = []
+        chosen: Optional[KeyState] = None
+        fallback: Optional[KeyState] = None
+
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            state = self.states[entry[3]]
+            if entry[4] != state.version:
+                continue
+            popped.append(entry)
+            if state.index in excluded or state.backoff_until > now:
+                continue
+            request_bucket, token_bucket = self._buckets(state, model_name)
+            if request_bucket.available(1, now) and token_bucket.available(estimated_tokens, now):
+                chosen = state
+                break
+            if fallback is None:
+                fallback = state
+
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+
+        chosen = chosen or fallback
+        if chosen is None:
+            return None
+
+        request_bucket, token_bucket = self._buckets(chosen, model_name)
+        request_bucket.consume(1, now)
+        token_bucket.consume(estimated_tokens, now)
+        chosen.in_flight += 1
+        chosen.stats["requests"] += 1
+        self._push(chosen)
+        return chosen.index
+
+    def release(self, index: int, error: Optional[BaseException] = None, cancelled: bool = False):
+        """请求结束时调用。error 为 None 表示成功；被主动取消的请求只减少进行中计数。"""
+        state = self.states[index]
+        state.in_flight = max(state.in_flight - 1, 0)
+        if cancelled:
+            self._push(state)
+        elif error is None:
+            self.report_success(index)
+        else:
+            self.report_failure(index, error)
+
+    def report_success(self, index: int):
+        state = self.states[index]
+        state.stats["successes"] += 1
+        state.consecutive_failures = 0
+        state.backoff_until = 0.0
+        self._push(state)
+
+    def report_failure(self, index: int, error: Optional[BaseException] = None):
+        """按指数退避（带抖动）冷却 Key；限流错误优先采用服务商给出的等待时间。"""
+        state = self.states[index]
+        state.stats["failures"] += 1
+        state.consecutive_failures += 1
+
+        delay = min(KEY_BACKOFF_BASE_SECONDS * (2 ** (state.consecutive_failures - 1)), API_KEY_COOLDOWN_DURATION)
+        delay = random.uniform(delay / 2, delay)
+        if error is not None and _is_invalid_key_error(error):
+            delay = API_KEY_COOLDOWN_DURATION
+        elif error is not None and is_rate_limit_error(error):
+            state.stats["rate_limited"] += 1
+            retry_after = parse_retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+        state.backoff_until = max(state.backoff_until, time.monotonic() + delay)
+        self._push(state)
+
+    def available_indices(self) -> List[int]:
+        """按当前负载排序的、未处于退避期的 Key 索引。"""
+        now = time.monotonic()
+        return [
+            state.index for state in sorted(self.states, key=lambda s: (s.in_flight, s.consecutive_failures, s.index))
+            if state.backoff_until <= now
+        ]
+
+    def get_stats(self, keys: List[str]) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "index": state.index,
+                "key": f"...{keys[state.index][-4:]}" if state.index < len(keys) else None,
+                "in_flight": state.in_flight,
+                "backoff_remaining": round(max(state.backoff_until - now, 0.0), 1),
+                "consecutive_failures": state.consecutive_failures,
+                **state.stats,
+                "models": {
+                    model_name: {
+                        "rpm_utilisation": request_bucket.utilisation(now),
+                        "tpm_utilisation": token_bucket.utilisation(now),
+                    }
+                    for model_name, (request_bucket, token_bucket) in state.buckets.items()
+                },
+            }
+            for state in self.states
+        ]
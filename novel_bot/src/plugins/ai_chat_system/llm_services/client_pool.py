@@ -0,0 +1,160 @@
+# novel_bot/src/plugins/ai_chat_system/llm_services/client_pool.py
+# 职责: 按 (服务商, API Key, 代理) 维护长期存活的客户端与模型句柄，
+#       取代进程全局的 genai.configure，使并发请求互不干扰并复用底层连接。
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.api_core import gapic_v1
+from google.generativeai import client as genai_client
+
+logger = logging.getLogger("nonebot")
+
+MAX_POOLED_CLIENTS = 64          # 同时保留的 (服务商, Key, 代理) 客户端组数量
+MAX_MODELS_PER_CLIENT = 32       # 每组客户端缓存的模型句柄数量
+EVICTED_CLIENT_GRACE_SECONDS = 120  # 被淘汰的客户端延迟关闭，让仍在进行中的请求完成
+
+
+def _fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _current_proxy() -> Optional[str]:
+    # gRPC 通道只在创建时读取代理环境变量（由 reconfigure_system 设置），
+    # 因此代理必须成为池键的一部分，代理变化后才会建立新的通道。
+    return os.environ.get("HTTPS_PROXY") or os.environ.get("https_proxy")
+
+
+class GeminiClientBundle:
+    """一个 API Key 对应的一组 Gemini 客户端，以及绑定到这组客户端的模型句柄。"""
+
+    def __init__(self, api_key: str, proxy: Optional[str]):
+        self.key_fingerprint = _fingerprint(api_key)
+        self.proxy = proxy
+        client_options = {"api_key": api_key}
+        client_info = gapic_v1.client_info.ClientInfo(user_agent=f"{genai_client.USER_AGENT}/{genai.__version__}")
+
+        self.generative_client = glm.GenerativeServiceAsyncClient(client_options=client_options, client_info=client_info)
+        self._client_options = client_options
+        self._client_info = client_info
+        self._model_client: Optional[glm.ModelServiceClient] = None
+        self._cache_client: Optional[glm.CacheServiceClient] = None
+        self._models: "OrderedDict[Tuple[str, str], genai.GenerativeModel]" = OrderedDict()
+
+    @property
+    def model_client(self) -> glm.ModelServiceClient:
+        """用于 list_models 的同步客户端，按需创建。"""
+        if self._model_client is None:
+            self._model_client = glm.ModelServiceClient(client_options=self._client_options, client_info=self._client_info)
+        return self._model_client
+
+    @property
+    def cache_client(self) -> glm.CacheServiceClient:
+        """用于服务端上下文缓存的同步客户端，按需创建。"""
+        if self._cache_client is None:
+            self._cache_client = glm.CacheServiceClient(client_options=self._client_options, client_info=self._client_info)
+        return self._cache_client
+
+    def get_model(self, model_name: str, system_instruction: Optional[str] = None) -> genai.GenerativeModel:
+        """
+        获取绑定到本组客户端的模型句柄。
+        生成参数、安全设置和工具在每次调用时传入，因此句柄只按 (模型, 系统提示) 区分。
+        """
+        instruction_key = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest() if system_instruction else ""
+        key = (model_name, instruction_key)
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            return model
+
+        model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+        self._bind(model)
+        self._models[key] = model
+        while len(self._models) > MAX_MODELS_PER_CLIENT:
+            self._models.popitem(last=False)
+        return model
+
+    def get_cached_model(self, cached_content: Any) -> genai.GenerativeModel:
+        """获取引用服务端缓存内容的模型句柄。"""
+        key = (f"cached:{cached_content.name}", "")
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            return model
+
+        model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+        self._bind(model)
+        self._models[key] = model
+        while len(self._models) > MAX_MODELS_PER_CLIENT:
+            self._models.popitem(last=False)
+        return model
+
+    def _bind(self, model: genai.GenerativeModel):
+        # GenerativeModel 在 _async_client 为空时才会去取全局默认客户端
+        model._async_client = self.generative_client
+
+    async def close(self):
+        self._models.clear()
+        try:
+            await self.generative_client.transport.close()
+            for sync_client in (self._model_client, self._cache_client):
+                if sync_client is not None:
+                    await asyncio.to_thread(sync_client.transport.close)
+        except Exception as e:
+            logger.debug(f"LLM_CLIENT_POOL: Error while closing client for key {self.key_fingerprint}: {e}")
+
+
+class LLMClientPool:
+    """
+    有界的 LRU 客户端池。
+    查找与创建都在事件循环线程内同步完成、中间没有 await，因此并发协程之间无需加锁，
+    同一个池键也不会被重复创建。
+    """
+
+    def __init__(self, max_clients: int = MAX_POOLED_CLIENTS):
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[Tuple[str, str, Optional[str]], GeminiClientBundle]" = OrderedDict()
+        self.stats = {"hits": 0, "creates": 0, "evictions": 0}
+
+    def get_gemini_client(self, api_key: str) -> GeminiClientBundle:
+        """获取（或创建）指定 Key 的 Gemini 客户端组。"""
+        key = ("google_gemini", _fingerprint(api_key), _current_proxy())
+        bundle = self._clients.get(key)
+        if bundle is not None:
+            self._clients.move_to_end(key)
+            self.stats["hits"] += 1
+            return bundle
+
+        bundle = GeminiClientBundle(api_key, key[2])
+        self._clients[key] = bundle
+        self.stats["creates"] += 1
+        while len(self._clients) > self.max_clients:
+            _, evicted = self._clients.popitem(last=False)
+            self.stats["evictions"] += 1
+            self._retire(evicted)
+        return bundle
+
+    def _retire(self, bundle: GeminiClientBundle):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_later(EVICTED_CLIENT_GRACE_SECONDS, lambda: loop.create_task(bundle.close()))
+
+    def clear(self):
+        """代理等全局网络配置变化后调用，丢弃所有已建立的客户端。"""
+        bundles = list(self._clients.values())
+        self._clients.clear()
+        for bundle in bundles:
+            self._retire(bundle)
+        if bundles:
+            logger.info(f"LLM_CLIENT_POOL: Cleared {len(bundles)} pooled client(s).")
+
+
+llm_client_pool = LLMClientPool()
@@ -0,0 +1,175 @@
+# novel_bot/src/plugins/ai_chat_system/llm_services/context_cache.py
+# 职责: 在服务端缓存稳定的系统提示前缀（Gemini Context Caching），后续调用只引用缓存句柄。
+
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..utils.tokenizer import count_tokens
+from .client_pool import llm_client_pool
+
+logger = logging.getLogger("nonebot")
+
+DEFAULT_CACHE_TTL_SECONDS = 600
+# Gemini 对可缓存内容有最小 Token 数要求，低于该值的前缀不值得（也无法）缓存
+DEFAULT_MIN_PREFIX_TOKENS = 4096
+# 句柄剩余寿命不足该值时视为过期，避免请求途中缓存失效
+EXPIRY_SAFETY_MARGIN_SECONDS = 30
+# 某个 (模型, Key) 创建缓存失败后，在这段时间内不再尝试
+FAILURE_BACKOFF_SECONDS = 900
+MAX_CACHE_ENTRIES = 256
+
+
+class CachedPrefix:
+    """一个已在服务端注册的前缀缓存。handle 为服务商返回的原始对象。"""
+    __slots__ = ("name", "handle", "model_name", "expires_at")
+
+    def __init__(self, name: str, handle: Any, model_name: str, expires_at: float):
+        self.name = name
+        self.handle = handle
+        self.model_name = model_name
+        self.expires_at = expires_at
+
+    def is_fresh(self) -> bool:
+        return self.expires_at - EXPIRY_SAFETY_MARGIN_SECONDS > time.time()
+
+
+class ContextCacheBackend(ABC):
+    """服务端上下文缓存的抽象接口。"""
+
+    @abstractmethod
+    async def create(self, api_key: str, model_name: str, system_instruction: str, ttl_seconds: int) -> CachedPrefix:
+        """在服务端注册一个新的前缀缓存。"""
+        pass
+
+
+class GeminiContextCacheBackend(ContextCacheBackend):
+    """基于 google.generativeai.caching 的实现。"""
+
+    async def create(self, api_key: str, model_name: str, system_instruction: str, ttl_seconds: int) -> CachedPrefix:
+        from google.generativeai import caching
+
+        cache_client = llm_client_pool.get_gemini_client(api_key).cache_client
+
+        def _create():
+            request = caching.CachedContent._prepare_create_request(
+                model=model_name,
+                system_instruction=system_instruction,
+                ttl=datetime.timedelta(seconds=ttl_seconds),
+            )
+            return caching.CachedContent._from_obj(cache_client.create_cached_content(request))
+
+        cached_content = await asyncio.to_thread(_create)
+        expire_time = getattr(cached_content, "expire_time", None)
+        expires_at = expire_time.timestamp() if expire_time else time.time() + ttl_seconds
+        return CachedPrefix(cached_content.name, cached_content, model_name, expires_at)
+
+
+class FakeContextCacheBackend(ContextCacheBackend):
+    """离线测试用的替身：只在内存中记录创建过的缓存，不访问任何网络。"""
+
+    def __init__(self, fail_models: Optional[set] = None):
+        self.fail_models = fail_models or set()
+        self.created: Dict[str, Tuple[str, str]] = {}
+
+    async def create(self, api_key: str, model_name: str, system_instruction: str, ttl_seconds: int) -> CachedPrefix:
+        if model_name in self.fail_models:
+            raise RuntimeError(f"Fake backend: model '{model_name}' does not support context caching.")
+        name = f"cachedContents/fake-{len(self.created) + 1}"
+        self.created[name] = (model_name, system_instruction)
+        return CachedPrefix(name, name, model_name, time.time() + ttl_seconds)
+
+
+def _fingerprint(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class ContextCacheManager:
+    """
+    按 (模型, Key 指纹, 前缀哈希) 管理服务端缓存句柄。
+    任何失败都只会让调用方退回到普通的 system_instruction 调用。
+    """
+
+    def __init__(
+        self,
+        backend: ContextCacheBackend,
+        ttl_seconds: int = DEFAULT_CACHE_TTL_SECONDS,
+        min_prefix_tokens: int = DEFAULT_MIN_PREFIX_TOKENS,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.min_prefix_tokens = min_prefix_tokens
+        self._entries: "OrderedDict[Tuple[str, str, str], CachedPrefix]" = OrderedDict()
+        self._locks: Dict[Tuple[str, str, str], asyncio.Lock] = {}
+        self._failures: Dict[Tuple[str, str], float] = {}
+        self.stats = {"hits": 0, "misses": 0, "creates": 0, "failures": 0, "skipped": 0}
+
+    def is_cacheable(self, prefix: Optional[str], model_name: str) -> bool:
+        return bool(prefix) and count_tokens(prefix, model_name) >= self.min_prefix_tokens
+
+    async def get_or_create(self, api_key: str, model_name: str, prefix: Optional[str]) -> Optional[CachedPrefix]:
+        """返回可用的缓存句柄；前缀过短、服务商不支持或创建失败时返回 None。"""
+        if not self.is_cacheable(prefix, model_name):
+            self.stats["skipped"] += 1
+            return None
+
+        key_fingerprint = _fingerprint(api_key)[:16]
+        if self._failures.get((model_name, key_fingerprint), 0) > time.time():
+            self.stats["skipped"] += 1
+            return None
+
+        cache_key = (model_name, key_fingerprint, _fingerprint(prefix))
+        cached = self._lookup(cache_key)
+        if cached:
+            self.stats["hits"] += 1
+            return cached
+
+        lock = self._locks.setdefault(cache_key, asyncio.Lock())
+        async with lock:
+            # 等锁期间可能已有其他协程完成了创建
+            cached = self._lookup(cache_key)
+            if cached:
+                self.stats["hits"] += 1
+                return cached
+
+            self.stats["misses"] += 1
+            try:
+                cached = await self.backend.create(api_key, model_name, prefix, self.ttl_seconds)
+            except Exception as e:
+                self.stats["failures"] += 1
+                self._failures[(model_name, key_fingerprint)] = time.time() + FAILURE_BACKOFF_SECONDS
+                logger.warning(f"CONTEXT_CACHE: Failed to create cache for model '{model_name}': {e}. Falling back to uncached calls.")
+                return None
+            finally:
+                self._locks.pop(cache_key, None)
+
+            self.stats["creates"] += 1
+            self._entries[cache_key] = cached
+            while len(self._entries) > MAX_CACHE_ENTRIES:
+                self._entries.popitem(last=False)
+            logger.info(f"CONTEXT_CACHE: Registered prefix cache '{cached.name}' for model '{model_name}'.")
+            return cached
+
+    def invalidate(self, cached: CachedPrefix):
+        """调用方发现句柄不可用时（例如服务端已提前删除）调用。"""
+        for cache_key, entry in list(self._entries.items()):
+            if entry is cached:
+                del self._entries[cache_key]
+
+    def _lookup(self, cache_key: Tuple[str, str, str]) -> Optional[CachedPrefix]:
+        cached = self._entries.get(cache_key)
+        if cached is None:
+            return None
+        if not cached.is_fresh():
+            del self._entries[cache_key]
+            return None
+        self._entries.move_to_end(cache_key)
+        return cached
+
+
+context_cache_manager = ContextCacheManager(GeminiContextCacheBackend())
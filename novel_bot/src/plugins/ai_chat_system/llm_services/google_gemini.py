@@ -1,6 +1,8 @@
 # novel_bot/src/plugins/ai_chat_system/llm_services/google_gemini.py
 
+import asyncio
 import logging
+import time
 from typing import Any, List, Optional, Tuple, AsyncGenerator, Dict
 
 import google.generativeai as genai
@@ -10,9 +12,97 @@ from google.generativeai import retriever
 from ..api_manager import ApiManager
 from .. import global_state
 from .base import LLMService
+from .client_pool import llm_client_pool
+from .context_cache import context_cache_manager
+from .latency_tracker import latency_tracker
+from ..services.token_usage import token_usage_recorder
+from ..utils.tokenizer import count_tokens
 
 logger = logging.getLogger("nonebot")
 
+class _AttemptPlan:
+    """按模型顺序依次向调度器申请 Key；同一模型下已尝试过的 Key 不再重复。"""
+
+    def __init__(self, api_manager: ApiManager, models: List[str], estimated_tokens: int):
+        self.api_manager = api_manager
+        self.models = models
+        self.estimated_tokens = estimated_tokens
+        self._model_position = 0
+        self._tried: set = set()
+
+    def next(self) -> Optional[Tuple[str, int]]:
+        while self._model_position < len(self.models):
+            model_name = self.models[self._model_position]
+            key_index = self.api_manager.acquire_key(model_name, self.estimated_tokens, self._tried)
+            if key_index is not None:
+                self._tried.add(key_index)
+                return model_name, key_index
+            self._model_position += 1
+            self._tried = set()
+        return None
+
+
+class _KeyLeasedStream:
+    """
+    流式请求在整个流结束后才算完成，期间一直计入该 Key 的进行中请求数。
+    Key 在流结束、出错或 aclose() 时释放，且只释放一次；调用方即使从未开始迭代，也应在 finally 中 aclose()。
+    用量以流中最后一个带 usage_metadata 的数据块为准，流结束时记入用量汇总。
+    """
+
+    _NO_CHUNK = object()
+
+    def __init__(self, stream: AsyncGenerator, api_manager: ApiManager, key_index: int, user_id: str, model_name: str,
+                 first_chunk: Any = _NO_CHUNK):
+        self._stream = stream
+        self._api_manager = api_manager
+        self._key_index = key_index
+        self._user_id = user_id
+        self._model_name = model_name
+        self._pending_chunk = first_chunk
+        self._started = False
+        self._usage = None
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._released:
+            raise StopAsyncIteration
+        self._started = True
+        if self._pending_chunk is not self._NO_CHUNK:
+            chunk, self._pending_chunk = self._pending_chunk, self._NO_CHUNK
+        else:
+            try:
+                chunk = await self._stream.__anext__()
+            except StopAsyncIteration:
+                await self._release()
+                raise
+            except Exception as e:
+                await self._release(e)
+                raise
+            except BaseException:
+                await self._release(cancelled=True)
+                raise
+        self._usage = getattr(chunk, "usage_metadata", None) or self._usage
+        return chunk
+
+    async def aclose(self):
+        # 从未开始迭代就被关闭（例如调用方在消费前被取消）时不计入成败
+        await self._release(cancelled=not self._started)
+
+    async def _release(self, error: Optional[BaseException] = None, cancelled: bool = False):
+        if self._released:
+            return
+        self._released = True
+        try:
+            await self._stream.aclose()
+        finally:
+            self._api_manager.release_key(self._key_index, error, cancelled)
+            if self._started:
+                token_usage_recorder.record(self._user_id, self._model_name, self._api_manager.keys[self._key_index], self._usage)
+
+
 class GoogleGeminiService(LLMService):
     """Google Gemini 服务的实现。"""
 
@@ -81,44 +171,187 @@ class GoogleGeminiService(LLMService):
         if not indices_to_try:
             raise RuntimeError("All provided Google API keys are currently in cooldown.")
 
-        for model_name in available_models:
-            for key_index in indices_to_try:
-                current_key = api_manager.keys[key_index]
-                try:
-                    genai.configure(api_key=current_key)
-                    model = genai.GenerativeModel(
-                        model_name,
-                        system_instruction=system_instruction,
-                        generation_config=generation_config,
-                        tools=final_tools,
-                        tool_config=tool_config,
-                        safety_settings=safety_settings
-                    )
-                    
-                    # [核心修复] 在调用API前，确保所有历史记录都是正确的 parts 格式
-                    formatted_contents = [
-                        {"role": msg["role"], "parts": msg["parts"]}
-                        for msg in contents if "role" in msg and "parts" in msg
-                    ]
-
-                    if stream:
-                        response_stream = await model.generate_content_async(contents=formatted_contents, stream=True)
-                        return self._stream_wrapper(response_stream), model_name
-                    else:
-                        response = await model.generate_content_async(contents=formatted_contents, stream=False)
-                        api_manager.report_key_success(key_index)
-                        return response, model_name
-
-                except Exception as e:
-                    last_exception = e
-                    logger.warning(f"❌ GEMINI_SERVICE: Call failed. Model: '{model_name}', Key Index: {key_index}, Error: {repr(e)}")
-                    api_manager.report_key_failure(key_index)
+        # [优化] 服务端上下文缓存：只有在没有工具调用、且系统提示以稳定前缀开头时才启用
+        cacheable_prefix = kwargs.get("cacheable_prefix")
+        use_context_cache = (
+            service_config.get("context_cache_enabled", True)
+            and bool(cacheable_prefix)
+            and bool(system_instruction) and system_instruction.startswith(cacheable_prefix)
+            and not final_tools and tool_config is None
+        )
+
+        # [核心修复] 在调用API前，确保所有历史记录都是正确的 parts 格式
+        formatted_contents = [
+            {"role": msg["role"], "parts": msg["parts"]}
+            for msg in contents if "role" in msg and "parts" in msg
+        ]
+
+        call_options = {
+            "generation_config": generation_config,
+            "safety_settings": safety_settings,
+            "tools": final_tools or None,
+            "tool_config": tool_config,
+        }
+        request = {
+            "system_instruction": system_instruction,
+            "contents": formatted_contents,
+            "call_options": call_options,
+            "cacheable_prefix": cacheable_prefix if use_context_cache else None,
+        }
+        # [核心重构] Key 由调度器按负载、速率限制和退避状态逐次分配
+        api_manager.set_rate_limits(service_config.get("rate_limits"))
+        estimated_tokens = count_tokens(
+            (system_instruction or "") + "".join(
+                part.get("text", "") for msg in formatted_contents for part in msg["parts"] if isinstance(part, dict)
+            ),
+            available_models[0]
+        )
+        plan = _AttemptPlan(api_manager, available_models, estimated_tokens)
+
+        # [核心新增] 可选的对冲模式：首个数据块迟迟不到时，在下一个 Key/模型上并行发起请求
+        if stream and service_config.get("hedging_enabled", False) and len(available_models) * len(indices_to_try) > 1:
+            return await self._hedged_stream(api_manager, plan, request, service_config.get("hedge_quantile", 0.95), user_id)
+
+        while (attempt := plan.next()) is not None:
+            model_name, key_index = attempt
+            try:
+                result = await self._attempt(api_manager, model_name, key_index, request, stream)
+            except Exception as e:
+                last_exception = e
+                logger.warning(f"❌ GEMINI_SERVICE: Call failed. Model: '{model_name}', Key Index: {key_index}, Error: {repr(e)}")
+                api_manager.release_key(key_index, e)
+                continue
+            except BaseException:
+                # 请求被取消（客户端断开等）：同样要归还 Key，否则它的进行中计数永远不会减少
+                api_manager.release_key(key_index, cancelled=True)
+                raise
+            if stream:
+                return _KeyLeasedStream(result, api_manager, key_index, user_id, model_name), model_name
+            api_manager.release_key(key_index)
+            token_usage_recorder.record(user_id, model_name, api_manager.keys[key_index], getattr(result, "usage_metadata", None))
+            return result, model_name
             
         raise RuntimeError(f"All Gemini models and API Keys failed. Last error: {last_exception}")
 
-    async def _stream_wrapper(self, stream: AsyncGenerator) -> AsyncGenerator[Dict[str, Any], None]:
+    async def _attempt(self, api_manager: ApiManager, model_name: str, key_index: int, request: Dict, stream: bool) -> Any:
+        """使用指定的模型和 Key 发起一次调用；失败时抛出异常，由调用方决定如何重试。"""
+        current_key = api_manager.keys[key_index]
+        # [优化] 每个 Key 使用独立的长期客户端，不再修改进程全局的 genai 配置
+        client = llm_client_pool.get_gemini_client(current_key)
+        system_instruction = request["system_instruction"]
+        cacheable_prefix = request["cacheable_prefix"]
+
+        cached_prefix = None
+        if cacheable_prefix:
+            cached_prefix = await context_cache_manager.get_or_create(current_key, model_name, cacheable_prefix)
+        if cached_prefix:
+            try:
+                model = client.get_cached_model(cached_prefix.handle)
+                call_contents = self._prepend_dynamic_instruction(system_instruction[len(cacheable_prefix):], request["contents"])
+                return await self._generate(model, model_name, call_contents, stream, request["call_options"])
+            except Exception as e:
+                # 缓存句柄可能已在服务端失效，丢弃后用同一个 Key 以普通方式重试一次
+                logger.warning(f"GEMINI_SERVICE: Call with cached context '{cached_prefix.name}' failed ({e!r}). Retrying without cache.")
+                context_cache_manager.invalidate(cached_prefix)
+
+        model = client.get_model(model_name, system_instruction)
+        return await self._generate(model, model_name, request["contents"], stream, request["call_options"])
+
+    async def _open_stream_for_race(self, api_manager: ApiManager, model_name: str, key_index: int, request: Dict) -> Tuple[Any, AsyncGenerator]:
+        """打开流并等待首个数据块，供对冲竞速使用。"""
+        stream = await self._attempt(api_manager, model_name, key_index, request, stream=True)
+        try:
+            first_chunk = await stream.__anext__()
+        except BaseException:
+            await stream.aclose()
+            raise
+        return first_chunk, stream
+
+    async def _hedged_stream(self, api_manager: ApiManager, plan: "_AttemptPlan", request: Dict, quantile: float, user_id: str) -> Tuple[AsyncGenerator, str]:
+        """
+        同时最多保持两个请求：主请求超过该模型 TTFT 的分位数时限仍无首块时发出一个对冲请求，
+        先产出首块者胜出，另一个被取消。请求失败时立即顺延到下一个 Key/模型。
+        """
+        in_flight: Dict[asyncio.Task, Tuple[str, int]] = {}
+        hedged = False
+        last_exception = None
+
+        def launch() -> bool:
+            attempt = plan.next()
+            if attempt is None:
+                return False
+            task = asyncio.create_task(self._open_stream_for_race(api_manager, attempt[0], attempt[1], request))
+            in_flight[task] = attempt
+            return True
+
+        launch()
+        try:
+            while in_flight:
+                timeout = None
+                if not hedged:
+                    primary_model = next(iter(in_flight.values()))[0]
+                    timeout = latency_tracker.get_hedge_deadline(primary_model, quantile)
+
+                done, _ = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if launch():
+                        model_name, key_index = list(in_flight.values())[-1]
+                        logger.info(f"GEMINI_SERVICE: No first chunk within {timeout:.2f}s. Hedging on '{model_name}' (Key Index: {key_index}).")
+                    continue
+
+                for task in done:
+                    model_name, key_index = in_flight.pop(task)
+                    try:
+                        first_chunk, stream = task.result()
+                    except Exception as e:
+                        last_exception = e
+                        logger.warning(f"❌ GEMINI_SERVICE: Call failed. Model: '{model_name}', Key Index: {key_index}, Error: {repr(e)}")
+                        api_manager.release_key(key_index, e)
+                        continue
+                    if hedged:
+                        logger.info(f"GEMINI_SERVICE: Hedged race won by '{model_name}' (Key Index: {key_index}).")
+                    return _KeyLeasedStream(stream, api_manager, key_index, user_id, model_name, first_chunk=first_chunk), model_name
+
+                if not in_flight and launch():
+                    hedged = False
+        finally:
+            await self._cancel_race(api_manager, in_flight)
+
+        raise RuntimeError(f"All Gemini models and API Keys failed. Last error: {last_exception}")
+
+    async def _cancel_race(self, api_manager: ApiManager, in_flight: Dict[asyncio.Task, Tuple[str, int]]):
+        """取消落败的请求；已经拿到首块的落败者需要关闭它的流。"""
+        for task in in_flight:
+            task.cancel()
+        results = await asyncio.gather(*in_flight, return_exceptions=True)
+        for (model_name, key_index), result in zip(in_flight.values(), results):
+            if isinstance(result, tuple):
+                await result[1].aclose()
+            api_manager.release_key(key_index, cancelled=True)
+        in_flight.clear()
+
+    async def _generate(self, model: genai.GenerativeModel, model_name: str, contents: List[Dict], stream: bool, call_options: Dict) -> Any:
+        started_at = time.monotonic()
+        if stream:
+            response_stream = await model.generate_content_async(contents=contents, stream=True, **call_options)
+            return self._stream_wrapper(response_stream, model_name, started_at)
+        return await model.generate_content_async(contents=contents, stream=False, **call_options)
+
+    def _prepend_dynamic_instruction(self, dynamic_instruction: str, contents: List[Dict]) -> List[Dict]:
+        """使用缓存前缀时，系统提示的动态尾部作为一条前置的用户消息发送。"""
+        dynamic_instruction = dynamic_instruction.strip()
+        if not dynamic_instruction:
+            return contents
+        return [{"role": "user", "parts": [{"text": dynamic_instruction}]}] + contents
+
+    async def _stream_wrapper(self, stream: AsyncGenerator, model_name: str, started_at: float) -> AsyncGenerator[Dict[str, Any], None]:
+        first_chunk = True
         try:
             async for chunk in stream:
+                if first_chunk:
+                    latency_tracker.record_ttft(model_name, time.monotonic() - started_at)
+                    first_chunk = False
                 yield chunk
         except Exception as e:
             logger.error(f"GEMINI_SERVICE: Error during streaming: {e}", exc_info=True)
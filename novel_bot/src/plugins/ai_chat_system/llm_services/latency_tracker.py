@@ -0,0 +1,86 @@
+# novel_bot/src/plugins/ai_chat_system/llm_services/latency_tracker.py
+# 职责: 按模型记录首字延迟（TTFT）的直方图，并据此给出对冲请求的触发时限。
+
+import bisect
+from typing import Dict, List, Optional
+
+# 直方图桶上界（秒）：从 50ms 到约 60s 按 1.25 倍对数递增
+_BUCKET_BOUNDS: List[float] = [0.05 * (1.25 ** i) for i in range(33)]
+# 超过最后一个上界的样本落入溢出桶，其分位数按该上界报告（表示"不小于"）
+OVERFLOW_BOUND = _BUCKET_BOUNDS[-1]
+
+MIN_SAMPLES_FOR_DEADLINE = 20     # 样本不足时使用默认时限
+DECAY_THRESHOLD = 1000            # 样本数超过该值时所有桶计数减半，使统计跟随近期表现
+DEFAULT_HEDGE_DEADLINE = 4.0
+MIN_HEDGE_DEADLINE = 0.5
+MAX_HEDGE_DEADLINE = 15.0
+
+
+class LatencyHistogram:
+    """固定对数分桶的延迟直方图，记录和查询分位数都是 O(桶数)。"""
+
+    def __init__(self):
+        self.counts: List[float] = [0.0] * (len(_BUCKET_BOUNDS) + 1)
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+        self.total += 1
+        if self.total >= DECAY_THRESHOLD:
+            self.counts = [count / 2 for count in self.counts]
+            self.total /= 2
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回分位数所在桶的上界；落在溢出桶时返回 OVERFLOW_BOUND（保证结果可以 JSON 序列化）。"""
+        if self.total <= 0:
+            return None
+        target = q * self.total
+        cumulative = 0.0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return _BUCKET_BOUNDS[index] if index < len(_BUCKET_BOUNDS) else OVERFLOW_BOUND
+        return OVERFLOW_BOUND
+
+    @property
+    def overflow(self) -> float:
+        """超过 OVERFLOW_BOUND 的样本数。"""
+        return self.counts[-1]
+
+
+class LatencyTracker:
+    """按模型名称维护 TTFT 直方图。"""
+
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def record_ttft(self, model_name: str, seconds: float):
+        histogram = self._histograms.get(model_name)
+        if histogram is None:
+            histogram = self._histograms[model_name] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def get_hedge_deadline(self, model_name: str, quantile: float = 0.95) -> float:
+        """在该时限内仍未收到首个数据块时，应当发出对冲请求。"""
+        histogram = self._histograms.get(model_name)
+        if histogram is None or histogram.total < MIN_SAMPLES_FOR_DEADLINE:
+            return DEFAULT_HEDGE_DEADLINE
+        deadline = histogram.quantile(quantile)
+        return min(max(deadline, MIN_HEDGE_DEADLINE), MAX_HEDGE_DEADLINE)
+
+    def snapshot(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {
+            model_name: {
+                "samples": round(histogram.total, 1),
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+                # 分位数等于 overflow_bound 且 overflow_samples 不为 0 时，实际值不小于该上界
+                "overflow_bound": OVERFLOW_BOUND,
+                "overflow_samples": round(histogram.overflow, 1),
+            }
+            for model_name, histogram in self._histograms.items()
+        }
+
+
+latency_tracker = LatencyTracker()
@@ -1,12 +1,18 @@
 import logging
+import os
 import re
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 
 import pytz
 from nonebot.adapters.onebot.v11 import MessageEvent
 
 from . import global_state
+from .services.content_versions import get_visible_item_version
+from .services.world_info_engine import (
+    CompiledWorldBook, get_compiled_world_book, activate_world_info, build_scan_texts
+)
 
 logger = logging.getLogger("nonebot")
 
@@ -24,22 +30,89 @@ def _render_template(template_string: str, context: Dict[str, Any]) -> str:
     # 查找所有 {{...}} 格式的占位符并替换
     return re.sub(r"\{\{\s*(.*?)\s*\}\}", replacer, template_string)
 
-def build_system_prompt(
-    user_config: Dict, 
-    user_message: str, 
-    event: MessageEvent,
-    request_story_options: bool = False
-) -> str:
-    """
-    构建一个单一的、完整的、用于指导AI模型的系统提示(System Prompt)。
-    该函数现在完全由用户激活的预设驱动，并包含一个模板渲染步骤。
-    """
-    if not global_state.data_manager:
-        logger.critical("FATAL: DataManager in global_state is not initialized! Cannot build system prompt.")
-        return "Error: DataManager not ready."
+# [优化] 编译后的系统提示缓存
+# 除了时间行以外，系统提示在相邻两轮对话之间几乎不会变化。这里把渲染好的静态部分
+# 按 (预设版本, 激活模块, 角色版本, 人设版本, 世界书版本) 缓存起来，每轮只拼接时间行。
+COMPILED_PROMPT_CACHE_SIZE = 256
+# 世界书内容取决于本轮的关键词匹配结果，编译时先用占位符代替，每轮再替换
+_WORLD_INFO_SENTINEL = "\x00world_info\x00"
 
-    user_id = str(event.user_id)
-    
+
+class CompiledPrompt:
+    """一次编译的产物：渲染完成的静态提示词、编译好的世界书，以及它们的版本。"""
+    __slots__ = ("static_prompt", "world_versions", "world_books")
+
+    def __init__(self, static_prompt: str, world_versions: Dict[str, Tuple[int, int]], world_books: List[CompiledWorldBook]):
+        self.static_prompt = static_prompt
+        self.world_versions = world_versions
+        self.world_books = world_books
+
+
+_compiled_prompts: "OrderedDict[Tuple, CompiledPrompt]" = OrderedDict()
+
+
+def clear_compiled_prompts():
+    """清空全部已编译的提示词（例如在公共数据被整体重建后调用）。"""
+    _compiled_prompts.clear()
+
+
+def _make_compile_key(
+    user_id: str,
+    user_config: Dict,
+    active_module_ids: List[str],
+    user_display_name: Optional[str],
+) -> Tuple:
+    char_name = user_config.get("active_character")
+    persona_name = user_config.get("user_persona")
+    preset_name = user_config.get("preset")
+    return (
+        user_id,
+        preset_name, get_visible_item_version(user_id, "preset", preset_name),
+        tuple(active_module_ids),
+        char_name, get_visible_item_version(user_id, "character", char_name),
+        persona_name, get_visible_item_version(user_id, "character", persona_name),
+        tuple(user_config.get("world_info", [])),
+        user_display_name,
+    )
+
+
+def _get_compiled_prompt(user_id: str, key: Tuple) -> Optional[CompiledPrompt]:
+    compiled = _compiled_prompts.get(key)
+    if compiled is None:
+        return None
+    # 角色卡里链接的世界书只有在编译时才知道，因此逐一校验它们的版本
+    for world_name, version in compiled.world_versions.items():
+        if get_visible_item_version(user_id, "world_info", world_name) != version:
+            del _compiled_prompts[key]
+            return None
+    _compiled_prompts.move_to_end(key)
+    return compiled
+
+
+def _store_compiled_prompt(key: Tuple, compiled: CompiledPrompt):
+    _compiled_prompts[key] = compiled
+    _compiled_prompts.move_to_end(key)
+    while len(_compiled_prompts) > COMPILED_PROMPT_CACHE_SIZE:
+        _compiled_prompts.popitem(last=False)
+
+
+def _build_time_instruction() -> Optional[str]:
+    try:
+        china_tz = pytz.timezone('Asia/Shanghai')
+        current_time = datetime.now(china_tz).strftime('%Y-%m-%d %H:%M:%S %Z')
+        return f"[系统指令：当前现实世界时间是 {current_time}。请在你的回复中适当考虑这一点。]"
+    except Exception as e:
+        logger.warning(f"Failed to get current time for system prompt: {e}")
+        return None
+
+
+def _compile_static_prompt(
+    user_id: str,
+    user_config: Dict,
+    active_module_ids: List[str],
+    user_display_name: Optional[str],
+) -> Optional[CompiledPrompt]:
+    """加载角色、人设、预设与世界书，并渲染出与时间无关的静态提示词。"""
     # --- 1. 数据加载与上下文准备 ---
     dm = global_state.data_manager
     available_chars = dm.get_available_data(user_id, "character")
@@ -51,12 +124,16 @@ def build_system_prompt(
     user_persona_card = available_chars.get(user_persona_name, {}) if user_persona_name and user_persona_name != "User" else {}
 
     # 加载所有相关的世界书
-    world_names_to_load = set(active_char_card.get("linked_worlds", []) + user_config.get("world_info", []))
+    # 保持顺序并去重，使世界书条目的输出顺序稳定
+    world_names_to_load = list(dict.fromkeys(active_char_card.get("linked_worlds", []) + user_config.get("world_info", [])))
     available_worlds = dm.get_available_data(user_id, "world_info")
-    loaded_worlds_content = "\n".join(
-        "\n".join(f"- {entry.get('content', '')}" for entry in available_worlds[name].get("entries", []))
+    world_books = [
+        get_compiled_world_book(user_id, name, available_worlds[name])
         for name in world_names_to_load if name in available_worlds
-    )
+    ]
+    world_versions = {
+        name: get_visible_item_version(user_id, "world_info", name) for name in world_names_to_load
+    }
 
     # --- 2. 预设和模块加载 ---
     preset_name = user_config.get("preset")
@@ -65,15 +142,7 @@ def build_system_prompt(
     
     if not preset:
         logger.error(f"User '{user_id}' has an invalid preset '{preset_name}' configured. Returning empty prompt.")
-        return ""
-    
-    active_module_ids = user_config.get("active_modules", {}).get(preset_name, [])
-
-    if request_story_options:
-        story_option_module_id = "ec7db4d7-c8ac-4b17-9d1b-3892225cdfdf"
-        if story_option_module_id not in active_module_ids:
-            active_module_ids.append(story_option_module_id)
-            logger.info(f"AI_CHAT: Force-activating story option module for user {user_id}.")
+        return None
 
     id_to_prompt = {p["identifier"]: p for p in preset.get("prompts", [])}
     
@@ -91,11 +160,11 @@ def build_system_prompt(
     # --- 3. [核心优化] 创建用于模板渲染的上下文 ---
     rendering_context = {
         "char": active_char_card.get("name", "AI"),
-        "user": user_persona_card.get("name") or (event.sender.nickname if hasattr(event, "sender") and event.sender.nickname else "User"),
+        "user": user_persona_card.get("name") or user_display_name or "User",
         "personality": active_char_card.get("personality", ""),
         "description": active_char_card.get("description", ""),
         "scenario": active_char_card.get("first_mes", ""), # 默认场景为开场白
-        "world_info": loaded_worlds_content,
+        "world_info": _WORLD_INFO_SENTINEL if world_books else "",
         "personaDescription": user_persona_card.get("description", ""),
         "dialogueExamples": active_char_card.get("mes_example", ""),
         # 可以添加更多...
@@ -104,7 +173,7 @@ def build_system_prompt(
         "RoleBase": "Roleplayer",
     }
 
-    # --- 4. 构建最终提示词字符串 ---
+    # --- 4. 构建静态提示词字符串 ---
     final_prompt_parts = []
     for module in ordered_prompts_data:
         content = module.get("content", "")
@@ -127,18 +196,94 @@ def build_system_prompt(
         else:
             final_prompt_parts.append(content)
 
-    # --- 5. 添加动态时间信息 ---
-    try:
-        china_tz = pytz.timezone('Asia/Shanghai')
-        current_time = datetime.now(china_tz).strftime('%Y-%m-%d %H:%M:%S %Z')
-        final_prompt_parts.append(f"[系统指令：当前现实世界时间是 {current_time}。请在你的回复中适当考虑这一点。]")
-    except Exception as e:
-        logger.warning(f"Failed to get current time for system prompt: {e}")
-                
     unrendered_prompt = "\n".join(filter(None, final_prompt_parts))
     
-    # --- 6. [核心优化] 执行模板渲染 ---
-    final_prompt = _render_template(unrendered_prompt, rendering_context)
+    # --- 5. [核心优化] 执行模板渲染 ---
+    static_prompt = _render_template(unrendered_prompt, rendering_context)
+    return CompiledPrompt(static_prompt, world_versions, world_books)
+
+
+def _splice_world_info(static_prompt: str, world_info_content: str) -> str:
+    """把本轮激活的世界书条目填入占位符；没有激活任何条目时连同所在的空行一起移除。"""
+    if _WORLD_INFO_SENTINEL not in static_prompt:
+        return static_prompt
+    if world_info_content:
+        return static_prompt.replace(_WORLD_INFO_SENTINEL, world_info_content)
+    return (
+        static_prompt
+        .replace(_WORLD_INFO_SENTINEL + "\n", "")
+        .replace("\n" + _WORLD_INFO_SENTINEL, "")
+        .replace(_WORLD_INFO_SENTINEL, "")
+    )
+
+
+def build_system_prompt_sections(
+    user_config: Dict, 
+    user_message: str, 
+    event: MessageEvent,
+    request_story_options: bool = False,
+    history: Optional[List[Dict]] = None
+) -> Tuple[str, str]:
+    """
+    构建系统提示，并拆分为 (稳定前缀, 动态尾部) 两段，两段直接相加即为完整提示。
+    稳定前缀在内容不变时逐字相同，可交给服务端上下文缓存；
+    动态尾部包含本轮激活的世界书条目与时间行。
+    """
+    if not global_state.data_manager:
+        logger.critical("FATAL: DataManager in global_state is not initialized! Cannot build system prompt.")
+        return "Error: DataManager not ready.", ""
+
+    user_id = str(event.user_id)
+    preset_name = user_config.get("preset")
+    active_module_ids = list(user_config.get("active_modules", {}).get(preset_name, []))
+
+    if request_story_options:
+        story_option_module_id = "ec7db4d7-c8ac-4b17-9d1b-3892225cdfdf"
+        if story_option_module_id not in active_module_ids:
+            active_module_ids.append(story_option_module_id)
+            logger.info(f"AI_CHAT: Force-activating story option module for user {user_id}.")
+
+    user_display_name = event.sender.nickname if hasattr(event, "sender") and event.sender.nickname else None
+
+    compile_key = _make_compile_key(user_id, user_config, active_module_ids, user_display_name)
+    compiled = _get_compiled_prompt(user_id, compile_key)
+    if compiled is None:
+        compiled = _compile_static_prompt(user_id, user_config, active_module_ids, user_display_name)
+        if compiled is None:
+            return "", ""
+        _store_compiled_prompt(compile_key, compiled)
+        logger.debug(f"AI_CHAT: Compiled system prompt for user {user_id}, static length {len(compiled.static_prompt)}")
+
+    # --- 根据用户输入与最近的历史消息激活世界书条目 ---
+    world_info_content = ""
+    if compiled.world_books:
+        world_info_content = activate_world_info(compiled.world_books, build_scan_texts(user_message, history))
+    prompt_body = _splice_world_info(compiled.static_prompt, world_info_content)
+
+    # --- 添加动态时间信息 ---
+    final_prompt = "\n".join(filter(None, [prompt_body, _build_time_instruction()]))
+
+    sentinel_index = compiled.static_prompt.find(_WORLD_INFO_SENTINEL)
+    stable_candidate = compiled.static_prompt if sentinel_index < 0 else compiled.static_prompt[:sentinel_index]
+    stable_prefix = os.path.commonprefix([stable_candidate, final_prompt])
     
-    logger.debug(f"AI_CHAT: Built a unified system prompt for user {user_id}, length {len(final_prompt)}")
-    return final_prompt
\ No newline at end of file
+    logger.debug(f"AI_CHAT: Built a unified system prompt for user {user_id}, length {len(final_prompt)} (stable prefix {len(stable_prefix)})")
+    return stable_prefix, final_prompt[len(stable_prefix):]
+
+
+def build_system_prompt(
+    user_config: Dict, 
+    user_message: str, 
+    event: MessageEvent,
+    request_story_options: bool = False,
+    history: Optional[List[Dict]] = None
+) -> str:
+    """
+    构建一个单一的、完整的、用于指导AI模型的系统提示(System Prompt)。
+    该函数现在完全由用户激活的预设驱动，静态部分会被编译并缓存，每轮只填入
+    由关键词触发的世界书条目并拼接动态时间行。
+    """
+    stable_prefix, dynamic_tail = build_system_prompt_sections(
+        user_config, user_message, event, request_story_options, history
+    )
+    return stable_prefix + dynamic_tail
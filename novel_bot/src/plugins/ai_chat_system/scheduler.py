@@ -3,6 +3,9 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from nonebot import logger
 from .services.archival_service import data_conduit_instance
+from .services.response_cache import response_cache
+from .services.token_usage import token_usage_recorder
+from .services.message_compression import message_recompressor
 
 # 创建一个原生的 AsyncIOScheduler 实例
 scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
@@ -22,4 +25,43 @@ scheduler.add_job(
 )
 
 logger.info("Scheduler job defined: periodic data synchronization every 6 hours.")
+
+async def purge_expired_response_cache():
+    try:
+        await response_cache.purge_expired()
+    except Exception as e:
+        logger.warning(f"Scheduler: Failed to purge expired response cache entries: {e}")
+
+scheduler.add_job(
+    purge_expired_response_cache,
+    "interval",
+    hours=12,
+    id="purge_response_cache",
+    misfire_grace_time=3600
+)
+
+async def flush_token_usage():
+    await token_usage_recorder.flush()
+
+scheduler.add_job(
+    flush_token_usage,
+    "interval",
+    seconds=60,
+    id="flush_token_usage",
+    misfire_grace_time=60
+)
+
+async def recompress_chat_messages():
+    try:
+        await message_recompressor.run()
+    except Exception as e:
+        logger.warning(f"Scheduler: Chat message recompression failed: {e}")
+
+scheduler.add_job(
+    recompress_chat_messages,
+    "interval",
+    hours=6,
+    id="recompress_chat_messages",
+    misfire_grace_time=3600
+)
 # 注意：scheduler.start() 会在 main.py 的 startup 事件中被调用
\ No newline at end of file
@@ -0,0 +1,144 @@
+# novel_bot/src/plugins/ai_chat_system/services/backplane.py
+# 职责: WebSocket 事件在多个工作进程之间的发布/订阅通道（backplane）。
+#       某个 worker 发布的事件先投递给本进程持有的连接，再经 backplane 转发给其他 worker，
+#       由它们投递给各自持有的连接。单进程部署使用 InProcessBackplane（无需转发）；
+#       多 worker 部署使用 RedisBackplane（兼容 Redis 协议的服务均可，需要安装 redis 包）。
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger("nonebot")
+
+DEFAULT_CHANNEL = "novelbot:events"
+# 待发布消息的缓冲上限，Redis 长时间不可用时丢弃新消息而不是无限占用内存
+OUTBOX_SIZE = 10_000
+# 与 Redis 断开后重新订阅的最长等待（秒）
+MAX_RECONNECT_DELAY = 30.0
+
+# 本进程的标识，用于忽略自己发布后又从 backplane 收到的消息
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class InProcessBackplane:
+    """单进程部署：所有连接都在本进程内，事件已在本地投递，无需转发。"""
+
+    name = "memory"
+
+    async def start(self, handler: MessageHandler):
+        return None
+
+    def publish(self, message: Dict[str, Any]):
+        return None
+
+    async def stop(self):
+        return None
+
+
+class RedisBackplane:
+    """
+    通过一个 Redis pub/sub 频道在 worker 之间转发事件。publish() 只把消息放入本地发件箱，
+    由单个发送协程按顺序发布（保证同一 worker 发出的事件顺序不变）；发布失败只记录日志，不影响本地投递。
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, channel: str = DEFAULT_CHANNEL):
+        if aioredis is None:
+            raise RuntimeError("The 'redis' package is required for the Redis WebSocket backplane.")
+        self.url = url
+        self.channel = channel
+        self._client = aioredis.from_url(url)
+        self._outbox: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, handler: MessageHandler):
+        self._outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self._tasks = [asyncio.create_task(self._listen(handler)), asyncio.create_task(self._send())]
+
+    def publish(self, message: Dict[str, Any]):
+        if self._outbox is None:
+            return
+        try:
+            self._outbox.put_nowait(json.dumps({**message, "origin": WORKER_ID}, separators=(",", ":"), ensure_ascii=False))
+        except asyncio.QueueFull:
+            logger.warning(f"BACKPLANE: Outbox full, dropping a message for '{self.channel}'.")
+
+    async def _send(self):
+        while True:
+            payload = await self._outbox.get()
+            try:
+                await self._client.publish(self.channel, payload)
+            except Exception as e:
+                logger.warning(f"BACKPLANE: Failed to publish to '{self.channel}': {e}")
+
+    async def _listen(self, handler: MessageHandler):
+        delay = 1.0
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                logger.info(f"BACKPLANE: Subscribed to Redis channel '{self.channel}'.")
+                delay = 1.0
+                async for raw in pubsub.listen():
+                    if raw.get("type") != "message":
+                        continue
+                    try:
+                        message = json.loads(raw["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if message.get("origin") == WORKER_ID:
+                        continue
+                    try:
+                        await handler(message)
+                    except Exception as e:
+                        logger.error(f"BACKPLANE: Error handling message from worker {message.get('origin')}: {e}", exc_info=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"BACKPLANE: Redis subscription lost, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def stop(self):
+        # 先把发件箱中剩余的消息发出去
+        if self._outbox is not None:
+            while not self._outbox.empty():
+                try:
+                    await self._client.publish(self.channel, self._outbox.get_nowait())
+                except Exception:
+                    break
+            self._outbox = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+
+
+def create_backplane(config: Dict[str, Any]):
+    """按 config.toml 的 [websocket] 配置创建 backplane；Redis 不可用时退回进程内实现。"""
+    kind = (config.get("backplane") or "memory").lower()
+    if kind == "redis":
+        try:
+            return RedisBackplane(config.get("redis_url", "redis://127.0.0.1:6379/0"), config.get("channel", DEFAULT_CHANNEL))
+        except Exception as e:
+            logger.error(f"BACKPLANE: Could not create Redis backplane, falling back to in-process: {e}")
+    elif kind != "memory":
+        logger.warning(f"BACKPLANE: Unknown backplane '{kind}', using in-process.")
+    return InProcessBackplane()
@@ -1,58 +1,251 @@
+# novel_bot/src/plugins/ai_chat_system/services/connection_manager.py
+# 职责: WebSocket 连接管理与消息分发。私有事件只投递给所属用户的全部连接，公共事件只投递给订阅了对应主题的连接，
+#       多 worker 部署时经 backplane 转发到其他进程持有的连接。
+#       每个连接有独立的有界发送队列和发送协程：分发时消息只序列化一次、入队即返回，不等待网络，
+#       各连接并发发送，慢客户端既不会阻塞事件循环，也不会拖慢其他客户端。
+
+import asyncio
+import json
 import logging
-from typing import Any, Dict
-from fastapi import WebSocket
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+from fastapi import WebSocket, WebSocketDisconnect
 from websockets.exceptions import ConnectionClosed
 
+from .backplane import InProcessBackplane, WORKER_ID, create_backplane
+
 logger = logging.getLogger("nonebot")
 
+PUBLIC_TOPIC = "public"
+# 新连接默认订阅的主题
+DEFAULT_TOPICS = frozenset({PUBLIC_TOPIC})
+
+# 每个连接发送队列的容量（条）
+OUTBOUND_QUEUE_SIZE = 256
+# 单条消息的发送超时（秒），超时视为连接失效
+SEND_TIMEOUT = 10.0
+# 队列满时丢弃最旧的消息；连续丢弃超过该数量说明客户端消费过慢，断开连接（客户端重连后会重新拉取数据）
+MAX_CONSECUTIVE_DROPS = 64
+SLOW_CONSUMER_CLOSE_CODE = 1013  # Try Again Later
+
+
+def _encode(data: Dict) -> str:
+    # 与 WebSocket.send_json 的序列化方式一致
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, user_id: str, topics: Iterable[str] = DEFAULT_TOPICS):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.topics: Set[str] = set(topics)
+        self.dropped = 0
+        self._consecutive_drops = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self._sender: Optional[asyncio.Task] = None
+
+    def start(self, on_failure):
+        self._sender = asyncio.create_task(self._run(on_failure))
+
+    def enqueue(self, text: str) -> bool:
+        """入队一条已序列化的消息；客户端消费过慢、应当断开时返回 False。"""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            self._consecutive_drops += 1
+            if self._consecutive_drops > MAX_CONSECUTIVE_DROPS:
+                return False
+        self._queue.put_nowait(text)
+        return True
+
+    async def _run(self, on_failure):
+        try:
+            while True:
+                text = await self._queue.get()
+                await asyncio.wait_for(self.websocket.send_text(text), SEND_TIMEOUT)
+                self._consecutive_drops = 0
+        except (ConnectionClosed, WebSocketDisconnect, RuntimeError, asyncio.TimeoutError) as e:
+            on_failure(self, e)
+
+    def stop(self):
+        if self._sender is not None:
+            self._sender.cancel()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.stop()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+
+# 每个用户同时保持的连接数上限（多个标签页/设备），超出时关闭最早的连接
+MAX_CONNECTIONS_PER_USER = 8
+
+ControlHandler = Callable[[Dict[str, Any]], Any]
+
+
 class ConnectionManager:
+    """
+    进程内唯一的 WebSocket 中心。一个用户可以同时有多个连接（多标签页），
+    事件先投递给本进程的连接，再经 backplane 转发给其他 worker 上的连接。
+    除连接事件外，backplane 也承载 control 消息（例如缓存失效），由各 worker 注册的处理函数执行。
+    """
+
     def __init__(self):
-        self.connections: Dict[str, WebSocket] = {}
+        self.connections: Dict[str, List[ClientConnection]] = {}
+        self._backplane = InProcessBackplane()
+        self._backplane_config: Optional[Dict[str, Any]] = None
+        self._control_handlers: Dict[str, List[ControlHandler]] = {}
         logger.info("ConnectionManager initialized.")
 
+    # ------------------------------------------------------------------
+    # backplane
+    # ------------------------------------------------------------------
+
+    async def configure_backplane(self, config: Dict[str, Any]):
+        """按 [websocket] 配置（重新）创建 backplane；配置未变化时保持现有实例。"""
+        config = dict(config or {})
+        if config == self._backplane_config:
+            return
+        await self._backplane.stop()
+        self._backplane = create_backplane(config)
+        self._backplane_config = config
+        await self._backplane.start(self._on_backplane_message)
+        logger.info(f"ConnectionManager: Using '{self._backplane.name}' backplane (worker {WORKER_ID}).")
+
+    async def close_backplane(self):
+        await self._backplane.stop()
+        self._backplane = InProcessBackplane()
+        self._backplane_config = None
+
+    def _forward(self, message: Dict[str, Any]):
+        self._backplane.publish(message)
+
+    async def _on_backplane_message(self, message: Dict[str, Any]):
+        kind = message.get("kind")
+        if kind == "user":
+            self._deliver_to_user(message.get("target"), message.get("text", ""))
+        elif kind == "topic":
+            self._deliver_to_topic(message.get("target"), message.get("text", ""))
+        elif kind == "control":
+            for handler in self._control_handlers.get(message.get("target"), []):
+                result = handler(message.get("data") or {})
+                if asyncio.iscoroutine(result):
+                    await result
+
+    def on_control(self, name: str, handler: ControlHandler):
+        """注册 control 消息的处理函数（只会收到其他 worker 发布的消息）。"""
+        self._control_handlers.setdefault(name, []).append(handler)
+
+    def publish_control(self, name: str, data: Dict[str, Any]):
+        """通知其他 worker（本进程应已自行处理）。单进程部署下不做任何事。"""
+        self._forward({"kind": "control", "target": name, "data": data})
+
+    # ------------------------------------------------------------------
+    # 连接
+    # ------------------------------------------------------------------
+
     async def connect(self, websocket: WebSocket, user_id: str) -> bool:
         await websocket.accept()
-        if user_id in self.connections:
-            try:
-                await self.connections[user_id].close(code=1000, reason="New connection established")
-                logger.info(f"ConnectionManager: Closed existing WebSocket for user '{user_id}'.")
-            except Exception:
-                pass
-        
-        self.connections[user_id] = websocket
-        logger.info(f"ConnectionManager: User '{user_id}' connected with new websocket.")
-
-        if self.connections.get(user_id) is not websocket:
-            logger.warning(f"ConnectionManager: A newer connection for user '{user_id}' arrived. Aborting outdated task.")
-            return False
-            
-        return True
+        user_connections = self.connections.setdefault(user_id, [])
+        connection = ClientConnection(websocket, user_id)
+        user_connections.append(connection)
+        connection.start(self._on_send_failure)
+        logger.info(f"ConnectionManager: User '{user_id}' connected ({len(user_connections)} open connections).")
+
+        while len(user_connections) > MAX_CONNECTIONS_PER_USER:
+            oldest = user_connections.pop(0)
+            await oldest.close(code=1000, reason="Too many connections")
+            logger.info(f"ConnectionManager: Closed oldest WebSocket for user '{user_id}' (connection limit reached).")
+
+        return connection in user_connections
+
+    def _current(self, websocket: WebSocket, user_id: str) -> Optional[ClientConnection]:
+        for connection in self.connections.get(user_id, []):
+            if connection.websocket is websocket:
+                return connection
+        return None
 
     def disconnect(self, websocket: WebSocket, user_id: str):
-        if self.connections.get(user_id) == websocket:
-            del self.connections[user_id]
-            logger.info(f"ConnectionManager: User '{user_id}' disconnected.")
+        connection = self._current(websocket, user_id)
+        if connection is not None:
+            user_connections = self.connections[user_id]
+            user_connections.remove(connection)
+            if not user_connections:
+                del self.connections[user_id]
+            connection.stop()
+            logger.info(f"ConnectionManager: User '{user_id}' disconnected ({len(user_connections)} open connections).")
+
+    def _on_send_failure(self, connection: ClientConnection, error: Exception):
+        logger.warning(f"ConnectionManager: Could not send message to user '{connection.user_id}', connection closed. Error: {error!r}")
+        self.disconnect(connection.websocket, connection.user_id)
+
+    def _deliver(self, connection: ClientConnection, text: str) -> bool:
+        if connection.enqueue(text):
+            return True
+        logger.warning(
+            f"ConnectionManager: User '{connection.user_id}' is consuming too slowly "
+            f"({connection.dropped} messages dropped), closing connection."
+        )
+        self.disconnect(connection.websocket, connection.user_id)
+        asyncio.create_task(connection.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Slow consumer"))
+        return False
+
+    def _deliver_to_user(self, user_id: Optional[str], text: str) -> int:
+        return sum(1 for connection in list(self.connections.get(user_id, [])) if self._deliver(connection, text))
+
+    def _deliver_to_topic(self, topic: Optional[str], text: str) -> int:
+        subscribers = [
+            connection
+            for user_connections in self.connections.values()
+            for connection in user_connections
+            if topic in connection.topics
+        ]
+        return sum(1 for connection in subscribers if self._deliver(connection, text))
+
+    def subscribe(self, websocket: WebSocket, user_id: str, topics: Iterable[str]):
+        connection = self._current(websocket, user_id)
+        if connection is not None:
+            connection.topics.update(topic for topic in topics if isinstance(topic, str))
+
+    def unsubscribe(self, websocket: WebSocket, user_id: str, topics: Iterable[str]):
+        connection = self._current(websocket, user_id)
+        if connection is not None:
+            connection.topics.difference_update(topics)
+
+    # ------------------------------------------------------------------
+    # 发送
+    # ------------------------------------------------------------------
 
     async def send_to_user(self, user_id: str, data: Dict, current_websocket: WebSocket) -> bool:
-        active_connection = self.connections.get(user_id)
-        if active_connection and active_connection is current_websocket:
-            try:
-                await active_connection.send_json(data)
-                return True
-            except (ConnectionClosed, RuntimeError) as e:
-                logger.warning(f"ConnectionManager: Could not send message to user '{user_id}', connection closed. Error: {e}")
-                self.disconnect(active_connection, user_id)
-        else:
+        """只发给指定的那一个连接（例如对该连接请求的应答、心跳）。"""
+        connection = self._current(current_websocket, user_id)
+        if connection is None:
             logger.warning(f"ConnectionManager: Suppressed message for user '{user_id}' on an outdated websocket.")
-        return False
+            return False
+        return self._deliver(connection, _encode(data))
+
+    def push_to_user(self, user_id: str, data: Dict) -> bool:
+        """把消息放入该用户所有连接（包括其他 worker 上的连接）的发送队列；返回本进程是否有连接收到。"""
+        text = _encode(data)
+        self._forward({"kind": "user", "target": user_id, "text": text})
+        return self._deliver_to_user(user_id, text) > 0
+
+    def publish(self, topic: str, data: Dict) -> int:
+        """把消息投递给订阅了 topic 的所有连接（包括其他 worker 上的连接），返回本进程投递的连接数。"""
+        text = _encode(data)
+        self._forward({"kind": "topic", "target": topic, "text": text})
+        return self._deliver_to_topic(topic, text)
 
 manager = ConnectionManager()
 
-async def broadcast_status_update(message: Any, msg_type: str = "log"):
+async def broadcast_status_update(message: Any, msg_type: str = "log", user_id: Optional[str] = None, topic: str = PUBLIC_TOPIC):
+    """
+    推送一条状态通知。指定 user_id 时只发给该用户（私有数据、用户配置等事件），
+    否则发给订阅了 topic 的连接（默认所有连接都订阅 public）。
+    """
     data_to_send = {"type": msg_type, "payload": message}
-    connected_sockets = list(manager.connections.items())
-    for user_id, connection in connected_sockets:
-        try:
-            await connection.send_json(data_to_send)
-        except (ConnectionClosed, RuntimeError):
-            manager.disconnect(connection, user_id)
\ No newline at end of file
+    if user_id is not None:
+        manager.push_to_user(user_id, data_to_send)
+    else:
+        manager.publish(topic, data_to_send)
@@ -0,0 +1,100 @@
+# novel_bot/src/plugins/ai_chat_system/services/content_versions.py
+# 职责: 为内容条目和集合维护进程内的单调递增版本号，供各类缓存判断失效，
+#       并据此生成 HTTP ETag，使条件 GET 可以在读取任何数据之前就返回 304。
+
+import hashlib
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .connection_manager import manager as connection_manager
+
+# Key: (owner_id, data_type, filename)，owner_id 为 None 表示公共数据
+_item_versions: Dict[Tuple[Optional[str], str, str], int] = {}
+# Key: (owner_id, collection)。collection 为数据类型（'character' 等），
+# 或 'sessions'（会话列表）、'config'（用户配置与资料）
+_collection_versions: Dict[Tuple[Optional[str], str], int] = {}
+# 版本号只保存在内存中，重启后从 0 开始；把启动随机数混入 ETag，避免重启前后的标签相同。
+# 各 worker 的随机数不同，因此 ETag 只在签发它的 worker 上命中；版本变化经 backplane 同步到其他 worker。
+_BOOT_NONCE = uuid.uuid4().hex
+
+
+def get_item_version(owner_id: Optional[str], data_type: str, filename: str) -> int:
+    """返回指定条目的当前版本号，从未变更过的条目版本为 0。"""
+    return _item_versions.get((owner_id, data_type, filename), 0)
+
+
+def _bump_item(owner_id: Optional[str], data_type: str, filename: str) -> int:
+    key = (owner_id, data_type, filename)
+    _item_versions[key] = _item_versions.get(key, 0) + 1
+    _bump_collection(owner_id, data_type)
+    return _item_versions[key]
+
+
+def _bump_collection(owner_id: Optional[str], collection: str) -> int:
+    key = (owner_id, collection)
+    _collection_versions[key] = _collection_versions.get(key, 0) + 1
+    return _collection_versions[key]
+
+
+def bump_item_version(owner_id: Optional[str], data_type: str, filename: str) -> int:
+    """在条目被创建、修改、删除或重命名后调用，使依赖它的缓存失效。"""
+    version = _bump_item(owner_id, data_type, filename)
+    connection_manager.publish_control("content_version", {"owner_id": owner_id, "data_type": data_type, "filename": filename})
+    return version
+
+
+def get_collection_version(owner_id: Optional[str], collection: str) -> int:
+    return _collection_versions.get((owner_id, collection), 0)
+
+
+def bump_collection_version(owner_id: Optional[str], collection: str) -> int:
+    """集合中任一成员被增删改（或影响列表内容的排序信息变化）后调用。"""
+    version = _bump_collection(owner_id, collection)
+    connection_manager.publish_control("content_version", {"owner_id": owner_id, "collection": collection})
+    return version
+
+
+def _apply_remote_bump(data: Dict[str, Any]):
+    # 多 worker 部署时，其他 worker 上的修改同样要使本进程的版本号前进，否则本进程会对过期的 ETag 返回 304
+    if "filename" in data:
+        _bump_item(data.get("owner_id"), data["data_type"], data["filename"])
+    else:
+        _bump_collection(data.get("owner_id"), data["collection"])
+
+
+connection_manager.on_control("content_version", _apply_remote_bump)
+
+
+def get_visible_item_version(user_id: str, data_type: str, filename: str) -> Tuple[int, int]:
+    """用户可见的条目可能来自私有或公共数据，因此同时返回两者的版本号。"""
+    return (
+        get_item_version(user_id, data_type, filename),
+        get_item_version(None, data_type, filename),
+    )
+
+
+def make_etag(*parts: Any) -> str:
+    """由版本号与请求参数生成强 ETag。"""
+    raw = "|".join([_BOOT_NONCE, *(str(part) for part in parts)])
+    return f'"{hashlib.sha1(raw.encode("utf-8")).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """按 RFC 9110 的弱比较处理 If-None-Match（支持列表、W/ 前缀与 *）。"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def not_modified_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """If-None-Match 命中时返回 304 响应，否则把 ETag 写入正常响应的头部并返回 None。"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
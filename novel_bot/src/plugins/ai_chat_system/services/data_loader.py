@@ -30,7 +30,11 @@ def _convert_sillytavern_world_info(file_path: Path, raw_data: Dict) -> Optional
                 converted_entries.append({
                     "name": entry_data.get("comment", file_path.stem),
                     "keywords": keywords, 
-                    "content": content
+                    "content": content,
+                    # 保留触发相关的字段，供世界书激活引擎使用
+                    "constant": bool(entry_data.get("constant", False)),
+                    "disable": bool(entry_data.get("disable", False)),
+                    "scan_depth": entry_data.get("scanDepth"),
                 })
         
         name = raw_data.get("name") or file_path.stem
@@ -5,14 +5,17 @@ import logging
 import os
 import shutil
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from .. import global_state
-from ..database.models import ContentItem
+from ..database.models import ContentItem, ContentDisplayRank
+from ..database.session import dialect_insert
+from .content_versions import bump_item_version
+from .search_index import index_content_item, remove_content_item
 
 logger = logging.getLogger("nonebot")
 
@@ -20,6 +23,8 @@ _PROJECT_ROOT = Path(__file__).resolve().parents[5]
 BASE_DATA_PATH = _PROJECT_ROOT / "novel_bot" / "data" / "ai_chat"
 _USER_DATA_PATH = BASE_DATA_PATH / "users"
 
+CONTENT_DATA_TYPES = ("character", "preset", "world_info", "group")
+
 def get_user_data_path(user_id: str, data_type: str) -> Path:
     """获取并确保用户特定数据类型的目录存在"""
     dir_map = {
@@ -37,6 +42,9 @@ def get_user_data_path(user_id: str, data_type: str) -> Path:
 
 # [核心重构] 将所有文件操作替换为数据库操作
 # -------------------------------------------------------------------------
+# 同名条目已存在时被覆盖的列
+_UPSERT_COLUMNS = ("data", "name", "display_name", "is_user_persona")
+
 async def save_content_item_to_db(db: AsyncSession, user_id: str, data_type: str, filename: str, data: Dict, is_editing: bool) -> Dict[str, Any]:
     try:
         if is_editing:
@@ -45,30 +53,23 @@ async def save_content_item_to_db(db: AsyncSession, user_id: str, data_type: str
                 ContentItem.owner_id == user_id,
                 ContentItem.data_type == data_type,
                 ContentItem.filename == filename
-            ).values(data=data)
-            await db.execute(stmt)
+            ).values(data=data, **ContentItem.index_columns(data)).returning(ContentItem.id)
+            item_id = (await db.execute(stmt)).scalar_one_or_none()
         else:
-            # 创建新条目
-            # 检查是否存在同名项
-            existing_item_query = select(ContentItem).where(
-                ContentItem.owner_id == user_id,
-                ContentItem.data_type == data_type,
-                ContentItem.filename == filename
+            # [优化] 创建新条目：同名项已存在时转为更新，一条 INSERT ... ON CONFLICT 完成，无需先查询
+            stmt = dialect_insert(db.get_bind().dialect.name)(ContentItem).values(
+                owner_id=user_id, data_type=data_type, filename=filename, data=data, **ContentItem.index_columns(data)
             )
-            existing_item = await db.execute(existing_item_query)
-            if existing_item.scalar_one_or_none():
-                # 如果已存在，则转为更新操作以避免冲突
-                stmt = update(ContentItem).where(
-                    ContentItem.owner_id == user_id,
-                    ContentItem.data_type == data_type,
-                    ContentItem.filename == filename
-                ).values(data=data)
-                await db.execute(stmt)
-            else:
-                new_item = ContentItem(owner_id=user_id, data_type=data_type, filename=filename, data=data)
-                db.add(new_item)
-        
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["owner_id", "data_type", "filename"],
+                set_={column: stmt.excluded[column] for column in _UPSERT_COLUMNS},
+            ).returning(ContentItem.id)
+            item_id = (await db.execute(stmt)).scalar_one()
+
+        if item_id is not None:
+            await index_content_item(db, item_id, data_type, data)
         await db.commit()
+        bump_item_version(user_id, data_type, filename)
         return {"success": True, "filename": filename, "data": data}
     except IntegrityError as e:
         await db.rollback()
@@ -79,16 +80,107 @@ async def save_content_item_to_db(db: AsyncSession, user_id: str, data_type: str
         logger.error(f"DB Persistence: Error saving item for {user_id} - {data_type}/{filename}: {e}", exc_info=True)
         return {"success": False, "error": str(e)}
 
+# 单条 INSERT 的行数上限，避免超过 SQLite 的绑定参数数量限制
+BULK_UPSERT_CHUNK_SIZE = 200
+
+async def bulk_upsert_content_items(
+    db: AsyncSession, user_id: str, items: List[Dict[str, Any]], overwrite: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    批量写入用户的私有条目。items 中每项为 {"data_type", "filename", "data"}。
+    使用 INSERT ... ON CONFLICT (owner_id, data_type, filename) 分批写入，所有批次在同一个事务中提交。
+    overwrite=False 时已存在的条目保持不变（DO NOTHING），用于"跳过已有"的导入。
+    返回与 items 一一对应的结果：status 为 inserted / updated / skipped / failed。
+    """
+    results: List[Dict[str, Any]] = [
+        {"data_type": item.get("data_type"), "filename": item.get("filename"), "status": "failed"}
+        for item in items
+    ]
+    # 校验并去重：同一批中重复的 (类型, 文件名) 以最后一次出现为准
+    latest: Dict[Tuple[str, str], int] = {}
+    for index, item in enumerate(items):
+        data_type, filename, data = item.get("data_type"), item.get("filename"), item.get("data")
+        if data_type not in CONTENT_DATA_TYPES:
+            results[index]["error"] = f"Invalid data type '{data_type}'."
+        elif not isinstance(filename, str) or not filename.strip():
+            results[index]["error"] = "Data name cannot be empty."
+        elif not isinstance(data, dict):
+            results[index]["error"] = "Item data must be an object."
+        else:
+            previous = latest.get((data_type, filename))
+            if previous is not None:
+                results[previous].update(status="skipped", error="Superseded by a later item with the same name.")
+            latest[(data_type, filename)] = index
+    if not latest:
+        return results
+
+    positions = list(latest.values())
+    try:
+        existing = set()
+        for data_type in {items[i]["data_type"] for i in positions}:
+            filenames = [items[i]["filename"] for i in positions if items[i]["data_type"] == data_type]
+            for offset in range(0, len(filenames), BULK_UPSERT_CHUNK_SIZE):
+                rows = await db.execute(select(ContentItem.filename).where(
+                    ContentItem.owner_id == user_id,
+                    ContentItem.data_type == data_type,
+                    ContentItem.filename.in_(filenames[offset:offset + BULK_UPSERT_CHUNK_SIZE]),
+                ))
+                existing.update((data_type, filename) for filename in rows.scalars())
+
+        upsert = dialect_insert(db.get_bind().dialect.name)
+        written: Dict[Tuple[str, str], int] = {}
+        for offset in range(0, len(positions), BULK_UPSERT_CHUNK_SIZE):
+            chunk = positions[offset:offset + BULK_UPSERT_CHUNK_SIZE]
+            stmt = upsert(ContentItem).values([
+                {
+                    "owner_id": user_id, "data_type": items[i]["data_type"], "filename": items[i]["filename"],
+                    "data": items[i]["data"], **ContentItem.index_columns(items[i]["data"]),
+                }
+                for i in chunk
+            ])
+            conflict_columns = ["owner_id", "data_type", "filename"]
+            if overwrite:
+                stmt = stmt.on_conflict_do_update(index_elements=conflict_columns, set_={
+                    column: stmt.excluded[column] for column in _UPSERT_COLUMNS
+                })
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+            result = await db.execute(stmt.returning(ContentItem.id, ContentItem.data_type, ContentItem.filename))
+            written.update({(data_type, filename): item_id for item_id, data_type, filename in result})
+
+        for i in positions:
+            key = (items[i]["data_type"], items[i]["filename"])
+            if key in written:
+                await index_content_item(db, written[key], key[0], items[i]["data"])
+                results[i]["status"] = "updated" if key in existing else "inserted"
+            else:
+                results[i]["status"] = "skipped"
+                results[i]["error"] = "An item with this name already exists."
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"DB Persistence: Bulk upsert of {len(positions)} items for {user_id} failed: {e}", exc_info=True)
+        for i in positions:
+            results[i].update(status="failed", error=str(e))
+        return results
+
+    for result in results:
+        if result["status"] in ("inserted", "updated"):
+            bump_item_version(user_id, result["data_type"], result["filename"])
+    return results
+
 async def delete_content_item_from_db(db: AsyncSession, user_id: str, data_type: str, filename: str) -> str:
     try:
         stmt = delete(ContentItem).where(
             ContentItem.owner_id == user_id,
             ContentItem.data_type == data_type,
             ContentItem.filename == filename
-        )
-        result = await db.execute(stmt)
+        ).returning(ContentItem.id)
+        deleted_ids = list((await db.execute(stmt)).scalars())
+        await remove_content_item(db, deleted_ids)
         await db.commit()
-        if result.rowcount > 0:
+        if deleted_ids:
+            bump_item_version(user_id, data_type, filename)
             return f"成功删除您的私有{data_type} '{filename}'。"
         else:
             return f"错误: 未找到您名为 '{filename}' 的私有{data_type}。"
@@ -120,7 +212,35 @@ async def rename_content_item_in_db(db: AsyncSession, user_id: str, data_type: s
             return f"❌ 错误：找不到名为 '{old_filename}' 的私有数据。"
             
         await db.commit()
+        bump_item_version(user_id, data_type, old_filename)
+        bump_item_version(user_id, data_type, new_filename)
         return f"✅ 成功将 '{old_filename}' 重命名为 '{new_filename}'。"
     except Exception as e:
         await db.rollback()
-        return f"❌ 重命名时发生严重错误: {e}"
\ No newline at end of file
+        return f"❌ 重命名时发生严重错误: {e}"
+
+async def sync_display_ranks(db: AsyncSession, user_id: str, display_order: Dict[str, Any]):
+    """
+    把 display_order 同步到 content_display_ranks，只重写发生变化的列表（不提交，由调用方统一提交）。
+    与已存储的 rank 行比较而不是与旧配置比较，因为配置字典可能已被原地修改。
+    """
+    stored: Dict[str, list] = {}
+    result = await db.execute(
+        select(ContentDisplayRank.list_key, ContentDisplayRank.filename)
+        .where(ContentDisplayRank.owner_id == user_id)
+        .order_by(ContentDisplayRank.list_key, ContentDisplayRank.rank)
+    )
+    for list_key, filename in result:
+        stored.setdefault(list_key, []).append(filename)
+
+    display_order = display_order or {}
+    for list_key in set(stored) | set(display_order):
+        order = display_order.get(list_key)
+        rows = ContentDisplayRank.rows_for(user_id, list_key, order) if isinstance(order, list) else []
+        if stored.get(list_key, []) == [row["filename"] for row in rows]:
+            continue
+        await db.execute(delete(ContentDisplayRank).where(
+            ContentDisplayRank.owner_id == user_id, ContentDisplayRank.list_key == list_key
+        ))
+        if rows:
+            await db.execute(insert(ContentDisplayRank), rows)
@@ -8,12 +8,12 @@ import json
 import logging
 from typing import Dict
 
-import google.generativeai as genai
 from fastapi import HTTPException
 from gradio_client import Client
 from PIL import Image
 
 from ... import global_state as chat_system
+from ...llm_services.client_pool import llm_client_pool
 
 logger = logging.getLogger("nonebot")
 
@@ -52,12 +52,11 @@ async def _analyze_with_gemini(base64_data: str) -> str:
         if not api_manager or not api_manager.verified_models:
             raise HTTPException(status_code=503, detail="AI model service is not ready.")
         model_name = next((m for m in api_manager.verified_models if "flash" in m), api_manager.verified_models[0])
-        genai.configure(api_key=api_manager.get_current_key())
-        model = genai.GenerativeModel(model_name, safety_settings={"HARM_CATEGORY_HARASSMENT": "BLOCK_NONE", "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE", "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE", "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE"})
+        model = llm_client_pool.get_gemini_client(api_manager.get_current_key()).get_model(model_name)
         prompt_text = "Analyze the provided image within a fictional, artistic context... Return ONLY the generated prompt text, without any additional explanations." # 省略完整prompt
         image_bytes = base64.b64decode(base64_data.split(",", 1)[1])
         img_pil = Image.open(io.BytesIO(image_bytes))
-        response = await model.generate_content_async([prompt_text, img_pil])
+        response = await model.generate_content_async([prompt_text, img_pil], safety_settings={"HARM_CATEGORY_HARASSMENT": "BLOCK_NONE", "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE", "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE", "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE"})
         if not response.candidates or not hasattr(response, "text"):
             block_reason = (response.prompt_feedback.block_reason.name if response.prompt_feedback else "UNKNOWN")
             raise HTTPException(status_code=400, detail=f"Image analysis was blocked. Reason: {block_reason}.")
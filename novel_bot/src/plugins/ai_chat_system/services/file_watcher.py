@@ -13,6 +13,7 @@ from watchdog.observers import Observer
 
 from .. import global_state
 from .connection_manager import broadcast_status_update
+from .content_versions import bump_item_version
 
 logger = logging.getLogger("nonebot")
 
@@ -20,6 +21,8 @@ from .data_persistence import BASE_DATA_PATH
 # [优化] 从此处移除 import reconfigure_system 以解决循环导入问题
 
 DEBOUNCE_DELAY = 0.5
+# 数据目录名到内部 data_type 的映射，用于使对应条目的缓存失效
+_DIR_TO_DATA_TYPE = {"characters": "character", "presets": "preset", "world_info": "world_info", "groups": "group"}
 debounce_timers: Dict[Path, asyncio.TimerHandle] = {}
 
 
@@ -72,12 +75,16 @@ async def _handle_file_change(path: Path):
         else:
             logger.warning(f"File Watcher: Could not determine data type for path: {path}")
             return
+
+        changed_data_type = _DIR_TO_DATA_TYPE.get(payload['data_type'])
+        if changed_data_type:
+            bump_item_version(payload['user_id'], changed_data_type, path.stem)
             
         if event_type != "deleted":
             with open(path, "r", encoding="utf-8") as f:
                 payload["content"] = json5.load(f)
         
-        await broadcast_status_update(payload, msg_type="file_update")
+        await broadcast_status_update(payload, msg_type="file_update", user_id=payload['user_id'])
         logger.info(f"File Watcher: Broadcasted file_update for {path.name}")
 
     except Exception as e:
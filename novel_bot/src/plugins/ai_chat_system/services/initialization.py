@@ -9,6 +9,10 @@ import sys
 from ..services.file_watcher import start_file_watcher
 from ..services.archival_service import initialize_data_conduit
 from ..database.session import initialize_database, create_db_and_tables
+from ..llm_services.client_pool import llm_client_pool
+from ..services.message_compression import message_codec, DEFAULT_MIN_BYTES
+from ..services.job_executor import job_executor
+from ..services.connection_manager import manager as connection_manager
 
 from .. import global_state
 from ..data_manager import DataManager
@@ -49,6 +53,15 @@ async def reconfigure_system():
         if not db_url:
             raise ValueError("Database URL could not be determined. Please check config.toml.")
 
+        compression_config = db_config.get("message_compression", {})
+        message_codec.configure(
+            enabled=compression_config.get("enabled", True),
+            min_bytes=compression_config.get("min_bytes", DEFAULT_MIN_BYTES),
+        )
+
+        job_executor.configure(config_data.get("jobs", {}))
+        await connection_manager.configure_backplane(config_data.get("websocket", {}))
+
         initialize_database(db_url)
         await create_db_and_tables()
         
@@ -66,6 +79,9 @@ async def reconfigure_system():
             if 'HTTPS_PROXY' in os.environ: del os.environ['HTTPS_PROXY']
             if 'HTTP_PROXY' in os.environ: del os.environ['HTTP_PROXY']
             logger.info("System Reconfiguration: No proxy found. Cleared proxy environment variables.")
+
+        # 已建立的 gRPC 通道不会感知代理变化，丢弃后按新的代理重新建立
+        llm_client_pool.clear()
         
         logger.info("System Reconfiguration: Hot reload complete.")
 
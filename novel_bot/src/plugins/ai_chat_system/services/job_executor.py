@@ -0,0 +1,434 @@
+# novel_bot/src/plugins/ai_chat_system/services/job_executor.py
+# 职责: 后台作业执行器。导出、导入、批量 TTS、图片生成、上传等耗时操作以"作业"形式提交到具名队列，
+#       每个队列有总并发与单用户并发上限，队列内按优先级（数值越小越先）与提交顺序调度，
+#       一个用户的大批量作业不会占满全部执行槽位。作业状态保存在 tasks 表（经 TaskManager 的注册表），
+#       支持取消、失败后指数退避重试。每个 worker 定期为自己持有的作业续约（worker_id + heartbeat_at），
+#       续约过期的未完成作业（持有者已退出）由其他 worker 或重启后的进程接管并重新排队。
+#       CPU 密集的步骤可通过 JobContext.run_cpu() 放入进程池执行，不阻塞事件循环。
+
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+
+from ..database import session as db_session
+from ..database.models import Task
+from ..database.write_queue import write_queue
+from .task_manager import task_registry, _task_to_dict
+from .connection_manager import manager as connection_manager
+from .backplane import WORKER_ID
+
+logger = logging.getLogger("nonebot")
+
+DEFAULT_QUEUE = "default"
+DEFAULT_PRIORITY = 10
+DEFAULT_PROCESS_WORKERS = 2
+# 重试间隔上限（秒）
+MAX_RETRY_DELAY = 300.0
+# 作业续约间隔与租约时长（秒）。租约须远大于续约间隔，超过租约未续约的作业视为持有者已退出
+HEARTBEAT_INTERVAL = 15.0
+JOB_LEASE = 60.0
+
+
+class QueueSpec:
+    def __init__(self, concurrency: int, per_user: int):
+        self.concurrency = max(int(concurrency), 1)
+        self.per_user = max(min(int(per_user), self.concurrency), 1)
+
+
+# 队列的默认并发配置，可被 config.toml 的 [jobs.queues.<name>] 覆盖
+DEFAULT_QUEUES: Dict[str, QueueSpec] = {
+    DEFAULT_QUEUE: QueueSpec(concurrency=4, per_user=2),
+    # 头像、角色图片等交互性上传：很快，但用户在等待结果
+    "interactive": QueueSpec(concurrency=4, per_user=2),
+    # 图片生成、批量 TTS：依赖外部服务、耗时长
+    "media": QueueSpec(concurrency=2, per_user=1),
+    # 数据导入导出
+    "bulk": QueueSpec(concurrency=1, per_user=1),
+}
+
+
+class JobError(Exception):
+    """作业内不可重试的失败（例如输入无效），message 直接作为任务的错误信息。"""
+
+
+class JobHandler:
+    def __init__(self, task_type: str, func: Callable[["JobContext"], Awaitable[Any]], queue: str,
+                 priority: int, max_attempts: int, retry_delay: float):
+        self.task_type = task_type
+        self.func = func
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max(int(max_attempts), 1)
+        self.retry_delay = retry_delay
+
+
+class Job:
+    def __init__(self, task_id: str, user_id: str, task_type: str, queue: str, priority: int,
+                 payload: Optional[Dict[str, Any]], attempts: int = 0):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.task_type = task_type
+        self.queue = queue
+        self.priority = priority
+        self.payload = payload or {}
+        self.attempts = attempts
+
+
+class JobContext:
+    """传给作业处理函数的上下文。"""
+
+    def __init__(self, executor: "JobExecutor", job: Job):
+        self._executor = executor
+        self.task_id = job.task_id
+        self.user_id = job.user_id
+        self.payload = job.payload
+        self.attempt = job.attempts
+
+    async def progress(self, progress: int, status_text: str):
+        await task_registry.update_progress(self.task_id, progress, status_text)
+
+    async def run_cpu(self, func: Callable[..., Any], *args) -> Any:
+        """在进程池中执行 CPU 密集的函数（func 与参数必须可 pickle，即模块级函数）。"""
+        return await self._executor.run_in_process(func, *args)
+
+
+def _error_detail(error: Exception) -> str:
+    return str(error.detail) if isinstance(error, HTTPException) else str(error)
+
+
+class JobExecutor:
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queues: Dict[str, QueueSpec] = dict(DEFAULT_QUEUES)
+        self.process_workers = DEFAULT_PROCESS_WORKERS
+        # 每个队列一个 (priority, 序号, task_id) 小顶堆；被取消的作业在出堆时跳过
+        self._ready: Dict[str, List[Tuple[int, int, str]]] = {}
+        self._sequence = itertools.count()
+        self._jobs: Dict[str, Job] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._running_per_queue: Dict[str, int] = {}
+        self._running_per_user: Dict[Tuple[str, str], int] = {}
+        self._delayed: Dict[str, asyncio.TimerHandle] = {}
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._maintenance: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    # ------------------------------------------------------------------
+    # 注册与配置
+    # ------------------------------------------------------------------
+
+    def handler(self, task_type: str, queue: str = DEFAULT_QUEUE, priority: int = DEFAULT_PRIORITY,
+                max_attempts: int = 3, retry_delay: float = 5.0):
+        """
+        注册作业处理函数的装饰器。处理函数接收 JobContext，返回值作为任务结果；
+        抛出 JobError 时直接失败，抛出其他异常时按指数退避重试，直到 max_attempts 次。
+        """
+        def decorator(func: Callable[[JobContext], Awaitable[Any]]):
+            self._handlers[task_type] = JobHandler(task_type, func, queue, priority, max_attempts, retry_delay)
+            return func
+        return decorator
+
+    def configure(self, config: Dict[str, Any]):
+        """读取 config.toml 的 [jobs] 配置。"""
+        self.process_workers = int(config.get("process_workers", DEFAULT_PROCESS_WORKERS))
+        queues = dict(DEFAULT_QUEUES)
+        for name, options in (config.get("queues") or {}).items():
+            default = DEFAULT_QUEUES.get(name, DEFAULT_QUEUES[DEFAULT_QUEUE])
+            queues[name] = QueueSpec(
+                concurrency=options.get("concurrency", default.concurrency),
+                per_user=options.get("per_user", default.per_user),
+            )
+        self._queues = queues
+        self._dispatch()
+
+    def _spec(self, queue: str) -> QueueSpec:
+        return self._queues.get(queue) or self._queues[DEFAULT_QUEUE]
+
+    # ------------------------------------------------------------------
+    # 提交、取消与恢复
+    # ------------------------------------------------------------------
+
+    async def submit(self, task_type: str, user_id: str, payload: Optional[Dict[str, Any]] = None,
+                     priority: Optional[int] = None) -> str:
+        """把作业写入 tasks 表（状态 pending）并排队，返回任务 ID。payload 必须可 JSON 序列化。"""
+        handler = self._handlers.get(task_type)
+        if handler is None:
+            raise ValueError(f"No job handler registered for task type '{task_type}'.")
+        priority = handler.priority if priority is None else priority
+        task_id = await task_registry.create(
+            task_type, user_id, status="pending", status_text="排队中",
+            queue=handler.queue, priority=priority, payload=payload, attempts=0,
+            worker_id=WORKER_ID, heartbeat_at=time.time(),
+        )
+        self._enqueue(Job(task_id, user_id, task_type, handler.queue, priority, payload))
+        self._dispatch()
+        return task_id
+
+    async def cancel(self, task_id: str) -> bool:
+        """取消排队中或正在执行的作业；作业不存在或已结束时返回 False。"""
+        running = self._running.get(task_id)
+        if running is not None:
+            running.cancel()
+            return True
+        job = self._jobs.pop(task_id, None)
+        if job is None:
+            return False
+        delayed = self._delayed.pop(task_id, None)
+        if delayed is not None:
+            delayed.cancel()
+        await task_registry.finish(task_id, "failed", {"error": "任务已取消", "cancelled": True}, payload=None)
+        logger.info(f"JOB_EXECUTOR: Cancelled queued job {task_id} ({job.task_type}).")
+        return True
+
+    def request_remote_cancel(self, task_id: str):
+        """作业可能在其他 worker 上执行：经 backplane 请求持有它的 worker 取消。"""
+        connection_manager.publish_control("job_cancel", {"task_id": task_id})
+
+    async def _on_remote_cancel(self, data: Dict[str, Any]):
+        if data.get("task_id"):
+            await self.cancel(data["task_id"])
+
+    async def start(self):
+        """接管续约已过期的未完成作业，并启动定期续约/接管的后台协程。"""
+        self._stopping = False
+        if not db_session.AsyncSessionLocal:
+            return
+        await self._recover()
+        if self._maintenance is None or self._maintenance.done():
+            self._maintenance = asyncio.create_task(self._maintain())
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._heartbeat()
+                await self._recover()
+            except Exception as e:
+                logger.error(f"JOB_EXECUTOR: Lease maintenance failed: {e}", exc_info=True)
+
+    async def _heartbeat(self):
+        """为本进程持有的全部作业（排队、等待重试或执行中）续约。"""
+        task_ids = list(self._jobs)
+        if not task_ids:
+            return
+        stmt = (
+            update(Task)
+            .where(Task.id.in_(task_ids), Task.worker_id == WORKER_ID)
+            .values(heartbeat_at=time.time())
+        )
+        await write_queue.submit(lambda db: db.execute(stmt))
+
+    async def _recover(self):
+        """把持有者已退出（续约过期）的未完成作业重新排队（正在执行时被中断的作业从头重新执行）。"""
+        async with db_session.AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Task)
+                .where(
+                    Task.queue.is_not(None),
+                    Task.status.in_(["pending", "processing"]),
+                    or_(Task.heartbeat_at.is_(None), Task.heartbeat_at < time.time() - JOB_LEASE),
+                )
+                .order_by(Task.created_at)
+            )).scalars().all()
+
+        now = time.time()
+        recovered = 0
+        for row in rows:
+            if row.id in self._jobs:
+                continue
+            # 多个 worker 同时接管时，只有认领成功的 worker 恢复该作业
+            if not await self._claim(row):
+                continue
+            task_registry.adopt(_task_to_dict(row))
+            handler = self._handlers.get(row.task_type)
+            if handler is None:
+                await task_registry.finish(row.id, "failed", {"error": f"未知的任务类型 '{row.task_type}'。"}, payload=None)
+                continue
+            job = Job(row.id, row.user_id, row.task_type, handler.queue,
+                      row.priority if row.priority is not None else handler.priority,
+                      row.payload, row.attempts or 0)
+            await task_registry.finish(row.id, "pending", status_text="服务重启，重新排队中")
+            delay = (row.run_after or 0) - now
+            if delay > 0:
+                self._jobs[job.task_id] = job
+                self._delayed[job.task_id] = asyncio.get_running_loop().call_later(delay, self._requeue, job.task_id)
+            else:
+                self._enqueue(job)
+            recovered += 1
+        if recovered:
+            logger.info(f"JOB_EXECUTOR: Re-queued {recovered} unfinished jobs.")
+        self._dispatch()
+
+    @staticmethod
+    async def _claim(row: Task) -> bool:
+        # 认领条件与查询条件相同并在同一条 UPDATE 中检查：期间被续约或被他人认领的作业不会被重复接管
+        now = time.time()
+        stmt = (
+            update(Task)
+            .where(
+                Task.id == row.id,
+                Task.status.in_(["pending", "processing"]),
+                or_(Task.heartbeat_at.is_(None), Task.heartbeat_at < now - JOB_LEASE),
+            )
+            .values(worker_id=WORKER_ID, heartbeat_at=now)
+        )
+        result = await write_queue.submit(lambda db: db.execute(stmt))
+        return result.rowcount == 1
+
+    async def _release_leases(self):
+        """正常停止时放弃租约，使重启后的进程（或其他 worker）可以立即接管这些作业，而不必等待租约过期。"""
+        if not db_session.AsyncSessionLocal:
+            return
+        stmt = (
+            update(Task)
+            .where(Task.worker_id == WORKER_ID, Task.status.in_(["pending", "processing"]))
+            .values(worker_id=None, heartbeat_at=None)
+        )
+        try:
+            await write_queue.submit(lambda db: db.execute(stmt))
+        except Exception as e:
+            logger.warning(f"JOB_EXECUTOR: Could not release job leases on shutdown: {e}")
+
+    async def shutdown(self):
+        """停止调度并中断正在执行的作业。它们在数据库中保持 processing 状态并放弃租约，下次启动时（或由其他 worker）重新排队。"""
+        self._stopping = True
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+        for handle in self._delayed.values():
+            handle.cancel()
+        self._delayed.clear()
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        await self._release_leases()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {
+                "queued": sum(1 for *_, task_id in self._ready.get(name, []) if task_id in self._jobs),
+                "running": self._running_per_queue.get(name, 0),
+                "concurrency": spec.concurrency,
+                "per_user": spec.per_user,
+            }
+            for name, spec in self._queues.items()
+        }
+
+    # ------------------------------------------------------------------
+    # 调度
+    # ------------------------------------------------------------------
+
+    def _enqueue(self, job: Job):
+        self._jobs[job.task_id] = job
+        heapq.heappush(self._ready.setdefault(job.queue, []), (job.priority, next(self._sequence), job.task_id))
+
+    def _requeue(self, task_id: str):
+        self._delayed.pop(task_id, None)
+        job = self._jobs.get(task_id)
+        if job is not None and not self._stopping:
+            self._enqueue(job)
+            self._dispatch()
+
+    def _dispatch(self):
+        if self._stopping:
+            return
+        for queue, heap in self._ready.items():
+            spec = self._spec(queue)
+            blocked = []
+            while heap and self._running_per_queue.get(queue, 0) < spec.concurrency:
+                entry = heapq.heappop(heap)
+                job = self._jobs.get(entry[2])
+                if job is None or job.task_id in self._running:
+                    continue
+                if self._running_per_user.get((queue, job.user_id), 0) >= spec.per_user:
+                    # 该用户已达到单用户上限，让位给后面其他用户的作业
+                    blocked.append(entry)
+                    continue
+                self._start(job)
+            for entry in blocked:
+                heapq.heappush(heap, entry)
+
+    def _start(self, job: Job):
+        user_key = (job.queue, job.user_id)
+        self._running_per_queue[job.queue] = self._running_per_queue.get(job.queue, 0) + 1
+        self._running_per_user[user_key] = self._running_per_user.get(user_key, 0) + 1
+        self._running[job.task_id] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: Job):
+        handler = self._handlers[job.task_type]
+        job.attempts += 1
+        retry_delay = None
+        try:
+            await task_registry.finish(
+                job.task_id, "processing", status_text="执行中", attempts=job.attempts, start_time=time.time(), run_after=None,
+            )
+            result = await handler.func(JobContext(self, job))
+        except asyncio.CancelledError:
+            if not self._stopping:
+                await task_registry.finish(job.task_id, "failed", {"error": "任务已取消", "cancelled": True}, payload=None)
+                logger.info(f"JOB_EXECUTOR: Cancelled running job {job.task_id} ({job.task_type}).")
+        except JobError as e:
+            await task_registry.finish(job.task_id, "failed", {"error": str(e)}, payload=None)
+        except Exception as e:
+            if job.attempts < handler.max_attempts:
+                retry_delay = min(handler.retry_delay * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+                logger.warning(
+                    f"JOB_EXECUTOR: Job {job.task_id} ({job.task_type}) failed on attempt {job.attempts}, "
+                    f"retrying in {retry_delay:.0f}s: {e}"
+                )
+                await task_registry.finish(
+                    job.task_id, "pending", status_text=f"执行失败，{retry_delay:.0f} 秒后重试",
+                    run_after=time.time() + retry_delay,
+                )
+            else:
+                logger.error(f"JOB_EXECUTOR: Job {job.task_id} ({job.task_type}) failed: {e}", exc_info=True)
+                await task_registry.finish(job.task_id, "failed", {"error": _error_detail(e)}, payload=None)
+        else:
+            await task_registry.finish(job.task_id, "success", result, payload=None)
+        finally:
+            user_key = (job.queue, job.user_id)
+            self._running_per_queue[job.queue] -= 1
+            self._running_per_user[user_key] -= 1
+            if not self._running_per_user[user_key]:
+                del self._running_per_user[user_key]
+            self._running.pop(job.task_id, None)
+            if retry_delay is not None and not self._stopping:
+                self._delayed[job.task_id] = asyncio.get_running_loop().call_later(retry_delay, self._requeue, job.task_id)
+            elif not self._stopping:
+                self._jobs.pop(job.task_id, None)
+            self._dispatch()
+
+    # ------------------------------------------------------------------
+    # 进程池
+    # ------------------------------------------------------------------
+
+    async def run_in_process(self, func: Callable[..., Any], *args) -> Any:
+        """process_workers 为 0 时退化为线程池执行。"""
+        if self.process_workers <= 0:
+            return await asyncio.to_thread(func, *args)
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._process_pool, functools.partial(func, *args))
+        except BrokenProcessPool:
+            # 工作进程异常退出后进程池不可再用，下次调用时重建
+            self._process_pool = None
+            raise
+
+
+job_executor = JobExecutor()
+connection_manager.on_control("job_cancel", job_executor._on_remote_cancel)
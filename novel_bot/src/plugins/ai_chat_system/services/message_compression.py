@@ -0,0 +1,361 @@
+# novel_bot/src/plugins/ai_chat_system/services/message_compression.py
+# 职责: 聊天消息正文的可选存储编码。超过阈值的正文用 zstd 压缩（有训练好的字典时使用字典）后存入
+#       chat_messages.content_blob，content_codec 记录编码方式（NULL 为明文），新旧行可以共存；
+#       读取时在序列化消息时才解压。字典由本库的消息样本训练并保存在 compression_dictionaries 中，
+#       已有的明文行由定时任务分批重新压缩。未安装 zstandard 时只写明文，已压缩的行无法读取。
+#       多 worker 部署时只有领取到训练名额的 worker 训练字典，训练完成后经 backplane 通知其他 worker 加载；
+#       解压前发现缺少字典时也会从数据库补加载。
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ..database import session as db_session
+from ..database.models import ChatMessage, CompressionDictionary
+from ..database.write_queue import write_queue
+from .connection_manager import manager as connection_manager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("nonebot")
+
+CODEC_ZSTD = "zstd"
+DEFAULT_MIN_BYTES = 2048
+COMPRESSION_LEVEL = 9
+# 压缩后至少要节省 10% 才值得以压缩形式保存
+MAX_COMPRESSED_RATIO = 0.9
+
+DICTIONARY_SIZE = 112 * 1024
+MIN_TRAINING_SAMPLES = 200
+MAX_TRAINING_SAMPLES = 5000
+MIN_SAMPLE_CHARS = 256
+
+RECOMPRESS_BATCH_SIZE = 200
+# 训练名额（data 为空的占位行）超过该时间仍未完成，视为训练它的 worker 已退出，可以重新领取
+TRAINING_CLAIM_TIMEOUT = 3600.0
+
+
+class MessageCodec:
+    """
+    encode() 把正文转换为 (content, content_codec, content_blob) 三列的值，decode() 反之。
+    编码 "zstd" 表示无字典，"zstd:<id>" 表示使用 compression_dictionaries 中对应 id 的字典。
+    """
+
+    def __init__(self):
+        self.enabled = zstandard is not None
+        self.min_bytes = DEFAULT_MIN_BYTES
+        self._dictionaries: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._active_dictionary_id: Optional[int] = None
+        # zstd 的压缩/解压对象不是线程安全的，重新压缩任务在工作线程中运行，因此按线程各自缓存
+        self._local = threading.local()
+
+    def configure(self, enabled: bool = True, min_bytes: int = DEFAULT_MIN_BYTES):
+        if enabled and zstandard is None:
+            logger.warning("MESSAGE_CODEC: Message compression is enabled but 'zstandard' is not installed. Storing plain text.")
+        self.enabled = enabled and zstandard is not None
+        self.min_bytes = max(int(min_bytes), 64)
+
+    @property
+    def active_dictionary_id(self) -> Optional[int]:
+        return self._active_dictionary_id
+
+    def register_dictionary(self, dictionary_id: int, data: bytes, activate: bool = True):
+        if zstandard is None:
+            return
+        self._dictionaries[dictionary_id] = zstandard.ZstdCompressionDict(data)
+        if activate and (self._active_dictionary_id is None or dictionary_id > self._active_dictionary_id):
+            self._active_dictionary_id = dictionary_id
+
+    def has_dictionary(self, dictionary_id: int) -> bool:
+        return dictionary_id in self._dictionaries
+
+    def missing_dictionaries(self, codecs: Iterable[Optional[str]]) -> Set[int]:
+        """返回这些编码引用、但本进程尚未加载的字典 id。"""
+        missing = set()
+        for codec in codecs:
+            if not codec:
+                continue
+            name, _, dictionary_id = codec.partition(":")
+            if name == CODEC_ZSTD and dictionary_id and not self.has_dictionary(int(dictionary_id)):
+                missing.add(int(dictionary_id))
+        return missing
+
+    def _thread_cache(self, name: str) -> Dict[Optional[int], object]:
+        cache = getattr(self._local, name, None)
+        if cache is None:
+            cache = {}
+            setattr(self._local, name, cache)
+        return cache
+
+    def _compressor(self, dictionary_id: Optional[int]) -> "zstandard.ZstdCompressor":
+        compressors = self._thread_cache("compressors")
+        compressor = compressors.get(dictionary_id)
+        if compressor is None:
+            dictionary = self._dictionaries[dictionary_id] if dictionary_id is not None else None
+            compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+            compressors[dictionary_id] = compressor
+        return compressor
+
+    def _decompressor(self, dictionary_id: Optional[int]) -> "zstandard.ZstdDecompressor":
+        decompressors = self._thread_cache("decompressors")
+        decompressor = decompressors.get(dictionary_id)
+        if decompressor is None:
+            if dictionary_id is not None and dictionary_id not in self._dictionaries:
+                raise LookupError(f"Compression dictionary {dictionary_id} is not loaded.")
+            dictionary = self._dictionaries[dictionary_id] if dictionary_id is not None else None
+            decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+            decompressors[dictionary_id] = decompressor
+        return decompressor
+
+    def encode(self, content: Optional[str]) -> Tuple[str, Optional[str], Optional[bytes]]:
+        content = content or ""
+        if not self.enabled:
+            return content, None, None
+        raw = content.encode("utf-8")
+        if len(raw) < self.min_bytes:
+            return content, None, None
+        dictionary_id = self._active_dictionary_id
+        blob = self._compressor(dictionary_id).compress(raw)
+        if len(blob) > len(raw) * MAX_COMPRESSED_RATIO:
+            return content, None, None
+        codec = f"{CODEC_ZSTD}:{dictionary_id}" if dictionary_id is not None else CODEC_ZSTD
+        return "", codec, blob
+
+    def decode(self, content: Optional[str], codec: Optional[str], blob: Optional[bytes]) -> str:
+        if not codec:
+            return content or ""
+        name, _, dictionary_id = codec.partition(":")
+        if name != CODEC_ZSTD:
+            raise ValueError(f"Unknown message codec '{codec}'.")
+        if zstandard is None:
+            raise RuntimeError("This message is stored compressed; install 'zstandard' to read it.")
+        return self._decompressor(int(dictionary_id) if dictionary_id else None).decompress(blob).decode("utf-8")
+
+    def encoded_columns(self, content: Optional[str]) -> Dict[str, Optional[object]]:
+        """encode() 的结果以 ChatMessage 列名为键返回，便于直接用于 INSERT / UPDATE。"""
+        stored, codec, blob = self.encode(content)
+        return {"content": stored, "content_codec": codec, "content_blob": blob}
+
+
+message_codec = MessageCodec()
+
+
+def load_compression_dictionaries(sync_conn):
+    """启动时加载所有字典（在 create_db_and_tables 中调用），解压任意历史行都需要对应的字典。"""
+    if zstandard is None:
+        return
+    rows = sync_conn.execute(
+        select(CompressionDictionary.id, CompressionDictionary.data).order_by(CompressionDictionary.id)
+    ).all()
+    rows = [row for row in rows if row.data]  # 跳过训练中的占位行
+    for dictionary_id, data in rows:
+        message_codec.register_dictionary(dictionary_id, data)
+    if rows:
+        logger.info(f"MESSAGE_CODEC: Loaded {len(rows)} compression dictionaries (active: {message_codec.active_dictionary_id}).")
+
+
+async def load_dictionaries(dictionary_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    从数据库加载本进程尚未加载的字典（由其他 worker 训练的），返回加载的数量。
+    dictionary_ids 为 None 时加载所有已训练完成的字典。
+    """
+    if zstandard is None or not db_session.AsyncSessionLocal:
+        return 0
+    stmt = select(CompressionDictionary.id, CompressionDictionary.data).order_by(CompressionDictionary.id)
+    if dictionary_ids is not None:
+        dictionary_ids = set(dictionary_ids)
+        if not dictionary_ids:
+            return 0
+        stmt = stmt.where(CompressionDictionary.id.in_(dictionary_ids))
+    async with db_session.AsyncSessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+    # 跳过训练中的占位行和已加载的字典
+    rows = [row for row in rows if row.data and not message_codec.has_dictionary(row.id)]
+    for dictionary_id, data in rows:
+        message_codec.register_dictionary(dictionary_id, data)
+    if rows:
+        logger.info(f"MESSAGE_CODEC: Loaded compression dictionaries {[row.id for row in rows]} from the database.")
+    return len(rows)
+
+
+async def ensure_dictionaries(codecs: Iterable[Optional[str]]):
+    """解压一批消息前调用：补加载它们引用、但本进程还没有的字典。"""
+    missing = message_codec.missing_dictionaries(codecs)
+    if missing:
+        await load_dictionaries(missing)
+
+
+async def _on_remote_dictionary(data: Dict[str, object]):
+    if data.get("id") is not None:
+        await load_dictionaries([int(data["id"])])
+
+
+connection_manager.on_control("compression_dictionary", _on_remote_dictionary)
+
+
+async def _claim_training() -> Optional[int]:
+    """
+    领取下一代字典的训练名额：插入一行 data 为空的占位行，generation 的唯一索引保证
+    多个 worker 同时领取时只有一个成功。返回占位行 id；名额已被占用或已有可用字典时返回 None。
+    """
+    async def claim(db):
+        await db.execute(
+            delete(CompressionDictionary).where(
+                CompressionDictionary.data == b"",
+                CompressionDictionary.created_at < time.time() - TRAINING_CLAIM_TIMEOUT,
+            )
+        )
+        existing = (await db.execute(
+            select(func.count(CompressionDictionary.id), func.max(CompressionDictionary.generation))
+        )).one()
+        if existing[0]:
+            # 其他 worker 已训练好或正在训练
+            return None
+        row = CompressionDictionary(
+            codec=CODEC_ZSTD, data=b"", sample_count=0, created_at=time.time(), generation=(existing[1] or 0) + 1,
+        )
+        db.add(row)
+        await db.flush()
+        return row.id
+
+    try:
+        return await write_queue.submit(claim)
+    except IntegrityError:
+        return None
+
+
+async def train_dictionary() -> Optional[int]:
+    """
+    用最近的明文长消息训练一个新字典并设为当前字典；样本不足、或训练名额已被其他 worker 领取时返回 None
+    （此时压缩不使用字典，其他 worker 训练完成后会通知本进程加载）。
+    """
+    if zstandard is None:
+        return None
+    claim_id = await _claim_training()
+    if claim_id is None:
+        # 字典可能已由其他 worker 训练完成（例如本进程错过了它的通知）
+        await load_dictionaries()
+        return None
+
+    async def release_claim(db):
+        await db.execute(delete(CompressionDictionary).where(CompressionDictionary.id == claim_id))
+
+    try:
+        async with db_session.AsyncSessionLocal() as db:
+            samples = (await db.execute(
+                select(ChatMessage.content)
+                .where(ChatMessage.content_codec.is_(None), func.length(ChatMessage.content) >= MIN_SAMPLE_CHARS)
+                .order_by(ChatMessage.id.desc())
+                .limit(MAX_TRAINING_SAMPLES)
+            )).scalars().all()
+        if len(samples) < MIN_TRAINING_SAMPLES:
+            logger.info(f"MESSAGE_CODEC: Only {len(samples)} samples available, postponing dictionary training.")
+            await write_queue.submit(release_claim)
+            return None
+
+        encoded_samples = [sample.encode("utf-8") for sample in samples]
+        dictionary = await asyncio.to_thread(zstandard.train_dictionary, DICTIONARY_SIZE, encoded_samples)
+    except Exception as e:
+        logger.warning(f"MESSAGE_CODEC: Dictionary training failed: {e}")
+        await write_queue.submit(release_claim)
+        return None
+    except BaseException:
+        # 被取消时同样归还名额，否则要等 TRAINING_CLAIM_TIMEOUT 之后才能重新训练
+        await write_queue.submit(release_claim)
+        raise
+    data = dictionary.as_bytes()
+
+    async def store(db):
+        await db.execute(
+            update(CompressionDictionary)
+            .where(CompressionDictionary.id == claim_id)
+            .values(data=data, sample_count=len(samples), created_at=time.time())
+        )
+
+    await write_queue.submit(store)
+    message_codec.register_dictionary(claim_id, data)
+    connection_manager.publish_control("compression_dictionary", {"id": claim_id})
+    logger.info(f"MESSAGE_CODEC: Trained dictionary {claim_id} ({len(data)} bytes) from {len(samples)} messages.")
+    return claim_id
+
+
+class MessageRecompressor:
+    """按 id 顺序分批扫描明文长消息并改写为压缩形式。游标只保存在内存中，重启后从头扫描。"""
+
+    def __init__(self):
+        self._cursor = 0
+        self._lock = asyncio.Lock()
+
+    async def run(self, max_rows: int = 20_000) -> int:
+        if not message_codec.enabled or not db_session.AsyncSessionLocal:
+            return 0
+        if self._lock.locked():
+            return 0
+        async with self._lock:
+            if message_codec.active_dictionary_id is None:
+                await train_dictionary()
+
+            # 多字节字符每个至少 1 字节、至多 4 字节，按字符数粗筛，是否压缩由 encode() 决定
+            min_chars = message_codec.min_bytes // 4
+            compressed = scanned = 0
+            while scanned < max_rows:
+                async with db_session.AsyncSessionLocal() as db:
+                    rows = (await db.execute(
+                        select(ChatMessage.id, ChatMessage.content)
+                        .where(
+                            ChatMessage.id > self._cursor,
+                            ChatMessage.content_codec.is_(None),
+                            func.length(ChatMessage.content) >= min_chars,
+                        )
+                        .order_by(ChatMessage.id)
+                        .limit(RECOMPRESS_BATCH_SIZE)
+                    )).all()
+                if not rows:
+                    self._cursor = 0
+                    break
+                scanned += len(rows)
+                self._cursor = rows[-1].id
+
+                updates = await asyncio.to_thread(self._encode_rows, rows)
+                if updates:
+                    compressed += await write_queue.submit(lambda db, updates=updates: self._apply(db, updates))
+
+            if compressed:
+                logger.info(f"MESSAGE_CODEC: Recompressed {compressed} of {scanned} scanned chat messages.")
+            return compressed
+
+    @staticmethod
+    def _encode_rows(rows) -> List[Dict[str, object]]:
+        updates = []
+        for row in rows:
+            stored, codec, blob = message_codec.encode(row.content)
+            if codec is not None:
+                updates.append({"row_id": row.id, "old_content": row.content, "codec": codec, "blob": blob, "stored": stored})
+        return updates
+
+    @staticmethod
+    async def _apply(db, updates: List[Dict[str, object]]) -> int:
+        # 只改写仍未被编辑过的行（正文与读取时一致）
+        table = ChatMessage.__table__
+        result = await db.execute(
+            update(table)
+            .where(
+                table.c.id == bindparam("row_id"),
+                table.c.content_codec.is_(None),
+                table.c.content == bindparam("old_content"),
+            )
+            .values(content=bindparam("stored"), content_codec=bindparam("codec"), content_blob=bindparam("blob")),
+            updates,
+        )
+        return result.rowcount if result.rowcount >= 0 else len(updates)
+
+
+message_recompressor = MessageRecompressor()
@@ -0,0 +1,157 @@
+# novel_bot/src/plugins/ai_chat_system/services/model_discovery.py
+# 职责: 查询一组 API Key 可用的模型列表。相同 Key 集合的并发请求只会触发一次查询（single-flight），
+#       结果带 TTL 持久化到数据库，重启后无需重新查询。
+
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+from sqlalchemy import select
+
+from .. import global_state
+from ..database import session as db_session
+from ..database.models import ModelDiscoveryCache
+from ..database.write_queue import write_queue
+from ..llm_services.client_pool import llm_client_pool
+
+logger = logging.getLogger("nonebot")
+
+MODEL_DISCOVERY_TTL_SECONDS = 24 * 3600
+LIST_MODELS_TIMEOUT_SECONDS = 20.0
+
+
+def key_set_fingerprint(api_keys: List[str]) -> str:
+    """Key 集合的指纹，与顺序无关，且不会泄露 Key 本身。"""
+    return hashlib.sha256("\n".join(sorted(api_keys)).encode("utf-8")).hexdigest()
+
+
+def _format_model(model: Any) -> Dict[str, Any]:
+    return {
+        "name": model.name,
+        "display_name": model.display_name,
+        "description": model.description,
+        "input_token_limit": model.input_token_limit,
+        "output_token_limit": model.output_token_limit,
+        "supported_generation_methods": model.supported_generation_methods,
+    }
+
+
+async def _query_models(api_keys: List[str]) -> List[Dict[str, Any]]:
+    """依次使用每个 Key 查询，直到某个 Key 返回了可用于生成的模型。"""
+    for key_index, api_key in enumerate(api_keys):
+        model_client = llm_client_pool.get_gemini_client(api_key).model_client
+        try:
+            models = await asyncio.wait_for(
+                asyncio.to_thread(lambda: list(genai.list_models(client=model_client))),
+                timeout=LIST_MODELS_TIMEOUT_SECONDS
+            )
+            # [核心修改] 提取并格式化模型详细信息
+            formatted_models = sorted(
+                [_format_model(m) for m in models if "generateContent" in m.supported_generation_methods],
+                key=lambda x: x['display_name']
+            )
+            if formatted_models:
+                logger.info(f"ModelDiscovery: Verified {len(formatted_models)} models using Key index {key_index}.")
+                return formatted_models
+        except Exception as e:
+            logger.error(f"ModelDiscovery: Exception querying models with Key index {key_index}: {e}")
+
+    logger.error("ModelDiscovery: All provided API Keys failed to find any models.")
+    return []
+
+
+class ModelDiscovery:
+    """内存缓存 + 数据库持久化 + 按指纹合并的并发查询。"""
+
+    def __init__(self, ttl_seconds: int = MODEL_DISCOVERY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._results: Dict[str, Tuple[List[Dict[str, Any]], float]] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def discover(self, api_keys: List[str], force_refresh: bool = False) -> List[Dict[str, Any]]:
+        if not api_keys:
+            return []
+        fingerprint = key_set_fingerprint(api_keys)
+
+        if not force_refresh:
+            cached = await self.get_cached(fingerprint)
+            if cached is not None:
+                return cached
+
+        task = self._in_flight.get(fingerprint)
+        if task is None:
+            task = asyncio.create_task(self._discover_and_store(fingerprint, list(api_keys)))
+            self._in_flight[fingerprint] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(fingerprint, None))
+        else:
+            logger.debug("ModelDiscovery: Joining in-flight discovery for the same key set.")
+        # shield: 某个调用方被取消时，不影响其他正在等待同一结果的调用方
+        return await asyncio.shield(task)
+
+    async def get_cached(self, fingerprint: str) -> Optional[List[Dict[str, Any]]]:
+        """只查缓存（内存，然后数据库），不会发起网络请求。"""
+        now = time.time()
+        entry = self._results.get(fingerprint)
+        if entry is not None:
+            if entry[1] > now:
+                return entry[0]
+            del self._results[fingerprint]
+
+        if not db_session.AsyncSessionLocal:
+            return None
+        try:
+            async with db_session.AsyncSessionLocal() as db:
+                row = await db.get(ModelDiscoveryCache, fingerprint)
+            if row is not None and row.expires_at > now and row.models:
+                self._results[fingerprint] = (row.models, row.expires_at)
+                return row.models
+        except Exception as e:
+            logger.warning(f"ModelDiscovery: Failed to read persisted results: {e}")
+        return None
+
+    async def _discover_and_store(self, fingerprint: str, api_keys: List[str]) -> List[Dict[str, Any]]:
+        models = await _query_models(api_keys)
+        if not models:
+            # 查询失败的结果不缓存，下次请求会重新查询
+            return models
+
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self._results[fingerprint] = (models, expires_at)
+        if db_session.AsyncSessionLocal:
+            try:
+                await write_queue.submit(lambda db: db.merge(ModelDiscoveryCache(
+                    key_fingerprint=fingerprint, models=models, discovered_at=now, expires_at=expires_at
+                )))
+            except Exception as e:
+                logger.warning(f"ModelDiscovery: Failed to persist results: {e}")
+        return models
+
+    async def restore_user_models(self, user_id: str, api_keys: List[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        用持久化的结果填充 global_state.api_key_model_cache（例如在重启后的 bootstrap 时），
+        不发起网络请求；没有有效结果时返回 None。
+        """
+        if user_id in global_state.api_key_model_cache:
+            return global_state.api_key_model_cache[user_id]
+        if not api_keys:
+            return None
+        models = await self.get_cached(key_set_fingerprint(api_keys))
+        if models:
+            global_state.api_key_model_cache[user_id] = models
+        return models
+
+
+def extract_key_strings(api_keys: List[Any]) -> List[str]:
+    """用户配置中的 api_keys 可能是字符串列表，也可能是 {"key": ...} 字典列表。"""
+    return [
+        (item.get('key', '') if isinstance(item, dict) else item).strip()
+        for item in api_keys or []
+        if (item.get('key') if isinstance(item, dict) else item)
+    ]
+
+
+model_discovery = ModelDiscovery()
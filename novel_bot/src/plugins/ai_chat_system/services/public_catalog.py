@@ -0,0 +1,107 @@
+# novel_bot/src/plugins/ai_chat_system/services/public_catalog.py
+# 职责: 维护公共内容目录的进程内快照。快照只在公共条目变化（content_versions 中的集合版本号变化）时重建，
+#       重建时一次性完成序列化与压缩（gzip，安装了 brotli 时还有 br），并以内容哈希作为版本号。
+
+import asyncio
+import gzip
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..database import session as db_session
+from ..database.models import ContentItem
+from ..utils.stream_coalescer import dumps_bytes
+from .content_versions import get_collection_version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("nonebot")
+
+# 数据类型 -> bootstrap 响应中的字段名
+PUBLIC_CATALOG_FIELDS = {
+    "character": "public_characters",
+    "preset": "public_presets",
+    "world_info": "public_world_info",
+    "group": "public_groups",
+}
+
+
+class CatalogSnapshot:
+    __slots__ = ("version", "payload", "identity", "gzip", "br")
+
+    def __init__(self, payload: Dict[str, Dict[str, Any]], identity: bytes, gzip_body: bytes, br_body: Optional[bytes]):
+        self.version = hashlib.sha256(identity).hexdigest()[:16]
+        self.payload = payload
+        self.identity = identity
+        self.gzip = gzip_body
+        self.br = br_body
+
+    def encoded(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """按 Accept-Encoding 选择预压缩的正文，返回 (正文, Content-Encoding)。"""
+        accepted = {token.split(";")[0].strip().lower() for token in (accept_encoding or "").split(",")}
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+def _build_snapshot(payload: Dict[str, Dict[str, Any]]) -> CatalogSnapshot:
+    identity = dumps_bytes(payload)
+    gzip_body = gzip.compress(identity, compresslevel=6)
+    br_body = brotli.compress(identity, quality=9) if brotli is not None else None
+    return CatalogSnapshot(payload, identity, gzip_body, br_body)
+
+
+class PublicCatalog:
+    def __init__(self):
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._built_for: Optional[Tuple[int, ...]] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _current_versions() -> Tuple[int, ...]:
+        return tuple(get_collection_version(None, data_type) for data_type in PUBLIC_CATALOG_FIELDS)
+
+    async def get_snapshot(self) -> CatalogSnapshot:
+        versions = self._current_versions()
+        if self._snapshot is not None and self._built_for == versions:
+            return self._snapshot
+
+        async with self._lock:
+            # 等锁期间可能已由其他请求重建
+            versions = self._current_versions()
+            if self._snapshot is not None and self._built_for == versions:
+                return self._snapshot
+
+            async with db_session.AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(ContentItem.data_type, ContentItem.filename, ContentItem.data)
+                    .where(ContentItem.owner_id.is_(None), ContentItem.data_type.in_(list(PUBLIC_CATALOG_FIELDS)))
+                    .order_by(ContentItem.data_type, ContentItem.filename)
+                )
+                payload: Dict[str, Dict[str, Any]] = {field: {} for field in PUBLIC_CATALOG_FIELDS.values()}
+                for data_type, filename, data in result:
+                    payload[PUBLIC_CATALOG_FIELDS[data_type]][filename] = data
+
+            # 压缩是 CPU 密集型操作，放到线程中执行
+            snapshot = await asyncio.to_thread(_build_snapshot, payload)
+            if self._snapshot is None or snapshot.version != self._snapshot.version:
+                logger.info(
+                    f"PUBLIC_CATALOG: Rebuilt snapshot {snapshot.version} "
+                    f"({len(snapshot.identity)} bytes, gzip {len(snapshot.gzip)} bytes)."
+                )
+                self._snapshot = snapshot
+            self._built_for = versions
+            return self._snapshot
+
+    def invalidate(self):
+        self._built_for = None
+
+
+public_catalog = PublicCatalog()
@@ -0,0 +1,144 @@
+# novel_bot/src/plugins/ai_chat_system/services/response_cache.py
+# 职责: 为确定性较强的生成任务（标题、记忆提取、结构化 JSON 生成）缓存模型输出。
+#       内存 LRU 在前，数据库表 llm_response_cache 在后，重启后依然有效。
+
+import dataclasses
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+
+from ..database import session as db_session
+from ..database.models import LLMResponseCache
+from ..database.write_queue import write_queue
+
+logger = logging.getLogger("nonebot")
+
+MEMORY_CACHE_SIZE = 512
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+# 各任务的缓存有效期（秒），未列出的任务使用 DEFAULT_TTL_SECONDS
+TASK_TTL_SECONDS: Dict[str, int] = {
+    "title": 30 * 24 * 3600,
+    "memory": 7 * 24 * 3600,
+}
+
+
+def _normalize_contents(contents: List[Any]) -> List[Any]:
+    """把字符串 part 与 {"text": ...} part 统一成同一形式，避免等价输入产生不同的键。"""
+    normalized = []
+    for message in contents:
+        if isinstance(message, dict):
+            parts = [
+                {"text": part} if isinstance(part, str) else part
+                for part in message.get("parts", [])
+            ]
+            normalized.append({"role": message.get("role"), "parts": parts})
+        else:
+            normalized.append(message)
+    return normalized
+
+
+def _normalize_generation_config(generation_config: Any) -> Any:
+    if generation_config is None:
+        return None
+    if dataclasses.is_dataclass(generation_config):
+        return {k: v for k, v in dataclasses.asdict(generation_config).items() if v is not None}
+    if isinstance(generation_config, dict):
+        return generation_config
+    return repr(generation_config)
+
+
+def make_cache_key(
+    task: str,
+    model_pool: List[str],
+    contents: List[Any],
+    system_instruction: Optional[str] = None,
+    generation_config: Any = None,
+) -> str:
+    payload = {
+        "task": task,
+        "models": list(model_pool),
+        "system": system_instruction,
+        "contents": _normalize_contents(contents),
+        "config": _normalize_generation_config(generation_config),
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """两级缓存。数据库不可用时只使用内存层，任何缓存错误都不会影响正常生成。"""
+
+    def __init__(self, max_entries: int = MEMORY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0}
+
+    async def get(self, cache_key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(cache_key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+            del self._entries[cache_key]
+
+        if db_session.AsyncSessionLocal:
+            try:
+                async with db_session.AsyncSessionLocal() as db:
+                    row = (await db.execute(
+                        select(LLMResponseCache.response_text, LLMResponseCache.expires_at)
+                        .where(LLMResponseCache.cache_key == cache_key, LLMResponseCache.expires_at > now)
+                    )).first()
+                if row is not None:
+                    self._remember(cache_key, row.response_text, row.expires_at)
+                    self.stats["db_hits"] += 1
+                    return row.response_text
+            except Exception as e:
+                logger.warning(f"RESPONSE_CACHE: Failed to read cache entry: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, cache_key: str, task: str, model_name: Optional[str], response_text: str, ttl_seconds: Optional[int] = None):
+        now = time.time()
+        expires_at = now + (ttl_seconds if ttl_seconds is not None else TASK_TTL_SECONDS.get(task, DEFAULT_TTL_SECONDS))
+        self._remember(cache_key, response_text, expires_at)
+        self.stats["stores"] += 1
+
+        if not db_session.AsyncSessionLocal:
+            return
+        try:
+            async def write(db):
+                await db.merge(LLMResponseCache(
+                    cache_key=cache_key, task=task, model_name=model_name,
+                    response_text=response_text, created_at=now, expires_at=expires_at
+                ))
+            await write_queue.submit(write)
+        except Exception as e:
+            logger.warning(f"RESPONSE_CACHE: Failed to persist cache entry: {e}")
+
+    def _remember(self, cache_key: str, response_text: str, expires_at: float):
+        self._entries[cache_key] = (response_text, expires_at)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def purge_expired(self) -> int:
+        """删除数据库中已过期的条目，由定时任务调用。"""
+        if not db_session.AsyncSessionLocal:
+            return 0
+        result = await write_queue.submit(
+            lambda db: db.execute(delete(LLMResponseCache).where(LLMResponseCache.expires_at <= time.time()))
+        )
+        if result.rowcount:
+            logger.info(f"RESPONSE_CACHE: Purged {result.rowcount} expired entries.")
+        return result.rowcount or 0
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,204 @@
+# novel_bot/src/plugins/ai_chat_system/services/search_index.py
+# 职责: 内容条目（角色、预设、世界书、群组）的全文索引。SQLite 使用 FTS5，PostgreSQL 使用 tsvector + GIN。
+#       中日韩文本在写入前被切分为单字与二元组（bigram），拉丁文本按单词小写化，
+#       因此两种数据库都只需最简单的分词器即可支持中文检索。索引由持久化层在保存/删除条目时同步。
+
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import Float, Integer, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger("nonebot")
+
+# 假名、CJK 统一表意文字（含扩展 A 与兼容区）、谚文音节
+_CJK_RANGES = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(rf"([{_CJK_RANGES}]+)|([0-9A-Za-z\u00c0-\u024f]+)")
+
+# 正文过长（例如很大的世界书）时只索引前面的部分
+MAX_BODY_CHARS = 200_000
+# 标题命中的权重高于正文
+TITLE_WEIGHT = 10.0
+
+_TITLE_KEYS = ("name", "displayName")
+_BODY_KEYS = {
+    "character": ("description", "personality", "scenario", "first_mes", "mes_example"),
+    "group": ("description", "first_mes"),
+    "preset": ("description",),
+    "world_info": ("description",),
+}
+
+# 启动时由 ensure_search_index 设置；FTS5 不可用等情况下为 False，列表搜索退回 LIKE
+search_available = False
+
+
+def tokenize(value: str, for_query: bool = False) -> List[str]:
+    """
+    建索引时：中日韩连续片段产出单字与二元组；查询时：长度大于 1 的片段只产出二元组
+    （全部命中即等价于短语匹配），单字查询产出单字。拉丁单词统一小写。
+    """
+    tokens: List[str] = []
+    for cjk, word in _TOKEN_PATTERN.findall(value or ""):
+        if word:
+            tokens.append(word.lower())
+            continue
+        bigrams = [cjk[i:i + 2] for i in range(len(cjk) - 1)]
+        if for_query:
+            tokens.extend(bigrams or [cjk])
+        else:
+            tokens.extend(cjk)
+            tokens.extend(bigrams)
+    return tokens
+
+
+def _strings(values: Iterable[Any]) -> List[str]:
+    return [v for v in values if isinstance(v, str) and v]
+
+
+def extract_document(data_type: str, data: Dict[str, Any]) -> Tuple[str, str]:
+    """从条目数据中提取 (标题, 正文) 的原始文本。"""
+    if not isinstance(data, dict):
+        return "", ""
+    title = " ".join(_strings(data.get(key) for key in _TITLE_KEYS))
+    body_parts = _strings(data.get(key) for key in _BODY_KEYS.get(data_type, ()))
+
+    if data_type == "world_info":
+        for entry in data.get("entries") or []:
+            if isinstance(entry, dict):
+                body_parts.extend(_strings([entry.get("name"), entry.get("content")]))
+                body_parts.extend(_strings(entry.get("keywords") or []))
+    elif data_type == "preset":
+        for module in data.get("prompts") or []:
+            if isinstance(module, dict):
+                body_parts.extend(_strings([module.get("name"), module.get("content")]))
+
+    return title, "\n".join(body_parts)[:MAX_BODY_CHARS]
+
+
+def _indexed_text(value: str) -> str:
+    return " ".join(tokenize(value))
+
+
+# ---------------------------------------------------------------------------
+# 建表与回填（同步连接，在 create_db_and_tables 中调用）
+# ---------------------------------------------------------------------------
+
+def ensure_search_index(sync_conn):
+    """创建索引表（不存在时），并为尚未建立索引的条目补建索引。"""
+    global search_available
+    dialect = sync_conn.dialect.name
+    try:
+        with sync_conn.begin_nested():
+            if dialect == "sqlite":
+                sync_conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS content_search USING fts5(title, body, tokenize='unicode61')"
+                ))
+                missing_sql = "SELECT id, data_type, data FROM content_items WHERE id NOT IN (SELECT rowid FROM content_search)"
+            elif dialect == "postgresql":
+                sync_conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS content_search ("
+                    " item_id INTEGER PRIMARY KEY REFERENCES content_items(id) ON DELETE CASCADE,"
+                    " title TEXT, body TEXT,"
+                    " tsv tsvector GENERATED ALWAYS AS ("
+                    "  setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||"
+                    "  setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED)"
+                ))
+                sync_conn.execute(text("CREATE INDEX IF NOT EXISTS ix_content_search_tsv ON content_search USING GIN (tsv)"))
+                missing_sql = "SELECT id, data_type, data FROM content_items WHERE id NOT IN (SELECT item_id FROM content_search)"
+            else:
+                logger.warning(f"SEARCH_INDEX: Full-text search is not supported on '{dialect}'.")
+                search_available = False
+                return
+    except Exception as e:
+        logger.warning(f"SEARCH_INDEX: Could not create full-text index, falling back to LIKE search: {e}")
+        search_available = False
+        return
+
+    search_available = True
+    rows = sync_conn.execute(text(missing_sql)).all()
+    if not rows:
+        return
+
+    documents = []
+    for item_id, data_type, data in rows:
+        if isinstance(data, str):
+            data = json.loads(data)
+        title, body = extract_document(data_type, data)
+        documents.append({"id": item_id, "title": _indexed_text(title), "body": _indexed_text(body)})
+    sync_conn.execute(text(_insert_sql(dialect)), documents)
+    logger.info(f"SEARCH_INDEX: Indexed {len(documents)} content items.")
+
+
+def _insert_sql(dialect: str) -> str:
+    if dialect == "sqlite":
+        return "INSERT INTO content_search (rowid, title, body) VALUES (:id, :title, :body)"
+    return "INSERT INTO content_search (item_id, title, body) VALUES (:id, :title, :body)"
+
+
+def _delete_sql(dialect: str) -> str:
+    if dialect == "sqlite":
+        return "DELETE FROM content_search WHERE rowid = :id"
+    return "DELETE FROM content_search WHERE item_id = :id"
+
+
+# ---------------------------------------------------------------------------
+# 增量维护（在持久化层的事务中调用，不提交）
+# ---------------------------------------------------------------------------
+
+def _dialect(db: AsyncSession) -> str:
+    return db.get_bind().dialect.name
+
+
+async def index_content_item(db: AsyncSession, item_id: int, data_type: str, data: Dict[str, Any]):
+    if not search_available:
+        return
+    dialect = _dialect(db)
+    title, body = extract_document(data_type, data)
+    await db.execute(text(_delete_sql(dialect)), {"id": item_id})
+    await db.execute(text(_insert_sql(dialect)), {"id": item_id, "title": _indexed_text(title), "body": _indexed_text(body)})
+
+
+async def remove_content_item(db: AsyncSession, item_ids: List[int]):
+    if not search_available or not item_ids:
+        return
+    await db.execute(text(_delete_sql(_dialect(db))), [{"id": item_id} for item_id in item_ids])
+
+
+# ---------------------------------------------------------------------------
+# 查询
+# ---------------------------------------------------------------------------
+
+def build_search_subquery(dialect: str, query: str):
+    """
+    返回包含 (item_id, score) 两列的子查询，score 越小越相关；
+    索引不可用或查询中没有可检索的词时返回 None，调用方应退回 LIKE 搜索。
+    """
+    if not search_available:
+        return None
+    tokens = tokenize(query, for_query=True)
+    if not tokens:
+        return None
+    # 最后一个拉丁单词按前缀匹配，支持边输入边搜索
+    prefix_last = bool(re.fullmatch(r"[0-9a-z\u00c0-\u024f]+", tokens[-1]))
+
+    if dialect == "sqlite":
+        terms = [f'"{token}"' for token in tokens]
+        if prefix_last:
+            terms[-1] += "*"
+        statement = text(
+            f"SELECT rowid AS item_id, bm25(content_search, {TITLE_WEIGHT}, 1.0) AS score "
+            "FROM content_search WHERE content_search MATCH :match"
+        ).bindparams(match=" ".join(terms))
+    elif dialect == "postgresql":
+        terms = list(tokens)
+        if prefix_last:
+            terms[-1] += ":*"
+        statement = text(
+            "SELECT item_id, -ts_rank(tsv, to_tsquery('simple', :match)) AS score "
+            "FROM content_search WHERE tsv @@ to_tsquery('simple', :match)"
+        ).bindparams(match=" & ".join(terms))
+    else:
+        return None
+    return statement.columns(item_id=Integer, score=Float).subquery("search")
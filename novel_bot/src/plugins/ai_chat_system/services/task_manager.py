@@ -1,90 +1,203 @@
 # novel_bot/src/plugins/ai_chat_system/services/task_manager.py
+# 职责: 后台任务的状态管理。进行中任务的实时状态保存在进程内的 TaskRegistry 中：
+#       进度更新只修改内存并推送给任务所属用户的 WebSocket，由合并定时器批量写回 tasks 表；
+#       任务创建与终态（success / failed）同步落库。
 
+import asyncio
 import uuid
 import time
 import json
-from typing import Dict, Any, Literal, List, Optional
+from typing import Dict, Any, Literal, List, Optional, Set
 from pathlib import Path
 from nonebot import logger
 from fastapi import HTTPException, Depends
-from sqlalchemy import select, update
+from sqlalchemy import bindparam, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..database.session import DBSession
 from ..database.models import Task
+from ..database.write_queue import write_queue
+from .connection_manager import manager as connection_manager
 
 TaskStatus = Literal["pending", "processing", "success", "failed"]
 
-class TaskManager:
-    def __init__(self, db: AsyncSession):
-        self.db = db
+# 进度写回数据库的合并间隔（秒）：间隔内的多次进度更新只写最后一次
+PROGRESS_FLUSH_INTERVAL = 2.0
+# 任务结束后在内存中保留的时长（秒），供刚结束时的查询直接命中
+FINISHED_TASK_RETENTION = 300
 
-    async def create_task(self, task_type: str, user_id: str) -> str:
+
+def _task_to_dict(task: Task) -> Dict[str, Any]:
+    return {
+        "id": task.id, "user_id": task.user_id, "task_type": task.task_type,
+        "status": task.status, "progress": task.progress, "status_text": task.status_text,
+        "created_at": task.created_at, "updated_at": task.updated_at,
+        "start_time": task.start_time, "end_time": task.end_time,
+        "result": task.result, "error": task.error
+    }
+
+
+class TaskRegistry:
+    def __init__(self):
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        task = self._tasks.get(task_id)
+        return dict(task) if task is not None else None
+
+    def live_tasks_for_user(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return {task_id: dict(task) for task_id, task in self._tasks.items() if task["user_id"] == user_id}
+
+    def adopt(self, task: Dict[str, Any]):
+        """把数据库中已有的任务（例如重启后恢复的作业）纳入注册表，之后的进度走内存。"""
+        self._tasks.setdefault(task["id"], dict(task))
+
+    async def create(self, task_type: str, user_id: str, status: TaskStatus = "processing",
+                     status_text: Optional[str] = None, **columns) -> str:
         task_id = str(uuid.uuid4())
         current_time = time.time()
-        new_task = Task(
+        task = Task(
             id=task_id,
             user_id=user_id,
             task_type=task_type,
-            status="processing",
+            status=status,
+            progress=0,
+            status_text=status_text,
             created_at=current_time,
             updated_at=current_time,
-            start_time=current_time
+            start_time=current_time if status == "processing" else None,
+            **columns
         )
-        self.db.add(new_task)
-        await self.db.commit()
+        state = _task_to_dict(task)
+        await write_queue.submit(lambda db: self._add(db, task))
+        self._tasks[task_id] = state
         logger.info(f"Task created: ID={task_id}, Type={task_type}, User={user_id}")
+        await self._push(state)
         return task_id
 
+    @staticmethod
+    async def _add(db: AsyncSession, task: Task):
+        db.add(task)
+
+    async def update_progress(self, task_id: str, progress: int, status_text: str):
+        task = self._tasks.get(task_id)
+        if task is None:
+            # 不在注册表中（例如进程重启前创建的任务）：直接写库
+            await write_queue.submit(lambda db: db.execute(
+                update(Task).where(Task.id == task_id).values(progress=progress, status_text=status_text, updated_at=time.time())
+            ))
+            return
+        if task["status"] in ("success", "failed"):
+            return
+        task.update(progress=progress, status_text=status_text, updated_at=time.time())
+        self._dirty.add(task_id)
+        self._schedule_flush()
+        logger.debug(f"Task progress: ID={task_id}, Progress={progress}%, Status Text='{status_text}'")
+        await self._push(task)
+
+    async def finish(self, task_id: str, status: TaskStatus, data: Any = None, **columns):
+        """同步写入状态变化（终态，或作业开始/重新排队等非进度变化）；columns 为需要一并写入的其他列。"""
+        current_time = time.time()
+        values = {"status": status, "updated_at": current_time, **columns}
+        if status in ("success", "failed"):
+            values["end_time"] = current_time
+            values["result" if status == "success" else "error"] = data
+
+        task = self._tasks.get(task_id)
+        if task is not None:
+            # 终态与最后一次进度一起同步写入，之后不再需要合并写回
+            values.setdefault("progress", task["progress"])
+            values.setdefault("status_text", task["status_text"])
+            self._dirty.discard(task_id)
+        await write_queue.submit(lambda db: db.execute(update(Task).where(Task.id == task_id).values(**values)))
+        logger.info(f"Task updated: ID={task_id}, Status={status}")
+
+        if task is not None:
+            task.update({key: value for key, value in values.items() if key in task})
+            await self._push(task)
+            if status in ("success", "failed"):
+                asyncio.get_running_loop().call_later(FINISHED_TASK_RETENTION, self._tasks.pop, task_id, None)
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(PROGRESS_FLUSH_INTERVAL, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """把累积的进度批量写回 tasks 表（一次 executemany）。"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = [
+            {"task_id": task_id, "progress": task["progress"], "status_text": task["status_text"], "updated_at": task["updated_at"]}
+            for task_id in dirty
+            if (task := self._tasks.get(task_id)) is not None and task["status"] not in ("success", "failed")
+        ]
+        if not rows:
+            return
+        table = Task.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("task_id"), table.c.status.notin_(["success", "failed"]))
+            .values(progress=bindparam("progress"), status_text=bindparam("status_text"), updated_at=bindparam("updated_at"))
+        )
+        try:
+            await write_queue.submit(lambda db: db.execute(stmt, rows))
+        except Exception as e:
+            logger.warning(f"TASK_REGISTRY: Failed to flush progress of {len(rows)} tasks: {e}")
+            self._dirty.update(row["task_id"] for row in rows)
+            self._schedule_flush()
+
+    @staticmethod
+    async def _push(task: Dict[str, Any]):
+        connection_manager.push_to_user(task["user_id"], {"type": "task_update", "payload": dict(task)})
+
+
+task_registry = TaskRegistry()
+
+
+class TaskManager:
+    """按请求创建的门面：读取优先使用内存中的实时状态，写入委托给 task_registry。"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create_task(self, task_type: str, user_id: str) -> str:
+        return await task_registry.create(task_type, user_id)
+
     async def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        live_task = task_registry.get(task_id)
+        if live_task is not None:
+            return live_task
+
         query = select(Task).where(Task.id == task_id)
         result = await self.db.execute(query)
         task = result.scalar_one_or_none()
-        
+
         if not task: return None
-        return self._task_to_dict(task)
+        return _task_to_dict(task)
 
     async def get_tasks_by_user(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
         query = select(Task).where(Task.user_id == user_id).order_by(Task.created_at.desc()).limit(limit).offset(offset)
         result = await self.db.execute(query)
         tasks = result.scalars().all()
-        return [self._task_to_dict(task) for task in tasks]
+        live_tasks = task_registry.live_tasks_for_user(user_id)
+        return [live_tasks.get(task.id) or _task_to_dict(task) for task in tasks]
 
     async def update_task(self, task_id: str, status: TaskStatus, data: Any = None):
-        current_time = time.time()
-        values_to_update = {"status": status, "updated_at": current_time}
-        
-        if status in ["success", "failed"]:
-            values_to_update["end_time"] = current_time
-            if status == "success":
-                values_to_update["result"] = data
-            else:
-                values_to_update["error"] = data
-        
-        stmt = update(Task).where(Task.id == task_id).values(**values_to_update)
-        await self.db.execute(stmt)
-        await self.db.commit()
-        logger.info(f"Task updated: ID={task_id}, Status={status}")
-        
+        await task_registry.finish(task_id, status, data)
+
     async def update_task_progress(self, task_id: str, progress: int, status_text: str):
-        current_time = time.time()
-        stmt = update(Task).where(Task.id == task_id).values(
-            progress=progress, 
-            status_text=status_text, 
-            updated_at=current_time
-        )
-        await self.db.execute(stmt)
-        await self.db.commit()
-        logger.debug(f"Task progress: ID={task_id}, Progress={progress}%, Status Text='{status_text}'")
+        await task_registry.update_progress(task_id, progress, status_text)
 
     def _task_to_dict(self, task: Task) -> Dict[str, Any]:
-        return {
-            "id": task.id, "user_id": task.user_id, "task_type": task.task_type,
-            "status": task.status, "progress": task.progress, "status_text": task.status_text,
-            "created_at": task.created_at, "updated_at": task.updated_at,
-            "start_time": task.start_time, "end_time": task.end_time,
-            "result": task.result, "error": task.error
-        }
+        return _task_to_dict(task)
 
 def get_task_manager(db: AsyncSession = DBSession) -> TaskManager:
-    return TaskManager(db)
\ No newline at end of file
+    return TaskManager(db)
@@ -0,0 +1,160 @@
+# novel_bot/src/plugins/ai_chat_system/services/token_usage.py
+# 职责: 记录每次生成的 Token 用量。用量先在内存中按 (用户, 模型, Key 指纹, 小时) 累加，
+#       由定时任务（以及读取统计前）批量 upsert 到 token_usage_rollups；统计接口只读取预聚合的小时桶。
+
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import session as db_session
+from ..database.models import TokenUsageRollup
+from ..database.write_queue import write_queue
+
+logger = logging.getLogger("nonebot")
+
+BUCKET_SECONDS = 3600
+# 统计窗口（按小时桶对齐，均包含当前小时）
+STATS_WINDOWS = {"hourly": 1, "daily": 24, "monthly": 24 * 30}
+# 单条 INSERT 的行数上限，避免超过 SQLite 的绑定参数数量限制
+_UPSERT_CHUNK_SIZE = 500
+
+_COUNTER_COLUMNS = ("requests", "prompt_tokens", "candidates_tokens", "total_tokens")
+
+BucketKey = Tuple[str, str, str, int]
+
+
+def key_fingerprint(api_key: str) -> str:
+    """API Key 的短指纹，用于区分 Key 而不保存 Key 本身。"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+def bucket_start(timestamp: float) -> int:
+    return int(timestamp // BUCKET_SECONDS) * BUCKET_SECONDS
+
+
+def _usage_counts(usage: Any) -> Tuple[int, int, int]:
+    """兼容 Gemini 的 usage_metadata 对象与 {"prompt_token_count": ...} 字典。"""
+    if usage is None:
+        return 0, 0, 0
+    getter = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+    prompt = int(getter("prompt_token_count") or 0)
+    candidates = int(getter("candidates_token_count") or 0)
+    total = int(getter("total_token_count") or 0) or prompt + candidates
+    return prompt, candidates, total
+
+
+class TokenUsageRecorder:
+    """record() 只修改内存中的计数，不访问数据库；flush() 把累计的增量合并写入。"""
+
+    def __init__(self):
+        self._pending: Dict[BucketKey, List[int]] = {}
+
+    def record(self, user_id: str, model: str, api_key: str, usage: Any, timestamp: Optional[float] = None):
+        prompt, candidates, total = _usage_counts(usage)
+        if not user_id or total <= 0:
+            return
+        key = (user_id, model or "unknown", key_fingerprint(api_key), bucket_start(timestamp or time.time()))
+        counters = self._pending.setdefault(key, [0, 0, 0, 0])
+        counters[0] += 1
+        counters[1] += prompt
+        counters[2] += candidates
+        counters[3] += total
+
+    def pending_buckets(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """把内存中的增量 upsert 到数据库，返回写入的桶数。写入失败时增量会放回缓冲区。"""
+        if not self._pending or not db_session.AsyncSessionLocal:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [
+            {
+                "user_id": user_id, "model": model, "key_id": key_id, "bucket_start": start,
+                **dict(zip(_COUNTER_COLUMNS, counters)),
+            }
+            for (user_id, model, key_id, start), counters in pending.items()
+        ]
+
+        async def upsert(db: AsyncSession):
+            insert = db_session.dialect_insert(db.get_bind().dialect.name)
+            for offset in range(0, len(rows), _UPSERT_CHUNK_SIZE):
+                stmt = insert(TokenUsageRollup).values(rows[offset:offset + _UPSERT_CHUNK_SIZE])
+                await db.execute(stmt.on_conflict_do_update(
+                    index_elements=["user_id", "bucket_start", "model", "key_id"],
+                    set_={
+                        column: getattr(TokenUsageRollup, column) + getattr(stmt.excluded, column)
+                        for column in _COUNTER_COLUMNS
+                    },
+                ))
+
+        try:
+            await write_queue.submit(upsert)
+        except Exception as e:
+            logger.warning(f"TOKEN_USAGE: Failed to flush {len(rows)} usage buckets, will retry: {e}")
+            for key, counters in pending.items():
+                merged = self._pending.setdefault(key, [0, 0, 0, 0])
+                for i, value in enumerate(counters):
+                    merged[i] += value
+            return 0
+        return len(rows)
+
+
+token_usage_recorder = TokenUsageRecorder()
+
+
+async def get_usage_stats(db: AsyncSession, user_id: str, key_names: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    返回各统计窗口的 Token 总数，以及按模型、按 Key 的拆分。
+    key_names 为 {Key 指纹: 显示名}，用于把指纹还原为用户可读的 Key 名称。
+    """
+    current_bucket = bucket_start(time.time())
+    window_starts = {
+        window: current_bucket - (hours - 1) * BUCKET_SECONDS for window, hours in STATS_WINDOWS.items()
+    }
+    oldest_start = min(window_starts.values())
+
+    window_sums = [
+        func.sum(case((TokenUsageRollup.bucket_start >= start, TokenUsageRollup.total_tokens), else_=0)).label(window)
+        for window, start in window_starts.items()
+    ]
+    result = await db.execute(
+        select(
+            TokenUsageRollup.model,
+            TokenUsageRollup.key_id,
+            func.sum(TokenUsageRollup.requests).label("requests"),
+            func.sum(TokenUsageRollup.prompt_tokens).label("prompt_tokens"),
+            func.sum(TokenUsageRollup.candidates_tokens).label("candidates_tokens"),
+            *window_sums,
+        )
+        .where(TokenUsageRollup.user_id == user_id, TokenUsageRollup.bucket_start >= oldest_start)
+        .group_by(TokenUsageRollup.model, TokenUsageRollup.key_id)
+    )
+
+    totals = {window: 0 for window in STATS_WINDOWS}
+    by_model: Dict[str, Dict[str, int]] = {}
+    by_key: Dict[str, Dict[str, Any]] = {}
+    for row in result:
+        for breakdown, name in ((by_model, row.model), (by_key, row.key_id)):
+            entry = breakdown.setdefault(name, {"requests": 0, "prompt_tokens": 0, "candidates_tokens": 0, **dict.fromkeys(STATS_WINDOWS, 0)})
+            entry["requests"] += int(row.requests or 0)
+            entry["prompt_tokens"] += int(row.prompt_tokens or 0)
+            entry["candidates_tokens"] += int(row.candidates_tokens or 0)
+            for window in STATS_WINDOWS:
+                entry[window] += int(getattr(row, window) or 0)
+        for window in STATS_WINDOWS:
+            totals[window] += int(getattr(row, window) or 0)
+
+    key_names = key_names or {}
+    return {
+        **totals,
+        "by_model": [{"model": model, **entry} for model, entry in sorted(by_model.items())],
+        "by_key": [
+            {"key_id": key_id, "key_name": key_names.get(key_id), **entry}
+            for key_id, entry in sorted(by_key.items())
+        ],
+    }
@@ -9,7 +9,7 @@ import base64
 import subprocess
 import sys
 
-from ..services.task_manager import TaskManager
+from ..services.job_executor import JobContext
 
 CHANNELS = 1
 SAMPWIDTH = 2
@@ -62,8 +62,7 @@ async def synthesize_and_merge_audio(
     rate: int = 50, 
     volume: int = 50, 
     pitch: int = 50,
-    task_id: Optional[str] = None,
-    task_manager_instance: Optional[TaskManager] = None
+    job: Optional[JobContext] = None
 ) -> bytes:
     from ..services.tts_service import tts_client
 
@@ -84,9 +83,9 @@ async def synthesize_and_merge_audio(
     audio_data_list = []
     for i, f in enumerate(asyncio.as_completed(tasks)):
         audio_data_list.append(await f)
-        if task_id and task_manager_instance:
+        if job:
             progress = 20 + int(((i + 1) / len(tasks)) * 55)
-            await task_manager_instance.update_task_progress(task_id, progress, f"正在合成第 {i+1}/{len(tasks)} 段音频")
+            await job.progress(progress, f"正在合成第 {i+1}/{len(tasks)} 段音频")
 
     combined_wav_data = b"".join(audio_data_list)
     
@@ -98,8 +97,13 @@ async def synthesize_and_merge_audio(
         wf.writeframes(combined_wav_data)
     output_wav_buffer.seek(0)
     
-    if task_id and task_manager_instance: await task_manager_instance.update_task_progress(task_id, 85, "合并音频中")
-    mp3_output = _run_ffmpeg(output_wav_buffer.getvalue(), 'wav', 'mp3', ['-b:a', '48k'])
+    if job: await job.progress(85, "合并音频中")
+    # [优化] 整段编码是 CPU 密集操作，在作业执行器的进程池中运行，不阻塞事件循环
+    ffmpeg_args = (output_wav_buffer.getvalue(), 'wav', 'mp3', ['-b:a', '48k'])
+    if job:
+        mp3_output = await job.run_cpu(_run_ffmpeg, *ffmpeg_args)
+    else:
+        mp3_output = await asyncio.to_thread(_run_ffmpeg, *ffmpeg_args)
     
     logger.info("TTS Merger: Batch synthesis and merging complete.")
     return mp3_output
\ No newline at end of file
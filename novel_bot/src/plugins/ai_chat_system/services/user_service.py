@@ -18,6 +18,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from ..database.session import DBSession
 from ..database.models import User
 from .. import global_state
+from .content_versions import bump_collection_version
 from .data_persistence import _USER_DATA_PATH
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -94,6 +95,7 @@ class UserService:
 
         user.username = new_username
         await self.db.commit()
+        bump_collection_version(user_id, "config")
         logger.info(f"User {user_id} successfully changed username to '{new_username}'.")
         return True
 
@@ -118,6 +120,8 @@ class UserService:
 
         await self.db.delete(user)
         await self.db.commit()
+        if global_state.data_manager:
+            global_state.data_manager.invalidate_user_config(user_id)
         
         logger.info(f"User '{username}' (ID: {user_id}) has been successfully deleted from database.")
         return True
@@ -159,6 +163,7 @@ class UserService:
             user.avatar = avatar_url
             logger.info(f"[DIAG] Staged change for DB commit. New avatar URL: {user.avatar}")
             await self.db.commit()
+            bump_collection_version(user_id, "config")
             logger.info(f"[DIAG] DB commit successful for avatar update.")
         
         return avatar_url
@@ -0,0 +1,188 @@
+# novel_bot/src/plugins/ai_chat_system/services/world_info_engine.py
+# 职责: 基于关键词触发世界书条目。每个世界书版本只编译一次 Aho-Corasick 自动机，
+#       匹配耗时只与被扫描文本的长度线性相关，而与 条目数 × 关键词数 无关。
+
+import logging
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .content_versions import get_visible_item_version
+
+logger = logging.getLogger("nonebot")
+
+DEFAULT_SCAN_DEPTH = 4          # 默认扫描最近 4 条历史消息（外加当前用户输入）
+MAX_RECURSION_DEPTH = 3         # 递归激活的最大轮数
+COMPILED_BOOK_CACHE_SIZE = 512
+
+
+class AhoCorasickAutomaton:
+    """大小写不敏感的多模式匹配自动机，返回命中的负载 ID 集合。"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, int]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[int]] = [set()]
+
+        for pattern, payload in patterns:
+            pattern = pattern.strip().lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                state = next_state
+            self._output[state].add(payload)
+
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                candidate = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def search(self, text: str) -> Set[int]:
+        matched: Set[int] = set()
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                matched |= output[state]
+        return matched
+
+
+def _scan_depth(value, default: int) -> int:
+    # 0 表示只扫描当前输入，不能与"未设置"混为一谈
+    if value is None or value == "":
+        return default
+    return max(int(value), 0)
+
+
+class CompiledWorldBook:
+    """一本世界书的编译结果：可用条目、常驻条目和关键词自动机。"""
+
+    def __init__(self, name: str, world_data: Dict):
+        self.name = name
+        self.scan_depth = _scan_depth(world_data.get("scan_depth"), DEFAULT_SCAN_DEPTH)
+        self.recursive = world_data.get("recursive_scanning", True) is not False
+
+        self.entries: List[Dict] = []
+        self.entry_depths: List[int] = []
+        self.constant_indices: List[int] = []
+        patterns: List[Tuple[str, int]] = []
+
+        for entry in world_data.get("entries", []):
+            if not isinstance(entry, dict) or entry.get("disable") or not entry.get("content"):
+                continue
+            index = len(self.entries)
+            self.entries.append(entry)
+            self.entry_depths.append(_scan_depth(entry.get("scan_depth"), self.scan_depth))
+
+            keywords = [k for k in entry.get("keywords", []) if isinstance(k, str) and k.strip()]
+            # 没有关键词的条目无法被触发，按常驻条目处理以保持旧行为
+            if entry.get("constant") or not keywords:
+                self.constant_indices.append(index)
+            else:
+                patterns.extend((keyword, index) for keyword in keywords)
+
+        self.max_scan_depth = max(self.entry_depths, default=self.scan_depth)
+        self.automaton = AhoCorasickAutomaton(patterns)
+
+
+_compiled_books: "OrderedDict[Tuple, CompiledWorldBook]" = OrderedDict()
+
+
+def get_compiled_world_book(user_id: str, world_name: str, world_data: Dict) -> CompiledWorldBook:
+    """按 (用户, 世界书, 版本) 获取编译好的世界书，版本变化后自动重新编译。"""
+    key = (user_id, world_name, get_visible_item_version(user_id, "world_info", world_name))
+    compiled = _compiled_books.get(key)
+    if compiled is not None:
+        _compiled_books.move_to_end(key)
+        return compiled
+
+    compiled = CompiledWorldBook(world_name, world_data)
+    _compiled_books[key] = compiled
+    while len(_compiled_books) > COMPILED_BOOK_CACHE_SIZE:
+        _compiled_books.popitem(last=False)
+    logger.debug(f"WorldInfo: Compiled '{world_name}' for user {user_id} ({len(compiled.entries)} entries).")
+    return compiled
+
+
+def activate_world_info(books: List[CompiledWorldBook], scan_texts: List[str]) -> str:
+    """
+    根据扫描文本激活条目，并按世界书顺序和条目顺序拼接成提示词片段。
+    scan_texts[0] 为当前用户输入，其后依次为由新到旧的历史消息。
+    """
+    activated: List[Set[int]] = [set(book.constant_indices) for book in books]
+
+    for book_index, book in enumerate(books):
+        # 记录每个条目最早（最新）在哪一深度被命中，再与条目自身的扫描深度比较
+        hit_depths: Dict[int, int] = {}
+        for depth, text in enumerate(scan_texts[:book.max_scan_depth + 1]):
+            if not text:
+                continue
+            for entry_index in book.automaton.search(text):
+                hit_depths.setdefault(entry_index, depth)
+        activated[book_index].update(
+            entry_index for entry_index, depth in hit_depths.items()
+            if depth <= book.entry_depths[entry_index]
+        )
+
+    # 递归激活：被激活条目的内容本身也可能包含其他条目的关键词
+    newly_activated = [set(indices) for indices in activated]
+    for _ in range(MAX_RECURSION_DEPTH):
+        recursion_text = "\n".join(
+            books[book_index].entries[entry_index].get("content", "")
+            for book_index, indices in enumerate(newly_activated)
+            for entry_index in indices
+        )
+        if not recursion_text:
+            break
+        newly_activated = []
+        for book_index, book in enumerate(books):
+            found = book.automaton.search(recursion_text) - activated[book_index] if book.recursive else set()
+            activated[book_index] |= found
+            newly_activated.append(found)
+        if not any(newly_activated):
+            break
+
+    return "\n".join(
+        f"- {book.entries[entry_index].get('content', '')}"
+        for book_index, book in enumerate(books)
+        for entry_index in sorted(activated[book_index])
+    )
+
+
+def _message_text(message: Dict) -> str:
+    return message.get("content") or "".join(
+        p.get("text", "") for p in message.get("parts", []) if isinstance(p, dict)
+    )
+
+
+def build_scan_texts(user_message: str, history: Optional[List[Dict]]) -> List[str]:
+    """
+    把当前用户输入和历史消息整理为由新到旧的扫描文本列表，scan_texts[0] 为当前这一轮。
+    调用方通常已把当前用户输入追加到 history 末尾，此时它只作为第 0 层扫描一次，不再占用一个深度。
+    """
+    messages = list(history or [])
+    current = user_message or ""
+    if current and messages and messages[-1].get("role") == "user":
+        last_text = _message_text(messages.pop())
+        current = last_text if current in last_text else f"{current}\n{last_text}"
+    return [current] + [_message_text(message) for message in reversed(messages)]
@@ -1,20 +1,36 @@
 import json
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import AsyncIterator, Dict, List, Any, Optional
 import os
 import shutil
 import uuid
 import time
 import logging
 
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from .database import session as db_session
 from .database.models import Session, ChatMessage, User
+from .services.content_versions import bump_collection_version
+from .services.message_compression import message_codec, ensure_dictionaries
+from .utils.tokenizer import count_tokens, DEFAULT_TOKENIZER
 
 logger = logging.getLogger("nonebot")
 
+
+class SessionVersionConflict(ValueError):
+    """客户端持有的会话版本号已过期（会话在此期间被其他请求修改）。"""
+
+    def __init__(self, session_id: str, expected_version: Optional[int], current_version: int):
+        super().__init__(
+            f"Session {session_id} was modified concurrently (expected version {expected_version}, current {current_version})."
+        )
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
 class SessionManager:
     async def get_sessions_for_character(self, user_id: str, char_filename: str, db: AsyncSession) -> List[Dict]:
         if user_id == 'anonymous-user':
@@ -53,6 +69,7 @@ class SessionManager:
         try:
             db.add(new_session)
             await db.commit()
+            bump_collection_version(user_id, "sessions")
             await db.refresh(new_session)
             
             metadata = {"id": new_session.id, "title": new_session.title, "created": new_session.created_at, "last_updated": new_session.last_updated_at}
@@ -62,54 +79,318 @@ class SessionManager:
             logger.error(f"SessionManager: Failed to create new session in DB for user {user_id}: {e}", exc_info=True)
             return None
 
+    @staticmethod
+    def _serialize_message(msg: ChatMessage) -> Dict[str, Any]:
+        return {
+            "seq": msg.seq, "role": msg.role,
+            "content": message_codec.decode(msg.content, msg.content_codec, msg.content_blob),
+            "tokenUsage": msg.token_usage,
+            "tokenCount": msg.token_count, "tokenizer": msg.tokenizer
+        }
+
     async def get_session_history(self, user_id: str, session_id: str, db: AsyncSession) -> Optional[List[Dict]]:
         if user_id == 'anonymous-user':
             return []
 
-        stmt = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp)
+        stmt = (
+            select(ChatMessage)
+            .join(Session, Session.id == ChatMessage.session_id)
+            .where(ChatMessage.session_id == session_id, Session.owner_id == user_id)
+            .order_by(ChatMessage.seq, ChatMessage.timestamp)
+        )
         result = await db.execute(stmt)
         messages = result.scalars().all()
+        await ensure_dictionaries(msg.content_codec for msg in messages)
         
-        return [
-            {"role": msg.role, "content": msg.content, "tokenUsage": msg.token_usage}
-            for msg in messages
-        ]
+        return [self._serialize_message(msg) for msg in messages]
 
-    async def update_session_history(self, user_id: str, session_id: str, history: List[Dict], db: AsyncSession) -> bool:
+    async def get_session_history_page(
+        self, user_id: str, session_id: str, db: AsyncSession,
+        before_seq: Optional[int] = None, limit: int = 50
+    ) -> Dict[str, Any]:
+        """
+        键集分页：返回 seq < before_seq 的最近 limit 条消息（按 seq 升序）。
+        不传 before_seq 时返回最新一页；next_cursor 作为下一次请求的 before_seq，为 None 表示已到最早的消息。
+        """
         if user_id == 'anonymous-user':
-            return False
+            return {"messages": [], "next_cursor": None}
+
+        stmt = (
+            select(ChatMessage)
+            .join(Session, Session.id == ChatMessage.session_id)
+            .where(ChatMessage.session_id == session_id, Session.owner_id == user_id)
+        )
+        if before_seq is not None:
+            stmt = stmt.where(ChatMessage.seq < before_seq)
+        # 多取一条用于判断是否还有更早的消息，查询走 (session_id, seq) 索引
+        stmt = stmt.order_by(ChatMessage.seq.desc()).limit(limit + 1)
+        rows = (await db.execute(stmt)).scalars().all()
+
+        has_more = len(rows) > limit
+        page = list(reversed(rows[:limit]))
+        await ensure_dictionaries(msg.content_codec for msg in page)
+        return {
+            "messages": [self._serialize_message(msg) for msg in page],
+            "next_cursor": page[0].seq if has_more and page else None,
+        }
+
+    async def iter_session_history(self, user_id: str, session_id: str, batch_size: int = 200) -> AsyncIterator[Dict[str, Any]]:
+        """
+        按 seq 顺序分批逐条产出整个会话的消息，用于流式导出。
+        使用独立的数据库会话，每批一次短查询，不会一次性把整个会话加载进内存。
+        """
+        if user_id == 'anonymous-user':
+            return
+
+        after_seq = 0
+        while True:
+            async with db_session.AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(ChatMessage)
+                    .join(Session, Session.id == ChatMessage.session_id)
+                    .where(ChatMessage.session_id == session_id, Session.owner_id == user_id, ChatMessage.seq > after_seq)
+                    .order_by(ChatMessage.seq)
+                    .limit(batch_size)
+                )).scalars().all()
+            await ensure_dictionaries(msg.content_codec for msg in rows)
+            for msg in rows:
+                yield self._serialize_message(msg)
+            if len(rows) < batch_size:
+                return
+            after_seq = rows[-1].seq
+
+    async def get_session_version(self, user_id: str, session_id: str, db: AsyncSession) -> Optional[int]:
+        version = await db.scalar(
+            select(func.coalesce(Session.version, 0)).where(Session.id == session_id, Session.owner_id == user_id)
+        )
+        return version
+
+    async def _bump_version(self, user_id: str, session_id: str, db: AsyncSession, expected_version: Optional[int]) -> int:
+        """
+        递增会话版本号。expected_version 不为 None 时只有版本匹配才会更新（乐观锁），
+        否则抛出 SessionVersionConflict；会话不存在时抛出 LookupError。
+        """
+        stmt = update(Session).where(Session.id == session_id, Session.owner_id == user_id)
+        if expected_version is not None:
+            stmt = stmt.where(func.coalesce(Session.version, 0) == expected_version)
+        stmt = stmt.values(version=func.coalesce(Session.version, 0) + 1, last_updated_at=time.time())
+        result = await db.execute(stmt)
+
+        if result.rowcount == 0:
+            current_version = await self.get_session_version(user_id, session_id, db)
+            if current_version is None:
+                raise LookupError(f"Session {session_id} not found.")
+            raise SessionVersionConflict(session_id, expected_version, current_version)
+        if expected_version is not None:
+            return expected_version + 1
+        return await self.get_session_version(user_id, session_id, db)
+
+    def _build_message(self, session_id: str, seq: int, msg: Dict, timestamp: float) -> ChatMessage:
+        content = msg.get("content")
+        return ChatMessage(
+            session_id=session_id,
+            seq=seq,
+            timestamp=timestamp,
+            role=msg.get("role"),
+            **message_codec.encoded_columns(content),
+            token_usage=msg.get("tokenUsage"),
+            token_count=count_tokens(content or ""),
+            tokenizer=DEFAULT_TOKENIZER
+        )
+
+    async def _next_seq(self, session_id: str, db: AsyncSession) -> int:
+        max_seq = await db.scalar(select(func.max(ChatMessage.seq)).where(ChatMessage.session_id == session_id))
+        return (max_seq or 0) + 1
+
+    async def append_messages(
+        self, user_id: str, session_id: str, messages: List[Dict], db: AsyncSession,
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        """只插入新消息，返回新的会话版本号；失败返回 None，版本冲突抛出 SessionVersionConflict。"""
+        if user_id == 'anonymous-user':
+            return None
+
+        try:
+            async with db.begin_nested():
+                new_version = await self._bump_version(user_id, session_id, db, expected_version)
+                next_seq = await self._next_seq(session_id, db)
+                now = time.time()
+                db.add_all([
+                    self._build_message(session_id, next_seq + i, msg, now + i * 0.001)
+                    for i, msg in enumerate(messages)
+                ])
+            await db.commit()
+            bump_collection_version(user_id, "sessions")
+            return new_version
+        except SessionVersionConflict:
+            await db.rollback()
+            raise
+        except LookupError as e:
+            await db.rollback()
+            logger.warning(f"SessionManager: {e}")
+            return None
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"SessionManager: Failed to append messages to session {session_id}: {e}", exc_info=True)
+            return None
+
+    async def patch_messages(
+        self, user_id: str, session_id: str, patches: Dict[int, Dict], db: AsyncSession,
+        expected_version: Optional[int] = None, truncate_after: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        按 seq 只更新被编辑的消息（role / content / tokenUsage），可选地删除 seq > truncate_after 的消息
+        （例如重新生成最后一条回复时）。返回新的会话版本号。
+        """
+        if user_id == 'anonymous-user':
+            return None
 
         try:
             async with db.begin_nested():
-                del_stmt = delete(ChatMessage).where(ChatMessage.session_id == session_id)
-                await db.execute(del_stmt)
-
-                new_messages = [
-                    ChatMessage(
-                        session_id=session_id,
-                        timestamp=time.time() + i * 0.001,
-                        role=msg.get("role"),
-                        content=msg.get("content"),
-                        token_usage=msg.get("tokenUsage")
-                    ) for i, msg in enumerate(history[-100:])
+                new_version = await self._bump_version(user_id, session_id, db, expected_version)
+                for seq, fields in patches.items():
+                    values = self._patch_values(fields)
+                    if values:
+                        await db.execute(
+                            update(ChatMessage)
+                            .where(ChatMessage.session_id == session_id, ChatMessage.seq == int(seq))
+                            .values(**values)
+                        )
+                if truncate_after is not None:
+                    await db.execute(
+                        delete(ChatMessage).where(ChatMessage.session_id == session_id, ChatMessage.seq > truncate_after)
+                    )
+            await db.commit()
+            bump_collection_version(user_id, "sessions")
+            return new_version
+        except SessionVersionConflict:
+            await db.rollback()
+            raise
+        except LookupError as e:
+            await db.rollback()
+            logger.warning(f"SessionManager: {e}")
+            return None
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"SessionManager: Failed to patch messages in session {session_id}: {e}", exc_info=True)
+            return None
+
+    @staticmethod
+    def _patch_values(fields: Dict) -> Dict[str, Any]:
+        values: Dict[str, Any] = {}
+        if "role" in fields:
+            values["role"] = fields["role"]
+        if "content" in fields:
+            values.update(message_codec.encoded_columns(fields["content"]))
+            values["token_count"] = count_tokens(fields["content"] or "")
+            values["tokenizer"] = DEFAULT_TOKENIZER
+        if "tokenUsage" in fields:
+            values["token_usage"] = fields["tokenUsage"]
+        return values
+
+    async def update_session_history(
+        self, user_id: str, session_id: str, history: List[Dict], db: AsyncSession,
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        接收完整的历史记录（兼容旧接口），但只写入差异：按位置与已存储的消息比较，
+        内容变化的行原地更新，多出的消息追加，被截掉的尾部删除。没有变化时不写数据库。
+        返回会话版本号；失败返回 None。
+        """
+        if user_id == 'anonymous-user':
+            return None
+
+        try:
+            async with db.begin_nested():
+                stored = (await db.execute(
+                    select(
+                        ChatMessage.id, ChatMessage.seq, ChatMessage.role, ChatMessage.content,
+                        ChatMessage.content_codec, ChatMessage.content_blob, ChatMessage.token_usage
+                    )
+                    .where(ChatMessage.session_id == session_id)
+                    .order_by(ChatMessage.seq, ChatMessage.timestamp)
+                )).all()
+                await ensure_dictionaries(row.content_codec for row in stored)
+
+                changed = [
+                    (row, msg) for row, msg in zip(stored, history)
+                    if (row.role, message_codec.decode(row.content, row.content_codec, row.content_blob), row.token_usage)
+                    != (msg.get("role"), msg.get("content"), msg.get("tokenUsage"))
                 ]
-                db.add_all(new_messages)
-                
-                update_stmt = update(Session).where(Session.id == session_id).values(last_updated_at=time.time())
-                await db.execute(update_stmt)
-            
+                appended = history[len(stored):]
+                removed_ids = [row.id for row in stored[len(history):]]
+
+                has_changes = bool(changed or appended or removed_ids)
+                if not has_changes:
+                    current_version = await self.get_session_version(user_id, session_id, db)
+                    if expected_version is not None and current_version is not None and current_version != expected_version:
+                        raise SessionVersionConflict(session_id, expected_version, current_version)
+                    new_version = current_version
+                else:
+                    new_version = await self._bump_version(user_id, session_id, db, expected_version)
+                    for row, msg in changed:
+                        await db.execute(
+                            update(ChatMessage).where(ChatMessage.id == row.id).values(
+                                **self._patch_values({"role": msg.get("role"), "content": msg.get("content"), "tokenUsage": msg.get("tokenUsage")})
+                            )
+                        )
+                    if removed_ids:
+                        await db.execute(delete(ChatMessage).where(ChatMessage.id.in_(removed_ids)))
+                    if appended:
+                        next_seq = (stored[-1].seq + 1) if stored and stored[-1].seq is not None else await self._next_seq(session_id, db)
+                        now = time.time()
+                        db.add_all([
+                            self._build_message(session_id, next_seq + i, msg, now + i * 0.001)
+                            for i, msg in enumerate(appended)
+                        ])
+
             await db.commit()
-            return True
+            if has_changes:
+                bump_collection_version(user_id, "sessions")
+            if new_version is None:
+                logger.warning(f"SessionManager: History update for unknown session {session_id} ignored.")
+            return new_version
+        except SessionVersionConflict:
+            await db.rollback()
+            raise
+        except LookupError as e:
+            await db.rollback()
+            logger.warning(f"SessionManager: {e}")
+            return None
         except Exception as e:
             await db.rollback()
             logger.error(f"SessionManager: Failed to update session history in DB for session {session_id}: {e}", exc_info=True)
-            return False
+            return None
+
+    async def repair_session_history(self, user_id: str, session_id: str, history: List[Dict], db: AsyncSession) -> Optional[int]:
+        """显式的修复操作：删除该会话的所有消息并按给定顺序重写（seq 从 1 开始重新编号）。"""
+        if user_id == 'anonymous-user':
+            return None
+
+        try:
+            async with db.begin_nested():
+                new_version = await self._bump_version(user_id, session_id, db, None)
+                await db.execute(delete(ChatMessage).where(ChatMessage.session_id == session_id))
+                now = time.time()
+                db.add_all([
+                    self._build_message(session_id, i + 1, msg, now + i * 0.001)
+                    for i, msg in enumerate(history)
+                ])
+            await db.commit()
+            bump_collection_version(user_id, "sessions")
+            logger.info(f"SessionManager: Rewrote {len(history)} messages for session {session_id} (repair).")
+            return new_version
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"SessionManager: Failed to repair session history for session {session_id}: {e}", exc_info=True)
+            return None
 
     async def delete_session(self, user_id: str, session_id: str, db: AsyncSession) -> bool:
         try:
             stmt = delete(Session).where(Session.id == session_id, Session.owner_id == user_id)
             result = await db.execute(stmt)
             await db.commit()
+            bump_collection_version(user_id, "sessions")
             return result.rowcount > 0
         except Exception as e:
             await db.rollback()
@@ -121,6 +402,7 @@ class SessionManager:
             stmt = delete(Session).where(Session.owner_id == user_id, Session.character_filename == char_filename)
             await db.execute(stmt)
             await db.commit()
+            bump_collection_version(user_id, "sessions")
             return True
         except Exception as e:
             await db.rollback()
@@ -135,6 +417,7 @@ class SessionManager:
             ).values(character_filename=new_char_filename)
             await db.execute(stmt)
             await db.commit()
+            bump_collection_version(user_id, "sessions")
             return True
         except Exception as e:
             await db.rollback()
@@ -150,6 +433,7 @@ class SessionManager:
             
             result = await db.execute(stmt)
             await db.commit()
+            bump_collection_version(user_id, "sessions")
             return result.rowcount > 0
         except Exception as e:
             await db.rollback()
@@ -4,9 +4,20 @@ import logging
 from typing import Any, List, Optional, Tuple, AsyncGenerator, Dict
 
 from ..llm_services import get_llm_service
+from ..llm_services.base import LLMService
 
 logger = logging.getLogger("nonebot")
 
+# [优化] 服务实例本身无状态（Key 与客户端由 llm_client_pool 管理），每个服务商只创建一次
+_service_instances: Dict[str, LLMService] = {}
+
+def _get_service_instance(service_name: str) -> LLMService:
+    service_instance = _service_instances.get(service_name)
+    if service_instance is None:
+        service_instance = get_llm_service(service_name)()
+        _service_instances[service_name] = service_instance
+    return service_instance
+
 async def call_llm_service(
     user_id: str,
     service_config: Dict,
@@ -22,8 +33,7 @@ async def call_llm_service(
     service_name = service_config.get("provider", "google_gemini")
     
     try:
-        service_class = get_llm_service(service_name)
-        service_instance = service_class()
+        service_instance = _get_service_instance(service_name)
         
         return await service_instance.call_api(
             user_id=user_id,
@@ -0,0 +1,141 @@
+# novel_bot/src/plugins/ai_chat_system/utils/stream_coalescer.py
+# 职责: 将上游的细碎文本块按时间窗口或大小窗口合并后再下发，
+#       并提供低开销的 SSE 帧序列化与帧率统计。
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from ..constants import STREAM_FLUSH_CHARS, STREAM_FLUSH_INTERVAL_MS
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时使用标准库
+    orjson = None
+
+
+def dumps_bytes(payload: Any) -> bytes:
+    """把负载序列化为 UTF-8 JSON 字节串，优先使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def sse_frame(payload: Any) -> bytes:
+    """构造一条 SSE data 帧。"""
+    return b"data: " + dumps_bytes(payload) + b"\n\n"
+
+
+class StreamMetrics:
+    """进程级的流式输出统计，用于观察合并效果（上游块数 / 下发帧数）。"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.active_streams = 0
+        self.total_streams = 0
+        self.upstream_chunks = 0
+        self.frames_sent = 0
+        self.chars_sent = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        uptime = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "active_streams": self.active_streams,
+            "total_streams": self.total_streams,
+            "upstream_chunks": self.upstream_chunks,
+            "frames_sent": self.frames_sent,
+            "chars_sent": self.chars_sent,
+            "chunks_per_frame": round(self.upstream_chunks / self.frames_sent, 2) if self.frames_sent else 0.0,
+            "frames_per_second": round(self.frames_sent / uptime, 3),
+            "uptime_seconds": round(uptime, 1),
+        }
+
+
+stream_metrics = StreamMetrics()
+
+
+async def coalesce_chunks(
+    events: AsyncGenerator[Dict[str, Any], None],
+    flush_interval_ms: Optional[int] = None,
+    flush_chars: Optional[int] = None,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    合并连续的 {"type": "chunk"} 事件。缓冲区中最早的块等待超过 flush_interval_ms，
+    或累计字符数达到 flush_chars 时立即下发；其他类型的事件会先冲刷缓冲区再原样透传。
+    即使上游暂时没有新数据，时间窗口到期后也会下发，不会让已收到的文字滞留。
+    """
+    interval = (STREAM_FLUSH_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms) / 1000
+    max_chars = STREAM_FLUSH_CHARS if flush_chars is None else flush_chars
+
+    buffer: List[str] = []
+    buffered_chars = 0
+    window_deadline = 0.0
+    iterator = events.__aiter__()
+    pending: Optional[asyncio.Task] = None
+
+    stream_metrics.active_streams += 1
+    stream_metrics.total_streams += 1
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            if buffer:
+                timeout = window_deadline - time.monotonic()
+                if timeout > 0:
+                    await asyncio.wait((pending,), timeout=timeout)
+            else:
+                await asyncio.wait((pending,))
+
+            if not pending.done():
+                # 时间窗口到期，上游仍未产出新块
+                stream_metrics.frames_sent += 1
+                stream_metrics.chars_sent += buffered_chars
+                yield {"type": "chunk", "content": "".join(buffer)}
+                buffer, buffered_chars = [], 0
+                continue
+
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+
+            if event.get("type") == "chunk":
+                stream_metrics.upstream_chunks += 1
+                content = event.get("content", "")
+                if not buffer:
+                    window_deadline = time.monotonic() + interval
+                buffer.append(content)
+                buffered_chars += len(content)
+                if buffered_chars < max_chars and interval > 0:
+                    continue
+                event = None
+
+            if buffer:
+                stream_metrics.frames_sent += 1
+                stream_metrics.chars_sent += buffered_chars
+                yield {"type": "chunk", "content": "".join(buffer)}
+                buffer, buffered_chars = [], 0
+            if event is not None:
+                stream_metrics.frames_sent += 1
+                yield event
+
+        if buffer:
+            stream_metrics.frames_sent += 1
+            stream_metrics.chars_sent += buffered_chars
+            yield {"type": "chunk", "content": "".join(buffer)}
+    finally:
+        stream_metrics.active_streams -= 1
+        if pending is not None and not pending.done():
+            # 必须等待被取消的 __anext__ 结束，否则上游生成器仍处于运行状态，无法关闭
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
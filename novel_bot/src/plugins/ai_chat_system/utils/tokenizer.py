@@ -0,0 +1,118 @@
+# novel_bot/src/plugins/ai_chat_system/utils/tokenizer.py
+# 职责: 提供可插拔的本地 Token 计数后端，以及按模型名称选择后端的适配表。
+
+import logging
+import math
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Type
+
+logger = logging.getLogger("nonebot")
+
+# 中日韩统一表意文字、假名、谚文以及全角标点，这些字符基本上一字一 token
+_CJK_PATTERN = re.compile(
+    r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]"
+)
+
+
+class TokenizerBackend(ABC):
+    """本地 Token 计数后端的抽象基类。"""
+
+    name: str = "base"
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """返回给定文本的 Token 数量。"""
+        pass
+
+
+class HeuristicTokenizer(TokenizerBackend):
+    """
+    不依赖任何第三方库的估算器。
+    CJK 字符按每字 1 个 token 计算，其余文本按约 4 个字符 1 个 token 计算。
+    """
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk_count = len(_CJK_PATTERN.findall(text))
+        other_count = len(text) - cjk_count
+        return cjk_count + math.ceil(other_count / 4)
+
+
+class TiktokenTokenizer(TokenizerBackend):
+    """基于 tiktoken 的精确计数后端（可选依赖，未安装时不可用）。"""
+
+    name = "tiktoken"
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        import tiktoken
+        self._encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+# 后端注册表
+# Key: 后端名称
+# Value: 实现了 TokenizerBackend 基类的后端类
+TOKENIZER_REGISTRY: Dict[str, Type[TokenizerBackend]] = {
+    "heuristic": HeuristicTokenizer,
+    "tiktoken": TiktokenTokenizer,
+}
+
+DEFAULT_TOKENIZER = "heuristic"
+
+# 按模型名称前缀选择后端，按顺序匹配，未命中时使用 DEFAULT_TOKENIZER。
+# Gemini 与 Horde 上的开源模型没有可在本地加载的官方分词器，因此使用估算器。
+MODEL_TOKENIZER_ADAPTERS: List[Tuple[str, str]] = [
+    ("models/gemini", "heuristic"),
+    ("gemini", "heuristic"),
+    ("gpt-", "tiktoken"),
+]
+
+_backend_instances: Dict[str, TokenizerBackend] = {}
+
+
+def get_tokenizer(name: str = DEFAULT_TOKENIZER) -> TokenizerBackend:
+    """获取（并缓存）指定名称的后端实例，后端不可用时回退到默认估算器。"""
+    backend = _backend_instances.get(name)
+    if backend:
+        return backend
+
+    backend_class = TOKENIZER_REGISTRY.get(name)
+    if not backend_class:
+        raise ValueError(f"未知的 Tokenizer 后端: {name}")
+    try:
+        backend = backend_class()
+    except Exception as e:
+        if name == DEFAULT_TOKENIZER:
+            raise
+        logger.warning(f"Tokenizer: Backend '{name}' unavailable ({e}). Falling back to '{DEFAULT_TOKENIZER}'.")
+        backend = get_tokenizer(DEFAULT_TOKENIZER)
+
+    _backend_instances[name] = backend
+    return backend
+
+
+def get_tokenizer_for_model(model_name: Optional[str]) -> TokenizerBackend:
+    """根据模型名称从适配表中选择 Token 计数后端。"""
+    if model_name:
+        for prefix, backend_name in MODEL_TOKENIZER_ADAPTERS:
+            if model_name.startswith(prefix):
+                return get_tokenizer(backend_name)
+    return get_tokenizer(DEFAULT_TOKENIZER)
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """计算文本的 Token 数；后端出错时回退到估算器，保证总能返回一个结果。"""
+    backend = get_tokenizer_for_model(model_name)
+    try:
+        return backend.count(text)
+    except Exception as e:
+        logger.warning(f"Tokenizer: Backend '{backend.name}' failed to count tokens: {e}. Using heuristic.")
+        return get_tokenizer(DEFAULT_TOKENIZER).count(text)
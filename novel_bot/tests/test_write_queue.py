@@ -0,0 +1,87 @@
+# novel_bot/tests/test_write_queue.py
+# 职责: 验证 SQLite 写入队列确实按批提交：一批写入只 COMMIT 一次，单个写入失败只回滚它自己的 SAVEPOINT。
+
+import asyncio
+
+import pytest
+from sqlalchemy import event, text
+
+from src.plugins.ai_chat_system.database import session as db_session
+from src.plugins.ai_chat_system.database.write_queue import DatabaseWriteQueue
+
+
+def _insert(value: int):
+    async def job(db):
+        await db.execute(text("INSERT INTO items (value) VALUES (:value)"), {"value": value})
+        return value
+    return job
+
+
+async def _failing(db):
+    await db.execute(text("INSERT INTO items (value) VALUES (-1)"))
+    raise ValueError("boom")
+
+
+async def _run_batch(db_path):
+    db_session.initialize_database(f"sqlite+aiosqlite:///{db_path}")
+    try:
+        async with db_session.engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE items (value INTEGER NOT NULL)"))
+
+        statements = []
+        commits = []
+        event.listen(db_session.engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement.split()[0].upper()))
+        event.listen(db_session.engine.sync_engine, "commit", lambda conn: commits.append(True))
+
+        queue = DatabaseWriteQueue()
+        # 同一轮事件循环中入队的写入会被工作协程合并为一批
+        results = await asyncio.gather(
+            queue.submit(_insert(1)), queue.submit(_failing), queue.submit(_insert(2)), queue.submit(_insert(3)),
+            return_exceptions=True,
+        )
+        await queue.stop()
+        batch_statements = list(statements)
+
+        async with db_session.AsyncSessionLocal() as db:
+            stored = sorted((await db.execute(text("SELECT value FROM items"))).scalars())
+        return results, stored, batch_statements, commits, queue.metrics
+    finally:
+        await db_session.engine.dispose()
+        db_session.engine = None
+        db_session.AsyncSessionLocal = None
+
+
+def test_batch_commits_once_and_isolates_failures(tmp_path):
+    results, stored, statements, commits, metrics = asyncio.run(_run_batch(tmp_path / "queue.db"))
+
+    assert results[0] == 1 and results[2] == 2 and results[3] == 3
+    assert isinstance(results[1], ValueError)
+    # 失败写入的 SAVEPOINT 被回滚，同批其他写入仍然提交
+    assert stored == [1, 2, 3]
+    assert metrics.batches == 1
+    assert len(commits) == 1
+    # 整批在一个显式事务中执行：先 BEGIN，再逐个 SAVEPOINT
+    assert statements.index("BEGIN") < statements.index("SAVEPOINT")
+    assert statements.count("BEGIN") == 1
+
+
+def test_release_savepoint_does_not_commit(tmp_path):
+    async def run():
+        db_session.initialize_database(f"sqlite+aiosqlite:///{tmp_path / 'nested.db'}")
+        try:
+            async with db_session.engine.begin() as conn:
+                await conn.execute(text("CREATE TABLE items (value INTEGER NOT NULL)"))
+            async with db_session.AsyncSessionLocal() as db:
+                async with db.begin_nested():
+                    await db.execute(text("INSERT INTO items (value) VALUES (1)"))
+                assert db.in_transaction()
+                await db.rollback()
+            async with db_session.AsyncSessionLocal() as db:
+                return (await db.execute(text("SELECT COUNT(*) FROM items"))).scalar()
+        finally:
+            await db_session.engine.dispose()
+            db_session.engine = None
+            db_session.AsyncSessionLocal = None
+
+    assert asyncio.run(run()) == 0
@@ -8,7 +8,7 @@ import type {
   AvatarUploadResponse, DeleteAccountPayload, GenerationProfile, OptionsProfile, UsernameUpdatePayload, UsernameUpdateResponse,
   MessageActionType, PaginatedData,
   BootstrapResponse, CheckModelsResponse, TokenUsageStatsResponse, TaskSubmissionResponse, TaskStatusResponse,
-  GenerationProfiles, StoryPackageResponse, ApiKey
+  GenerationProfiles, StoryPackageResponse, ApiKey, BatchUpsertItem, BatchUpsertResponse
 } from '~/types/api';
 
 function getApiClient(): AxiosInstance {
@@ -37,9 +37,15 @@ export const apiService = {
   },
 
   // Bootstrap & Data
-  bootstrap(userId: string): Promise<BootstrapResponse> {
+  async bootstrap(userId: string): Promise<BootstrapResponse> {
     if (!userId) { return Promise.reject(new Error("User ID cannot be empty for bootstrap")); }
-    return getApiClient().get(`/bootstrap/${userId}`);
+    // 公共目录以引用方式返回，再从可缓存的版本化地址单独获取并合并
+    const bootstrap: BootstrapResponse = await getApiClient().get(`/bootstrap/${userId}`, { params: { public_catalog: 'reference' } });
+    if (bootstrap.public_catalog) {
+      const catalog: Pick<BootstrapResponse, 'public_characters' | 'public_presets' | 'public_world_info' | 'public_groups'> = await getApiClient().get(bootstrap.public_catalog.url);
+      Object.assign(bootstrap, catalog);
+    }
+    return bootstrap;
   },
   
   getPaginatedData<T>(userId: string, dataType: string, page: number, limit: number, sortBy: string, search?: string): Promise<PaginatedData<T>> {
@@ -60,6 +66,9 @@ export const apiService = {
     const payload = { ...data, _is_editing: isEditing };
     return getApiClient().post(`/data/${userId}/${dataType}/${filenameSuggestion}`, payload);
   },
+  batchUpsertData(userId: string, items: BatchUpsertItem[], overwrite: boolean = true): Promise<BatchUpsertResponse> {
+    return getApiClient().post(`/data/${userId}/batch`, { items, overwrite });
+  },
   renameData(userId: string, dataType: 'character' | 'preset' | 'world_info' | 'group', oldName: string, newName: string): Promise<{ status: string; message: string }> {
       return getApiClient().patch(`/data/${userId}/${dataType}/${oldName}`, { new_name: newName });
   },
@@ -71,6 +80,9 @@ export const apiService = {
   getSessionsForCharacter(userId: string, charFilename: string): Promise<Session[]> { return getApiClient().get(`/sessions/${userId}/${charFilename}`); },
   createNewSession(userId: string, charFilename: string): Promise<Session> { return getApiClient().post(`/session/${userId}/${charFilename}`); },
   getSessionHistory(userId: string, sessionId: string): Promise<Omit<ChatMessage, 'id'>[]> { return getApiClient().get(`/history/${userId}/${sessionId}`); },
+  getSessionHistoryPage(userId: string, sessionId: string, before?: number, limit: number = 50): Promise<{ messages: (Omit<ChatMessage, 'id'> & { seq: number })[]; next_cursor: number | null }> {
+    return getApiClient().get(`/history/${userId}/${sessionId}/page`, { params: { before, limit } });
+  },
   updateSessionHistory(userId: string, sessionId: string, history: Omit<ChatMessage, 'id'>[]): Promise<{ status: string; message: string }> { return getApiClient().put(`/history/${userId}/${sessionId}`, history); },
   deleteSession(userId: string, sessionId: string): Promise<{ status: string; message: string }> { return getApiClient().delete(`/session/${userId}/${sessionId}`); },
   renameSession(userId: string, sessionId: string, newTitle: string): Promise<{ status: string; message: string }> { return getApiClient().patch(`/session/${userId}/${sessionId}`, { title: newTitle }); },
@@ -106,6 +118,7 @@ export const apiService = {
   // Tasks
   getTaskStatus(taskId: string): Promise<TaskStatusResponse> { return getApiClient().get(`/tasks/${taskId}`); },
   getAllTasksForUser(userId: string, limit: number = 50, offset: number = 0): Promise<TaskStatusResponse[]> { return getApiClient().get(`/tasks/user/${userId}`, { params: { limit, offset } }); },
+  cancelTask(userId: string, taskId: string): Promise<{ status: 'cancelled' | 'cancelling'; task_id: string }> { return getApiClient().post(`/tasks/user/${userId}/${taskId}/cancel`); },
   
   // System
   checkModels(userId: string, apiKeys?: ApiKey[]): Promise<CheckModelsResponse> { return getApiClient().post('/system/check_models', { user_id: userId, api_keys: apiKeys }); },
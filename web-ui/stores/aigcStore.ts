@@ -6,10 +6,12 @@ import { apiService } from '~/services/api';
 import { useUIStore } from './ui';
 import { useSettingsStore } from './settings';
 import type { DrawingConfig, GenerationRequest, Img2ImgRequest, ImageToPromptRequest } from '~/types/api';
+import { useTaskStore } from './taskStore';
 
 export const useAigcStore = defineStore('aigc', () => {
     const uiStore = useUIStore();
     const settingsStore = useSettingsStore();
+    const taskStore = useTaskStore();
 
     const config = ref<DrawingConfig | null>(null);
     const isLoadingConfig = ref(false);
@@ -43,22 +45,11 @@ export const useAigcStore = defineStore('aigc', () => {
     const isAnalyzingPrompt = ref(false);
 
     async function pollTaskResult(taskId: string, timeout = 300000) {
-        const startTime = Date.now();
-        while (Date.now() - startTime < timeout) {
-            try {
-                const task = await apiService.getTaskStatus(taskId);
-                if (task.status === 'success') {
-                    return task.result;
-                }
-                if (task.status === 'failed') {
-                    throw new Error(task.error?.error || '任务执行失败');
-                }
-                await new Promise(resolve => setTimeout(resolve, 3000)); 
-            } catch (error) {
-                 throw new Error(`轮询任务状态失败: ${error}`);
-            }
+        const task = await taskStore.pollTaskResult(taskId, timeout);
+        if (task.status === 'failed') {
+            throw new Error(task.error?.error || '任务执行失败');
         }
-        throw new Error('任务超时');
+        return task.result;
     }
 
     async function fetchConfig() {
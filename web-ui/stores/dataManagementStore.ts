@@ -19,13 +19,8 @@ export const useDataManagementStore = defineStore('dataManagement', () => {
     const isImporting = ref(false);
 
     async function pollTaskResult(taskId: string): Promise<TaskStatusResponse> {
-        while (true) {
-            const task = await apiService.getTaskStatus(taskId);
-            if (task.status === 'success' || task.status === 'failed') {
-                return task;
-            }
-            await new Promise(resolve => setTimeout(resolve, 3000));
-        }
+        // 导入/导出可能耗时很长，不设超时；进度由 taskStore 通过 WebSocket 推送接收
+        return taskStore.pollTaskResult(taskId, Infinity);
     }
 
     async function exportData() {
@@ -7,9 +7,14 @@ import type { TaskStatusResponse, PaginatedData, Character } from '~/types/api';
 import { useQueryClient } from '@tanstack/vue-query';
 import { BOOTSTRAP_QUERY_KEY, useInvalidateAllData } from '~/composables/useAllData';
 import { useSettingsStore } from './settings';
+import { useWebSocket } from '~/services/websocket';
 
 type TaskStatus = 'pending' | 'processing' | 'success' | 'failed';
 
+// WebSocket 在线时任务进度由服务端推送，轮询只作为漏收推送时的兜底；断线时退回到快速轮询
+const PUSH_FALLBACK_INTERVAL = 15000;
+const POLL_INTERVAL = 2000;
+
 export interface Task {
   id: string;
   type: string;
@@ -36,55 +41,97 @@ export const useTaskStore = defineStore('task', () => {
   }
 
 
+  const { status: wsStatus, onMessage } = useWebSocket();
+  // 等待某个任务结束的 pollTaskResult 调用，收到推送时唤醒
+  const waiters: Record<string, Array<(task: TaskStatusResponse) => void>> = {};
+
+  function isFinished(status: string) {
+    return status === 'success' || status === 'failed';
+  }
+
+  function applyTaskUpdate(updatedTask: TaskStatusResponse) {
+    const existingTask = tasks.value[updatedTask.id];
+    if (existingTask && !isFinished(existingTask.status)) {
+      Object.assign(existingTask, updatedTask);
+      if (isFinished(updatedTask.status)) {
+        if (updatedTask.status === 'success') {
+          if (!settingsStore) settingsStore = useSettingsStore();
+
+          if (updatedTask.task_type === 'upload_avatar' || updatedTask.task_type === 'upload_character_image') {
+              console.log(`[TaskStore] Image upload task ${updatedTask.id} succeeded. Invalidating all data queries.`);
+              invalidateAllData();
+          }
+        }
+        setTimeout(() => dismissTask(updatedTask.id), 10000);
+      }
+    }
+    const pending = waiters[updatedTask.id];
+    if (pending) pending.forEach(wake => wake(updatedTask));
+  }
+
+  onMessage('task_update', (task: TaskStatusResponse) => applyTaskUpdate(task));
+
+  function waitForPush(taskId: string, ms: number): Promise<TaskStatusResponse | null> {
+    return new Promise(resolve => {
+      const wake = (task: TaskStatusResponse | null) => {
+        clearTimeout(timer);
+        const list = waiters[taskId] || [];
+        const index = list.indexOf(wake);
+        if (index > -1) list.splice(index, 1);
+        if (list.length === 0) delete waiters[taskId];
+        resolve(task);
+      };
+      const timer = setTimeout(() => wake(null), ms);
+      (waiters[taskId] ||= []).push(wake);
+    });
+  }
+
   async function pollTaskResult(taskId: string, timeout = 120000): Promise<TaskStatusResponse> {
     const startTime = Date.now();
     while (Date.now() - startTime < timeout) {
+        let task: TaskStatusResponse;
         try {
-            const task = await apiService.getTaskStatus(taskId);
-            if (task.status === 'success' || task.status === 'failed') {
-                return task;
-            }
-            await new Promise(resolve => setTimeout(resolve, 2000));
+            task = await apiService.getTaskStatus(taskId);
         } catch (error) {
             throw new Error(`轮询任务状态失败: ${error}`);
         }
+        // 推送的进度只是中间状态，直到收到终态才返回
+        while (!isFinished(task.status) && Date.now() - startTime < timeout) {
+            const interval = wsStatus.value === 'connected' ? PUSH_FALLBACK_INTERVAL : POLL_INTERVAL;
+            const pushed = await waitForPush(taskId, Math.min(interval, timeout - (Date.now() - startTime)));
+            if (!pushed) break;
+            task = pushed;
+        }
+        if (isFinished(task.status)) {
+            return task;
+        }
     }
     throw new Error('任务超时');
   }
 
+  let pollTicks = 0;
+
   function startPolling() {
       if (pollInterval.value) return;
       pollInterval.value = window.setInterval(async () => {
           const activeTasks = Object.values(tasks.value).filter(t => ['pending', 'processing'].includes(t.status));
-          if (activeTasks.length > 0) {
-              for (const task of activeTasks) {
-                  try {
-                      const updatedTask = await apiService.getTaskStatus(task.id);
-                      const existingTask = tasks.value[task.id];
-                      if (existingTask) {
-                          Object.assign(existingTask, updatedTask);
-                          if (['success', 'failed'].includes(updatedTask.status)) {
-                              if (updatedTask.status === 'success') {
-                                if (!settingsStore) settingsStore = useSettingsStore();
-                                
-                                if (updatedTask.task_type === 'upload_avatar' || updatedTask.task_type === 'upload_character_image') {
-                                    console.log(`[TaskStore] Image upload task ${updatedTask.id} succeeded. Invalidating all data queries.`);
-                                    invalidateAllData();
-                                }
-                              }
-                              setTimeout(() => dismissTask(updatedTask.id), 10000);
-                          }
-                      }
-                  } catch (e) {
-                      console.error(`Failed to poll task ${task.id}`, e);
-                      const existingTask = tasks.value[task.id];
-                      if (existingTask) {
-                        existingTask.status = 'failed';
-                      }
+          if (activeTasks.length === 0) {
+              stopPolling();
+              return;
+          }
+          // [优化] WebSocket 在线时进度由 task_update 推送更新，只偶尔轮询一次兜底
+          pollTicks += 1;
+          if (wsStatus.value === 'connected' && pollTicks % 5 !== 0) return;
+          for (const task of activeTasks) {
+              try {
+                  applyTaskUpdate(await apiService.getTaskStatus(task.id));
+              } catch (e) {
+                  console.error(`Failed to poll task ${task.id}`, e);
+                  const existingTask = tasks.value[task.id];
+                  if (existingTask) {
+                    existingTask.status = 'failed';
                   }
               }
-          } else {
-              stopPolling();
           }
       }, 3000);
   }
@@ -112,6 +159,15 @@ export const useTaskStore = defineStore('task', () => {
     }
   }
 
+  async function cancelTask(taskId: string) {
+    try {
+      if (!settingsStore) settingsStore = useSettingsStore();
+      await apiService.cancelTask(settingsStore.userId, taskId);
+    } catch (e) {
+      console.error(`Failed to cancel task ${taskId}`, e);
+    }
+  }
+
   function dismissTask(taskId: string) {
     if (tasks.value[taskId]) {
       delete tasks.value[taskId];
@@ -122,6 +178,7 @@ export const useTaskStore = defineStore('task', () => {
     tasks,
     addTask,
     dismissTask,
+    cancelTask,
     pollTaskResult,
   };
 });
\ No newline at end of file
@@ -82,22 +82,11 @@ export const useTtsStore = defineStore('tts', () => {
     }
 
     async function pollTaskResult(taskId: string, timeout = 300000) {
-        const startTime = Date.now();
-        while (Date.now() - startTime < timeout) {
-            try {
-                const task = await apiService.getTaskStatus(taskId);
-                if (task.status === 'success') {
-                    return task.result;
-                }
-                if (task.status === 'failed') {
-                    throw new Error(task.error?.error || '任务执行失败');
-                }
-                await new Promise(resolve => setTimeout(resolve, 2000));
-            } catch (error) {
-                throw new Error(`轮询任务状态失败: ${error}`);
-            }
+        const task = await taskStore.pollTaskResult(taskId, timeout);
+        if (task.status === 'failed') {
+            throw new Error(task.error?.error || '任务执行失败');
         }
-        throw new Error('任务超时');
+        return task.result;
     }
 
     function setupAudioListeners() {
@@ -397,6 +397,28 @@ export interface PaginatedData<T> {
 }
 
 
+export interface BatchUpsertItem {
+  data_type: 'character' | 'preset' | 'world_info' | 'group';
+  filename: Filename;
+  data: Record<string, any>;
+}
+
+export interface BatchUpsertResult {
+  data_type: BatchUpsertItem['data_type'];
+  filename: Filename;
+  status: 'inserted' | 'updated' | 'skipped' | 'failed';
+  error?: string;
+}
+
+export interface BatchUpsertResponse {
+  status: 'success' | 'partial';
+  inserted: number;
+  updated: number;
+  skipped: number;
+  failed: number;
+  results: BatchUpsertResult[];
+}
+
 export type BackendCharacter = Omit<Character, 'filename'>;
 export type BackendWorldInfo = Omit<WorldInfo, 'filename'>;
 export type BackendPreset = Omit<Preset, 'filename'>;
@@ -423,6 +445,7 @@ export interface BootstrapResponse {
   public_presets: Record<Filename, BackendPreset>;
   public_world_info: Record<Filename, BackendWorldInfo>;
   public_groups: Record<Filename, BackendGroup>;
+  public_catalog?: { version: string; url: string };
   user_info?: UserInfo;
 }
 
@@ -432,12 +455,23 @@ export interface CheckModelsResponse {
   error: string | null;
 }
 
-export interface TokenUsageStatsResponse {
+export interface TokenUsageWindows {
   hourly: number;
   daily: number;
   monthly: number;
 }
 
+export interface TokenUsageBreakdown extends TokenUsageWindows {
+  requests: number;
+  prompt_tokens: number;
+  candidates_tokens: number;
+}
+
+export interface TokenUsageStatsResponse extends TokenUsageWindows {
+  by_model?: (TokenUsageBreakdown & { model: string })[];
+  by_key?: (TokenUsageBreakdown & { key_id: string; key_name: string | null })[];
+}
+
 export interface TaskStatusResponse {
     id: string;
     user_id: string;